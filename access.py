@@ -0,0 +1,64 @@
+import os
+
+# Роли по возрастанию прав: viewer смотрит состояние, operator выполняет
+# команды, admin еще перезагружает сервер, перезапускает контейнеры и меняет пароль
+VIEWER, OPERATOR, ADMIN = 'viewer', 'operator', 'admin'
+ROLES = (VIEWER, OPERATOR, ADMIN)
+
+
+def parse_users(value):
+    """Parse "123456:admin,654321" into {user_id: role}; the role defaults to operator.
+
+    Raises ValueError on an invalid entry.
+    """
+    users = {}
+    for spec in (value or '').split(','):
+        if not spec.strip():
+            continue
+        user_id, _, role = spec.strip().partition(':')
+        role = role.strip().lower() or OPERATOR
+        if not user_id.strip().lstrip('-').isdigit() or role not in ROLES:
+            raise ValueError(f"Invalid AUTHORIZED_USERS entry: {spec.strip()!r}")
+        users[int(user_id)] = role
+    return users
+
+
+class Access:
+    """Telegram users allowed to use the bot, by numeric ID, with roles.
+
+    username is the older single-user setting (AUTHORIZED_USER) and is an
+    admin. With neither set the bot is open and everyone is an admin.
+    """
+
+    def __init__(self, users=None, username=None):
+        self.users = users or {}
+        self.username = username or None
+
+    @classmethod
+    def from_env(cls):
+        return cls(parse_users(os.getenv('AUTHORIZED_USERS')), os.getenv('AUTHORIZED_USER'))
+
+    @property
+    def open(self):
+        return not self.users and not self.username
+
+    def role(self, user):
+        """Role of a telegram.User, or None if they have no access"""
+        if self.open:
+            return ADMIN
+        if user is None:
+            return None
+        if user.id in self.users:
+            return self.users[user.id]
+        if self.username and user.username == self.username:
+            return ADMIN
+        return None
+
+    def admin_ids(self):
+        """Telegram IDs of the users with the admin role"""
+        return [user_id for user_id, role in self.users.items() if role == ADMIN]
+
+    def allows(self, user, role=OPERATOR):
+        """Whether user has role or a higher one"""
+        granted = self.role(user)
+        return granted is not None and ROLES.index(granted) >= ROLES.index(role)
@@ -0,0 +1,216 @@
+import logging
+import os
+import re
+from collections import namedtuple
+from threading import Lock
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import env_float
+from metrics_sampler import METRICS, format_value, parse_window
+
+DEFAULT_RULES = "disk > 90% for 5m; mem > 90% for 5m; load1 > ncpu*2 for 10m"
+# Тревога снимается, только когда значение отойдет от порога на эту долю,
+# иначе метрика около порога дает поток уведомлений
+HYSTERESIS = env_float('ALERT_HYSTERESIS', 0.05)
+
+Rule = namedtuple('Rule', ['text', 'metric', 'operator', 'threshold', 'per_cpu', 'duration'])
+Alert = namedtuple('Alert', ['rule', 'value', 'threshold', 'firing', 'hostname'])
+
+RULE_PATTERN = re.compile(
+    r'(?P<metric>[a-z0-9]+(?::[^\s<>]+)?)\s*(?P<operator>[<>]=?)\s*'
+    r'(?P<per_cpu>ncpu\s*(?:\*\s*)?)?(?P<value>\d+(?:\.\d+)?)?\s*%?'
+    r'(?:\s+for\s+(?P<duration>\S+))?',
+    re.IGNORECASE
+)
+LOAD_METRICS = ('load1', 'load5', 'load15')
+
+# Действие -> (надпись кнопки, команда на сервере)
+ACTIONS = {
+    'top_cpu': ("📋 Топ по CPU", "ps aux --sort=-%cpu | head -15"),
+    'top_mem': ("📋 Топ по памяти", "ps aux --sort=-%mem | head -15"),
+    'disk_usage': ("📂 Крупные каталоги", "du -xh --max-depth=2 / 2>/dev/null | sort -rh | head -20"),
+    'docker_prune': ("🧹 Очистить Docker", "docker system prune -f"),
+    'journal_vacuum': ("🗜 Сжать журналы", "journalctl --vacuum-size=200M"),
+}
+# Действия, удаляющие данные: только администратору и после подтверждения
+DESTRUCTIVE_ACTIONS = {'docker_prune', 'journal_vacuum'}
+# Какие действия предлагать для метрики
+METRIC_ACTIONS = {
+    'disk': ['disk_usage', 'docker_prune', 'journal_vacuum'],
+    'mem': ['top_mem'],
+    'swap': ['top_mem'],
+    'cpu': ['top_cpu'],
+    'load': ['top_cpu', 'top_mem'],
+}
+
+
+def parse_rule(text):
+    """Parse e.g. "disk:/ > 90% for 5m" or "load1 > ncpu*2"; raises ValueError"""
+    match = RULE_PATTERN.fullmatch(text.strip())
+    if not match or not (match['per_cpu'] or match['value']):
+        raise ValueError(f"Invalid alert rule: {text!r}")
+
+    # Регистр важен только в пути точки монтирования
+    name, separator, path = match['metric'].partition(':')
+    metric = name.lower() + separator + path
+    if metric == 'load':
+        metric = 'load1'
+    if metric not in LOAD_METRICS and metric not in METRICS and not metric.startswith('disk:'):
+        raise ValueError(f"Unknown metric in alert rule: {text!r}")
+
+    duration = 0
+    if match['duration']:
+        duration = parse_window(match['duration'])
+        if duration is None:
+            raise ValueError(f"Invalid duration in alert rule: {text!r}")
+
+    return Rule(
+        text=text.strip(),
+        metric=metric,
+        operator=match['operator'],
+        threshold=float(match['value'] or 1),
+        per_cpu=bool(match['per_cpu']),
+        duration=duration,
+    )
+
+
+def parse_rules(value):
+    """Rules separated by ";"; raises ValueError on the first invalid one"""
+    return [parse_rule(spec) for spec in (value or '').split(';') if spec.strip()]
+
+
+def _compare(operator, value, threshold):
+    if operator == '>':
+        return value > threshold
+    if operator == '>=':
+        return value >= threshold
+    if operator == '<':
+        return value < threshold
+    return value <= threshold
+
+
+def metric_value(metric, snapshot, values):
+    """Value of a rule metric in a sample, None if the sample lacks it"""
+    if metric.startswith('disk:'):
+        path = metric[len('disk:'):]
+        for mount in snapshot.mounts:
+            if mount.mount_point == path:
+                return 100.0 * mount.used / mount.total
+        return None
+    if metric in LOAD_METRICS:
+        return snapshot.load[LOAD_METRICS.index(metric)]
+    return values.get(metric)
+
+
+class _RuleState:
+    __slots__ = ('breached_since', 'firing', 'value')
+
+    def __init__(self):
+        self.breached_since = None
+        self.firing = False
+        self.value = None
+
+
+class AlertEngine:
+    """Evaluates threshold rules against each metric sample.
+
+    A rule fires once its condition has held for the rule's duration and
+    is reported once; it resolves when the value moves back past the
+    threshold by HYSTERESIS, which is reported once as well. Everything is
+    computed locally from samples the MetricsSampler already collects.
+    """
+
+    def __init__(self, rules, notify, hysteresis=HYSTERESIS):
+        self.rules = rules
+        self.notify = notify
+        self.hysteresis = hysteresis
+        self.states = [_RuleState() for _ in rules]
+        self.lock = Lock()
+        self.logger = logging.getLogger(__name__)
+
+    @classmethod
+    def from_env(cls, notify):
+        return cls(parse_rules(os.getenv('ALERT_RULES', DEFAULT_RULES)), notify)
+
+    def evaluate(self, snapshot, values):
+        """Update rule states with a sample and notify about changes"""
+        alerts = []
+        with self.lock:
+            for rule, state in zip(self.rules, self.states):
+                alert = self._evaluate_rule(rule, state, snapshot, values)
+                if alert is not None:
+                    alerts.append(alert)
+
+        for alert in alerts:
+            try:
+                self.notify(alert)
+            except Exception as e:
+                self.logger.error(f"Could not send alert {alert.rule.text!r}: {str(e)}")
+
+    def _evaluate_rule(self, rule, state, snapshot, values):
+        value = metric_value(rule.metric, snapshot, values)
+        if value is None:
+            return None
+        state.value = value
+        threshold = rule.threshold * (snapshot.cpu_count if rule.per_cpu else 1)
+
+        if state.firing:
+            margin = threshold * self.hysteresis
+            clear_threshold = threshold - margin if rule.operator.startswith('>') else threshold + margin
+            if _compare(rule.operator, value, clear_threshold):
+                return None
+            state.firing = False
+            state.breached_since = None
+            return Alert(rule, value, threshold, False, snapshot.hostname)
+
+        if not _compare(rule.operator, value, threshold):
+            state.breached_since = None
+            return None
+        if state.breached_since is None:
+            state.breached_since = snapshot.taken_at
+        if snapshot.taken_at - state.breached_since < rule.duration:
+            return None
+        state.firing = True
+        return Alert(rule, value, threshold, True, snapshot.hostname)
+
+    def status(self):
+        """(rule, firing, last value) for every rule"""
+        with self.lock:
+            return [(rule, state.firing, state.value) for rule, state in zip(self.rules, self.states)]
+
+
+def format_metric_value(metric, value):
+    unit = "" if metric in LOAD_METRICS else METRICS[metric.split(':')[0]][1]
+    return format_value(value, unit)
+
+
+def format_alert(alert):
+    value = format_metric_value(alert.rule.metric, alert.value)
+    if alert.firing:
+        return (
+            f"🚨 *Тревога* на `{alert.hostname}`\n"
+            f"`{alert.rule.text}`\n"
+            f"Сейчас: {value} (порог {alert.threshold:g})"
+        )
+    return f"✅ *Норма* на `{alert.hostname}`\n`{alert.rule.text}`\nСейчас: {value}"
+
+
+def alert_keyboard(alert):
+    """Inline buttons with remediation commands for a firing alert"""
+    if not alert.firing:
+        return None
+    metric = alert.rule.metric.split(':')[0]
+    actions = METRIC_ACTIONS.get('load' if metric in LOAD_METRICS else metric, [])
+    if not actions:
+        return None
+    buttons = [InlineKeyboardButton(ACTIONS[action][0], callback_data=f"alert_{action}") for action in actions]
+    return InlineKeyboardMarkup([buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+
+
+def confirm_keyboard(action):
+    """Confirm/cancel buttons for a destructive alert action"""
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("✅ Да, выполнить", callback_data=f"alert_confirm_{action}"),
+        InlineKeyboardButton("❌ Отмена", callback_data="alert_cancel"),
+    ]])
@@ -0,0 +1,500 @@
+"""End-to-end benchmark of the bot against local stand-ins for the SSH server and Bot API.
+
+Usage: python benchmarks/bench_e2e.py [options] [--output result.json] [--baseline old.json]
+
+The real bot.py runs as a child process, pointed at two stand-ins:
+
+- an in-process paramiko server whose scripted shell and exec understand
+  "bench <bytes> <delay_ms> <id>": it waits delay_ms, then prints <bytes>
+  of log lines and a "bench-done-<id>" line;
+- a fake Bot API that feeds updates to getUpdates and records replies.
+
+A command's round trip runs from the moment its update is handed to
+getUpdates until its full output is visible in the chat. For inline output
+that is the message containing the done line; for long output it is the
+uploaded document. Telegram rate limits are lifted by default, so the
+numbers measure the bot rather than the send queue's pacing. Other
+settings are inherited from the environment, e.g. SSH_SHELL_BUFFER_BYTES.
+
+Results are printed as JSON. With --baseline the script also prints the
+change of every metric against an earlier run.
+"""
+import argparse
+import json
+import os
+import re
+import resource
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import paramiko
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO)
+
+from delivery import INLINE_LIMIT
+from ssh_manager import BEGIN_MARKER, END_MARKER
+
+TOKEN = '123456:bench'
+REPLY_TIMEOUT = 120
+BENCH_COMMAND = re.compile(r'bench (\d+) (\d+) (\w+)')
+BEGIN_COMMAND = re.compile(re.escape(BEGIN_MARKER) + r' (\w+)')
+END_COMMAND = re.compile(re.escape(END_MARKER) + r' (\w+)')
+
+
+def done_line(command_id):
+    return f"bench-done-{command_id}"
+
+
+def bench_output(size, command_id):
+    """size bytes of log-like lines followed by the done line"""
+    line = b"2024-01-01 12:00:00 INFO worker[42]: processed request in 12 ms, status=200\n"
+    body = line * (size // len(line)) + line[:size % len(line)]
+    if body and not body.endswith(b"\n"):
+        body += b"\n"
+    return body + done_line(command_id).encode() + b"\n"
+
+
+def run_script(command, send):
+    """Run a line of the scripted shell; returns its exit status"""
+    match = BENCH_COMMAND.search(command)
+    if match:
+        size, delay, command_id = match.groups()
+        time.sleep(int(delay) / 1000)
+        data = bench_output(int(size), command_id)
+        for offset in range(0, len(data), 32768):
+            send(data[offset:offset + 32768])
+        return 0
+    if command.strip() == 'hostname':
+        send(b"bench-host\n")
+        return 0
+    send(f"sh: {command.split()[0] if command.split() else ''}: not found\n".encode())
+    return 127
+
+
+# --- SSH stand-in ---
+
+class ScriptedServer(paramiko.ServerInterface):
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_window_change_request(self, channel, width, height, pixelwidth, pixelheight):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=self._shell, args=(channel,), daemon=True).start()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._exec, args=(channel, command.decode()), daemon=True).start()
+        return True
+
+    @staticmethod
+    def _shell(channel):
+        """Line-by-line shell: no echo, markers answered like printf would.
+
+        A command arrives as one line "<begin printf>; eval '<command>'; <end printf>".
+        """
+        status = 0
+        pending = b''
+        while True:
+            data = channel.recv(65536)
+            if not data:
+                break
+            *lines, pending = (pending + data).split(b'\n')
+            for line in lines:
+                line = line.decode('utf-8', errors='replace')
+                if line.startswith('stty '):
+                    continue
+                lexer = shlex.shlex(line, posix=True, punctuation_chars=';')
+                lexer.whitespace_split = True
+                statements = [[]]
+                for token in lexer:
+                    if token == ';':
+                        statements.append([])
+                    else:
+                        statements[-1].append(token)
+                for statement in filter(None, statements):
+                    text = ' '.join(statement)
+                    begin = BEGIN_COMMAND.search(text)
+                    end = END_COMMAND.search(text)
+                    if begin:
+                        channel.sendall(f"{BEGIN_MARKER}:{begin.group(1)}\n".encode())
+                    elif end:
+                        channel.sendall(f"\n{END_MARKER}:{end.group(1)}:{status}:/root\n".encode())
+                    else:
+                        status = run_script(' '.join(statement[1:]) if statement[0] == 'eval' else text, channel.sendall)
+        channel.close()
+
+    @staticmethod
+    def _exec(channel, command):
+        channel.send_exit_status(run_script(command, channel.sendall))
+        # Как у sshd, за кодом завершения сразу идет EOF. Закрыть канал сразу
+        # нельзя: подтверждение exec поток транспорта отправляет уже после
+        # этого обработчика, а канал, закрытый раньше, клиент считает ошибкой
+        channel.shutdown_write()
+        threading.Timer(1, channel.close).start()
+
+
+def start_ssh_server():
+    host_key = paramiko.RSAKey.generate(2048)
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(16)
+
+    def serve():
+        while True:
+            client, _ = sock.accept()
+            # Как sshd для интерактивных сессий
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = paramiko.Transport(client)
+            transport.add_server_key(host_key)
+            transport.start_server(server=ScriptedServer())
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+# --- Bot API stand-in ---
+
+class FakeBotApi:
+    """Serves getUpdates from a queue and passes every reply to on_reply(chat_id, method, text)"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.updates = []
+        self.condition = threading.Condition()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.polled = threading.Event()
+        self.on_reply = None
+        self.calls = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def push_message(self, chat_id, text):
+        """Queue a message from user chat_id"""
+        message = {
+            'message_id': 0, 'date': int(time.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'bench', 'username': 'bench'},
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        with self.condition:
+            message['message_id'] = self._message_id()
+            self.updates.append({'update_id': self.next_update_id, 'message': message})
+            self.next_update_id += 1
+            self.condition.notify_all()
+
+    def _message_id(self):
+        self.next_message_id += 1
+        return self.next_message_id
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        # Длинный опрос короче настоящего, чтобы бот быстро останавливался
+        deadline = time.monotonic() + min(float(params.get('timeout') or 0), 1.0)
+        self.polled.set()
+        with self.condition:
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return list(self.updates)
+
+    def _reply(self, method, params, body):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getUpdates':
+            return self._get_updates(params)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        if method not in ('sendMessage', 'editMessageText', 'sendDocument'):
+            return True
+
+        if self.latency:
+            time.sleep(self.latency)
+        if method == 'sendDocument':
+            chat_id = int(re.search(rb'name="chat_id"\r\n\r\n(-?\d+)', body).group(1))
+            filename = re.search(rb'filename="([^"]*)"', body)
+            text = filename.group(1).decode() if filename else ''
+        else:
+            chat_id = int(params['chat_id'])
+            text = params.get('text', '')
+        with self.condition:
+            message_id = int(params.get('message_id') or 0) or self._message_id()
+        if self.on_reply:
+            self.on_reply(chat_id, method, text)
+        return {
+            'message_id': message_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Заголовки и тело уходят отдельными записями: без этого Nagle
+            # и отложенный ACK добавляют к каждому ответу 40 мс
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                method = self.path.rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                params = json.loads(body) if self.headers.get('Content-Type', '').startswith('application/json') else {}
+                result = api._reply(method, params, body)
+                data = json.dumps({'ok': True, 'result': result}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+# --- Driver ---
+
+class Driver:
+    """Sends commands as users and waits for their replies"""
+
+    def __init__(self, api):
+        self.api = api
+        self.api.on_reply = self._on_reply
+        # чат -> (признак ответа, событие)
+        self.waiting = {}
+        self.lock = threading.Lock()
+        self.sequence = 0
+
+    def _on_reply(self, chat_id, method, text):
+        with self.lock:
+            expected = self.waiting.get(chat_id)
+        if expected and expected[0](method, text):
+            expected[1].set()
+
+    def request(self, chat_id, text, matches):
+        """Send text from chat_id and wait until a reply satisfies matches; returns seconds"""
+        event = threading.Event()
+        with self.lock:
+            self.waiting[chat_id] = (matches, event)
+        started = time.perf_counter()
+        self.api.push_message(chat_id, text)
+        if not event.wait(REPLY_TIMEOUT):
+            raise TimeoutError(f"No reply to {text!r} in chat {chat_id}")
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.waiting.pop(chat_id, None)
+        return elapsed
+
+    def open_terminal(self, chat_id):
+        return self.request(chat_id, '/terminal', lambda method, text: 'Терминал запущен' in text)
+
+    def bench(self, chat_id, size, delay, prefix=''):
+        """Round trip of one bench command in seconds"""
+        with self.lock:
+            self.sequence += 1
+            command_id = f"{self.sequence:06d}"
+        command = f"{prefix}bench {size} {delay} {command_id}"
+        if prefix or size <= INLINE_LIMIT:
+            # /cmd всегда отвечает сообщением, хвост вывода в нем сохраняется
+            matches = lambda method, text: method != 'sendDocument' and done_line(command_id) in text
+        else:
+            matches = lambda method, text: method == 'sendDocument' and command_id in text
+        return self.request(chat_id, command, matches)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def latency_summary(seconds):
+    return {
+        'count': len(seconds),
+        'p50_ms': round(percentile(seconds, 0.5) * 1000, 2),
+        'p99_ms': round(percentile(seconds, 0.99) * 1000, 2),
+        'mean_ms': round(sum(seconds) / len(seconds) * 1000, 2),
+    }
+
+
+def run_concurrent(driver, chats, commands, size, delay):
+    samples = []
+    errors = []
+
+    def user(chat_id):
+        try:
+            for _ in range(commands):
+                samples.append(driver.bench(chat_id, size, delay))
+        except Exception as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=user, args=(chat_id,)) for chat_id in chats]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if errors:
+        raise RuntimeError(errors[0])
+    return dict(
+        latency_summary(samples), chats=len(chats), seconds=round(elapsed, 3),
+        commands_per_s=round(len(samples) / elapsed, 1)
+    )
+
+
+def run_benchmark(args):
+    ssh_port = start_ssh_server()
+    api = FakeBotApi(latency=args.api_latency / 1000)
+    api.start()
+    driver = Driver(api)
+
+    workdir = tempfile.mkdtemp(prefix='bench-e2e-')
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN=TOKEN, TELEGRAM_API_URL=api.url, AUTHORIZED_USER='',
+        SERVER_IP='127.0.0.1', SSH_PORT=str(ssh_port), SSH_USERNAME='bench', SSH_PASSWORD='bench',
+        SEND_CHAT_RATE=str(args.chat_rate), SEND_GLOBAL_RATE=str(args.global_rate),
+        METRICS_INTERVAL='0', HOST_GROUPS='', TRANSCRIPT_DIR=os.path.join(workdir, 'transcripts'),
+    )
+    log = open(os.path.join(workdir, 'bot.log'), 'w')
+    bot = subprocess.Popen([sys.executable, os.path.join(REPO, 'bot.py')], cwd=workdir, env=env, stdout=log, stderr=log)
+    results = {}
+    try:
+        if not api.polled.wait(30):
+            raise RuntimeError(f"Bot did not start polling, see {log.name}")
+
+        chats = list(range(1001, 1001 + max(args.chats, 1)))
+        for chat_id in chats:
+            driver.open_terminal(chat_id)
+
+        print(f"latency: {args.commands} commands of {args.size} bytes", file=sys.stderr)
+        # Прогрев: первое соединение, импорты и пулы потоков не должны попасть в замеры
+        driver.bench(chats[0], args.size, args.delay)
+        samples = [driver.bench(chats[0], args.size, args.delay) for _ in range(args.commands)]
+        results['terminal_latency'] = latency_summary(samples)
+
+        samples = [driver.bench(chats[0], args.size, args.delay, prefix='/cmd ') for _ in range(args.commands)]
+        results['cmd_latency'] = latency_summary(samples)
+
+        print(f"concurrency: {args.chats} chats x {args.commands} commands", file=sys.stderr)
+        results['concurrent'] = run_concurrent(driver, chats, args.commands, args.size, args.delay)
+
+        print(f"large output: {args.large_count} x {args.large_size} bytes", file=sys.stderr)
+        samples = [driver.bench(chats[0], args.large_size, 0) for _ in range(args.large_count)]
+        results['large_output'] = {
+            'bytes': args.large_size, 'count': len(samples),
+            'p50_ms': round(percentile(samples, 0.5) * 1000, 1),
+            'bytes_per_s': round(args.large_size * len(samples) / sum(samples)),
+        }
+    finally:
+        bot.send_signal(signal.SIGINT)
+        try:
+            bot.wait(30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+            bot.wait()
+        api.stop()
+        log.close()
+
+    # ru_maxrss дочерних процессов - в КБ на Linux и в байтах на macOS
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    results['peak_rss_bytes'] = peak if sys.platform == 'darwin' else peak * 1024
+    results['api_calls'] = api.calls
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def flatten(results, prefix=''):
+    values = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)):
+            values[prefix + name] = value
+    return values
+
+
+def compare(baseline, report):
+    old = flatten(baseline['results'])
+    new = flatten(report['results'])
+    print(f"{'metric':<36} {baseline.get('commit') or 'baseline':>14} {report.get('commit') or 'current':>14} {'change':>8}")
+    for name in sorted(old.keys() & new.keys()):
+        change = f"{(new[name] - old[name]) / old[name] * 100:+.1f}%" if old[name] else ""
+        print(f"{name:<36} {old[name]:>14} {new[name]:>14} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--commands', type=int, default=200, help="commands per latency run and per chat")
+    parser.add_argument('--chats', type=int, default=8, help="concurrent chats")
+    parser.add_argument('--size', type=int, default=512, help="output bytes of an ordinary command")
+    parser.add_argument('--delay', type=int, default=0, help="server-side run time of a command, ms")
+    parser.add_argument('--large-size', type=int, default=8 * 1024 * 1024, help="output bytes of a large command")
+    parser.add_argument('--large-count', type=int, default=3)
+    parser.add_argument('--api-latency', type=float, default=0, help="Bot API response time, ms")
+    parser.add_argument('--chat-rate', type=float, default=1000, help="SEND_CHAT_RATE for the bot")
+    parser.add_argument('--global-rate', type=float, default=1000, help="SEND_GLOBAL_RATE for the bot")
+    parser.add_argument('--output', help="also write the JSON report to this file")
+    parser.add_argument('--baseline', help="JSON report of an earlier run to compare with")
+    args = parser.parse_args()
+
+    report = {
+        'commit': current_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': sys.version.split()[0],
+        'params': {name: value for name, value in vars(args).items() if name not in ('output', 'baseline')},
+        'results': run_benchmark(args),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
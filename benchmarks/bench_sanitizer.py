@@ -0,0 +1,92 @@
+"""Micro-benchmark for sanitizer.py on large captured-like terminal output.
+
+Usage: python benchmarks/bench_sanitizer.py [size_mb] [input_file]
+
+Without input_file a synthetic build log is generated: coloured log lines,
+progress bars redrawn with \\r, Cyrillic text and bracketed-paste codes.
+The legacy per-line re.sub cleaning is timed alongside for comparison.
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sanitizer import sanitize, sanitize_bytes, TerminalSanitizer
+
+
+def make_log(size):
+    random.seed(0)
+    lines = [
+        "\x1b[32mINFO\x1b[0m [builder] Step {n}/120 : RUN pip install -r requirements.txt\r\n",
+        "\x1b[1;31mERROR\x1b[0m сборка образа завершилась с ошибкой на шаге {n}\r\n",
+        " ---> Running in 3f2a{n:x}c1d9e0\r\n",
+        "Downloading layer {n}: " + "".join(f"[{'#' * i}{' ' * (20 - i)}] {i * 5}%\r" for i in range(0, 21, 4)) + "\r\n",
+        "\x1b[?2004h\x1b]0;root@host: ~\x07root@host:~# \x1b[?2004l\r\n",
+        "plain output line number {n} with some text\tand a tab\r\n",
+    ]
+    parts = []
+    total = 0
+    n = 0
+    while total < size:
+        line = random.choice(lines).format(n=n)
+        parts.append(line)
+        total += len(line)
+        n += 1
+    return "".join(parts)
+
+
+def legacy_clean(text):
+    """The cleaning previously duplicated in bot.py and ssh_manager.py"""
+    processed_lines = []
+    for line in text.splitlines():
+        line = re.sub(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])', '', line)
+        line = re.sub(r'\[\?2004[lh]', '', line)
+        line = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', line)
+        if line.strip():
+            processed_lines.append(line)
+    return "\n".join(processed_lines)
+
+
+def measure(name, func, text, repeat=3):
+    best = min(_timed(func, text) for _ in range(repeat))
+    mb_per_s = len(text) / best / 1024 / 1024
+    print(f"{name:<28} {best * 1000:9.1f} ms {mb_per_s:9.1f} MB/s")
+    return best
+
+
+def _timed(func, text):
+    start = time.perf_counter()
+    func(text)
+    return time.perf_counter() - start
+
+
+def incremental(data, chunk_size=32768):
+    sanitizer = TerminalSanitizer(drop_blank_lines=True)
+    out = [sanitizer.feed(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size)]
+    out.append(sanitizer.flush())
+    return "".join(out)
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], encoding='utf-8', errors='replace') as f:
+            text = f.read()
+    else:
+        text = make_log(int(size_mb * 1024 * 1024))
+
+    data = text.encode('utf-8')
+
+    print(f"input: {len(data) / 1024 / 1024:.1f} MB")
+    measure("legacy per-line re.sub", legacy_clean, text, repeat=1)
+    measure("sanitize(str)", sanitize, text)
+    measure("sanitize_bytes", sanitize_bytes, data)
+    measure("sanitize_bytes(drop_blank)", lambda d: sanitize_bytes(d, True), data)
+    measure("TerminalSanitizer 32K chunks", incremental, data)
+
+
+if __name__ == '__main__':
+    main()
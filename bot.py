@@ -2,11 +2,37 @@ import os
 import logging
 import warnings
 import re
+import time
+from datetime import datetime
+from functools import wraps
+from tempfile import SpooledTemporaryFile
 from dotenv import load_dotenv
 from telegram import Update, ParseMode, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest
+from telegram.utils.helpers import escape_markdown
+from telegram.utils.request import Request
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, ConversationHandler, CallbackQueryHandler
 
+from config import env_int
 from ssh_manager import SSHManager
+from fleet import Fleet, format_results
+from streaming import MessageStreamer
+from sanitizer import sanitize
+from send_queue import QueuedBot, SEND_WORKERS
+from delivery import INLINE_LIMIT, SPOOL_MAX_SIZE, deliver_output, document_name, format_size, send_output_document
+from status_probe import PROBE_SCRIPT, StatusProbe, format_dashboard
+from metrics_sampler import METRICS, MetricsSampler, format_graph, parse_window
+from alerts import ACTIONS, DESTRUCTIVE_ACTIONS, AlertEngine, alert_keyboard, confirm_keyboard, format_alert, format_metric_value
+from result_cache import ResultCache, format_age
+from jobs import JobManager, format_job
+from follow import FollowManager
+from screen import FULLSCREEN_PROGRAMS, KEYS as SCREEN_KEYS, ScreenManager, capture as capture_screen
+from transcript import Transcript
+from dir_browser import DirBrowser
+from transfer import DOWNLOAD_LIMIT, TransferProgress, download, resolve_path, send_file, upload
+from scheduler import FairScheduler, QuotaExceeded, DEFAULT_MAX_WORKERS as HANDLER_WORKERS, USER_QUEUE_LIMIT
+from access import ADMIN, OPERATOR, VIEWER, Access
+from instrumentation import METRICS_ADDRESS, METRICS_PORT, registry as instrumentation, start_server as start_metrics_server
 
 # Игнорируем предупреждения для paramiko и telegram
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -28,32 +54,180 @@ load_dotenv()
 
 # Получение настроек из переменных окружения
 TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-AUTHORIZED_USER = os.getenv('AUTHORIZED_USER')
+# Адрес Bot API; свой сервер telegram-bot-api или заглушка для бенчмарков
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+# Пользователи бота по Telegram ID с ролями (AUTHORIZED_USERS) и прежний AUTHORIZED_USER
+access = Access.from_env()
+# Чат для уведомлений о тревогах; по умолчанию - последний чат администратора
+ALERT_CHAT_ID = os.getenv('ALERT_CHAT_ID')
+# Таймаут для долгих команд с потоковым выводом (пересборка контейнеров и т.п.)
+LONG_COMMAND_TIMEOUT = env_int('SSH_LONG_COMMAND_TIMEOUT', 1800)
+# Сколько байт вывода /cmd помещается в одно сообщение
+CMD_MAX_OUTPUT = 3500
+# Сколько секунд /status и кнопки терминала показывают сохраненный результат
+STATUS_CACHE_TTL = 10
+QUICK_COMMAND_TTLS = {
+    "ps": 5,
+    "top": 5,
+    "free": 10,
+    "uptime": 30,
+    "w": 30,
+    "df": 60,
+    "netstat": 60,
+    "ifconfig": 300,
+}
+# Кнопки терминала, чей снимок снимается через модель экрана (см. screen.capture)
+SCREEN_QUICK_COMMANDS = {"htop"}
 
 if not TELEGRAM_TOKEN:
     raise ValueError("TELEGRAM_TOKEN environment variable is not set")
 
-if not AUTHORIZED_USER:
-    logger.warning("AUTHORIZED_USER is not set. Bot will be accessible to anyone.")
+if access.open:
+    logger.warning("AUTHORIZED_USERS is not set. Bot will be accessible to anyone.")
 
-# Инициализация SSH менеджера
+# Инициализация SSH менеджера (терминальные сессии хранятся в нем по chat_id)
 ssh_manager = SSHManager()
 
-# Словарь активных терминальных сессий по chat_id
-active_sessions = {}
+# Группы хостов для рассылки команд (HOST_GROUPS), учетные данные общие с ssh_manager
+fleet = Fleet.from_env(ssh_manager)
 
-def check_authorization(update: Update) -> bool:
-    """Проверка авторизации пользователя по тегу"""
-    if not AUTHORIZED_USER:
-        return True
+# Снимки состояния сервера для /status (загрузка CPU считается между снимками)
+status_probe = StatusProbe(ssh_manager)
+
+# Результаты /status и кнопок терминала, которые не меняют сервер.
+# Сбрасываются перезапуском контейнеров, перезагрузкой и быстрыми действиями
+result_cache = ResultCache()
+
+# История метрик сервера для /graph (METRICS_INTERVAL, METRICS_HISTORY)
+metrics_sampler = MetricsSampler(ssh_manager)
+
+# Бот, через который отправляются тревоги, и чат администратора для них
+alert_bot = None
+alert_chat_id = int(ALERT_CHAT_ID) if ALERT_CHAT_ID else None
+
+def alert_chats() -> list:
+    """Куда отправлять тревоги: ALERT_CHAT_ID, последний чат администратора
+    или, пока ни один администратор не писал после запуска, им лично по ID"""
+    if alert_chat_id is not None:
+        return [alert_chat_id]
+    return access.admin_ids()
+
+def send_alert(alert) -> None:
+    """Отправка тревоги из потока сборщика метрик"""
+    chats = alert_chats()
+    if alert_bot is None or not chats:
+        logger.warning(f"No chat to send alert to: {alert.rule.text}")
+        return
+    for chat_id in chats:
+        alert_bot.send_message(
+            chat_id=chat_id,
+            text=format_alert(alert),
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=alert_keyboard(alert),
+            wait=False
+        )
+
+def send_job_result(chat_id: int, title: str, output: str) -> None:
+    """Уведомление о завершении фоновой задачи (из потока наблюдателя)"""
+    deliver_output(alert_bot, chat_id, output or "Нет вывода", filename="job_output.txt", title=title)
+
+# Фоновые задачи /job: выполняются на сервере независимо от бота,
+# завершение проверяет один поток для всех задач
+job_manager = JobManager(ssh_manager, send_job_result)
+
+# Журнал выполненных команд и их вывода по чатам (/history, /show)
+transcript = Transcript()
+
+def record_command(chat_id: int, command: str, output: str, exit_status, started: float) -> None:
+    """Запись команды в журнал чата; started - время начала по time.monotonic()"""
+    transcript.record(chat_id, command, output, exit_status, time.monotonic() - started)
+
+# Слежение за логами /follow: по одному на чат, каждое в своем потоке и канале
+follow_manager = FollowManager(ssh_manager)
+
+# Полноэкранные программы (top, less, vim) в живом экране /screen: по одному на чат
+screen_manager = ScreenManager(ssh_manager)
+
+# Просмотр каталогов /ls по SFTP: списки кэшируются, листание их не перечитывает
+dir_browser = DirBrowser(ssh_manager)
+
+# Правила тревог (ALERT_RULES) проверяются локально на каждой точке метрик
+alert_engine = AlertEngine.from_env(send_alert)
+metrics_sampler.add_listener(alert_engine.evaluate)
+
+# Долгие SSH-операции выполняются в фоновом пуле, а не в потоке диспетчера,
+# чтобы Ctrl+C, /status и подтверждения не ждали окончания сборки.
+# Задачи с одним ключом (терминал чата, одиночные команды чата) идут по очереди,
+# а пользователи получают SSH по кругу: поток команд одного не задерживает других
+background = FairScheduler()
+
+def schedule(update: Update, context: CallbackContext, key, func, *args, role: str = OPERATOR):
+    """Постановка задачи в фоновый планировщик от имени пользователя.
+    
+    Пользователь без роли role получает отказ, и задача не занимает очередь.
+    Если задача ждет очереди, пользователь узнает, сколько задач перед ней;
+    сверх квоты задача отклоняется. Возвращает Future или None
+    """
+    chat_id = update.effective_chat.id
+    user = update.effective_user
+    if not check_authorization(update, role):
+        context.bot.send_message(chat_id=chat_id, text="У вас нет доступа к этому боту.", wait=False)
+        return None
+    try:
+        future = background.submit(key, func, *args, user=user.id if user else None, host=ssh_manager.server_ip)
+    except QuotaExceeded:
+        context.bot.send_message(
+            chat_id=chat_id,
+            text=f"⛔ У вас уже {USER_QUEUE_LIMIT} задач в очереди. Дождитесь их выполнения",
+            wait=False
+        )
+        return None
+    
+    ahead = background.position(future)
+    if ahead:
+        context.bot.send_message(chat_id=chat_id, text=f"⏳ Команда в очереди, перед ней: {ahead}", wait=False)
+    return future
+
+def run_in_background(lane: str, role: str = OPERATOR):
+    """Декоратор: обработчик выполняется в фоновом пуле, по очереди в пределах чата.
+    
+    Роль проверяется до постановки в очередь
+    """
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(update: Update, context: CallbackContext) -> None:
+            schedule(update, context, (update.effective_chat.id, lane), handler, update, context, role=role)
+        return wrapper
+    return decorator
+
+def reply(update: Update, context: CallbackContext, text: str, **kwargs):
+    """Ответ в чат update без ожидания отправки; возвращает Future.
     
-    username = update.effective_user.username
-    return username and username == AUTHORIZED_USER
+    Обработчики в потоке диспетчера не должны ждать лимитов Telegram:
+    иначе один чат с паузой RetryAfter задерживает Ctrl+C во всех остальных
+    """
+    return context.bot.send_message(chat_id=update.effective_chat.id, text=text, wait=False, **kwargs)
+
+def edit_reply(query, context: CallbackContext, text: str, **kwargs):
+    """Правка сообщения с кнопкой query без ожидания отправки; возвращает Future"""
+    return context.bot.edit_message_text(
+        text, chat_id=query.message.chat_id, message_id=query.message.message_id, wait=False, **kwargs
+    )
+
+def check_authorization(update: Update, role: str = OPERATOR) -> bool:
+    """Проверка, что у пользователя есть роль role или выше"""
+    global alert_chat_id
+    if not access.allows(update.effective_user, role):
+        return False
+    # Запоминаем чат администратора, чтобы было куда присылать тревоги
+    if not ALERT_CHAT_ID and access.role(update.effective_user) == ADMIN:
+        alert_chat_id = update.effective_chat.id
+    return True
 
 def start(update: Update, context: CallbackContext) -> None:
     """Обработчик команды /start"""
-    if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
+    if not check_authorization(update, VIEWER):
+        reply(update, context, "У вас нет доступа к этому боту.")
         return
     
     # Создаем клавиатуру с кнопками команд
@@ -66,23 +240,34 @@ def start(update: Update, context: CallbackContext) -> None:
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
-    update.message.reply_text(
+    reply(
+        update, context,
         "Привет! Я бот для управления сервером через SSH.\n\n"
         "Доступные команды:\n"
         "/terminal - Запустить интерактивный SSH терминал\n"
         "/cmd <команда> - Выполнить одиночную команду\n"
+        "/fleet <группа> <команда> - Выполнить команду на группе хостов\n"
         "/status - Проверить статус сервера\n"
+        "/graph [метрика] [окно] - График метрики, например /graph cpu 6h\n"
+        "/alerts - Правила тревог и их состояние\n"
+        "/metrics - Время этапов обработки команд и счетчики бота\n"
+        "/job <команда> - Запустить долгую команду в фоне\n"
+        "/jobs - Список фоновых задач\n"
+        "/follow <файл|контейнер|юнит> [шаблон] - Следить за логом\n"
+        "/screen [команда] - Живой экран полноэкранной программы, по умолчанию top\n"
+        "/ls [путь] - Содержимое каталога с листанием и сортировкой\n"
+        "/get <путь> - Скачать файл с сервера\n"
+        "/history [текст] - Выполненные команды\n"
+        "/show <номер> - Сохраненный вывод команды из /history\n"
+        "/put [путь] - Загрузить файл на сервер (ответом на файл или в подписи к нему)\n"
         "/password - Установить пароль для SSH подключения\n"
         "/exit - Выйти из режима терминала\n",
         reply_markup=reply_markup
     )
 
+@run_in_background("exec")
 def connect_command(update: Update, context: CallbackContext) -> None:
     """Обработчик команды /connect"""
-    if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
-        return
-    
     # Проверяем, есть ли пароль
     if not ssh_manager.password:
         update.message.reply_text(
@@ -93,42 +278,48 @@ def connect_command(update: Update, context: CallbackContext) -> None:
     
     message = update.message.reply_text("Подключение к серверу...")
     
-    if ssh_manager.connect():
+    # Живое соединение переиспользуется, оборванное восстанавливается
+    if ssh_manager.ensure_connected():
         message.edit_text(f"✅ Успешно подключено к серверу {ssh_manager.server_ip}")
     else:
         message.edit_text("❌ Не удалось подключиться к серверу. Проверьте настройки и доступность сервера.")
 
 def disconnect_command(update: Update, context: CallbackContext) -> None:
     """Обработчик команды /disconnect"""
-    if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
+    if not check_authorization(update, ADMIN):
+        reply(update, context, "У вас нет доступа к этому боту.")
         return
     
-    chat_id = update.effective_chat.id
-    
-    # Если была активная терминальная сессия, удаляем её
-    if chat_id in active_sessions:
-        del active_sessions[chat_id]
-    
+    # Закрываем все терминальные сессии вместе с соединением
     ssh_manager.disconnect()
-    update.message.reply_text("Отключено от сервера.")
+    reply(update, context, "Отключено от сервера.")
 
+@run_in_background("exec")
 def execute_command(update: Update, context: CallbackContext) -> None:
     """Обработчик команды /cmd"""
-    if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
-        return
-    
     if not context.args:
         update.message.reply_text("Пожалуйста, укажите команду.\nПример: /cmd ls -la")
         return
     
+    # /cmd @группа <команда> выполняет команду на группе хостов
+    if context.args[0].startswith('@'):
+        run_fleet_command(update, context.args[0][1:], ' '.join(context.args[1:]))
+        return
+    
     command = ' '.join(context.args)
     message = update.message.reply_text(f"Выполнение команды: `{command}`...", parse_mode=ParseMode.MARKDOWN)
     
-    success, output = ssh_manager.execute_command(command)
+    # Начало и конец вывода сохраняются, середина длинного вывода пропускается
+    started = time.monotonic()
+    exit_status, output, error = ssh_manager.run_command(command, max_output=CMD_MAX_OUTPUT)
+    record_command(update.effective_chat.id, command, output + error, exit_status, started)
     
-    if success:
+    if exit_status is None:
+        output = error
+    elif exit_status != 0:
+        output = f"Command failed (exit status {exit_status}): {error or output}"
+    
+    if exit_status == 0:
         # Если вывод слишком длинный, обрезаем его
         if len(output) > 4000:
             output = output[:4000] + "...\n[Вывод слишком длинный и был обрезан]"
@@ -143,70 +334,92 @@ def execute_command(update: Update, context: CallbackContext) -> None:
             parse_mode=ParseMode.MARKDOWN
         )
 
+@run_in_background("exec")
+def fleet_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /fleet"""
+    if len(context.args) < 2:
+        groups = "\n".join(
+            f"{name}: {', '.join(hosts)}" for name, hosts in fleet.groups.items()
+        ) or "Группы не настроены (переменная HOST_GROUPS)"
+        update.message.reply_text(
+            "Использование: /fleet <группа> <команда>\n"
+            "Пример: /fleet web df -h\n\n"
+            f"Группы хостов:\n{groups}"
+        )
+        return
+    
+    run_fleet_command(update, context.args[0], ' '.join(context.args[1:]))
+
+def run_fleet_command(update: Update, group: str, command: str) -> None:
+    """Выполнение команды на всех хостах группы и сводный ответ"""
+    if group not in fleet.groups:
+        update.message.reply_text(f"❌ Неизвестная группа хостов: {group}")
+        return
+    
+    if not command:
+        update.message.reply_text("Пожалуйста, укажите команду.\nПример: /fleet web df -h")
+        return
+    
+    message = update.message.reply_text(
+        f"Выполнение команды {escape_markdown(command)} на {len(fleet.groups[group])} хостах "
+        f"группы *{escape_markdown(group)}*...",
+        parse_mode=ParseMode.MARKDOWN
+    )
+    
+    results = fleet.run(group, command)
+    message.edit_text(format_results(group, command, results), parse_mode=ParseMode.MARKDOWN)
+
 def start_terminal(update: Update, context: CallbackContext) -> int:
     """Запуск интерактивного терминала"""
     if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
+        reply(update, context, "У вас нет доступа к этому боту.")
         return ConversationHandler.END
     
     chat_id = update.effective_chat.id
     
     # Проверяем, есть ли пароль
     if not ssh_manager.password:
-        update.message.reply_text(
+        reply(
+            update, context,
             "Не указан пароль для SSH подключения.\n"
             "Используйте команду /password для установки пароля."
         )
         return ConversationHandler.END
     
-    message = update.message.reply_text("Запуск интерактивного терминала...")
+    # Сообщение потом правится - его нельзя склеивать с соседними
+    notice = reply(update, context, "Запуск интерактивного терминала...", coalesce=False)
     
     # Отображаем индикатор ввода (бот печатает...)
     context.bot.send_chat_action(chat_id=chat_id, action="typing")
+
+    # Сессия запускается в фоне; если запуск не удастся, первая же команда
+    # сообщит, что терминал не активен, и завершит режим терминала
+    schedule(update, context, chat_id, open_terminal, chat_id, notice)
+    return TERMINAL_MODE
+
+def open_terminal(chat_id: int, notice) -> None:
+    """Запуск сессии терминала и приветствие (выполняется в фоне).
     
-    # Запускаем сессию терминала
-    success, output = ssh_manager.start_shell_session()
+    notice - Future сообщения о запуске, оно заменяется приветствием
+    """
+    message = notice.result()
+    success, output = ssh_manager.start_shell_session(chat_id)
     
     if success:
-        # Сохраняем информацию о текущей сессии
-        active_sessions[chat_id] = True
-        
-        # Добавляем кнопки для управления терминалом
-        keyboard = [
-            [
-                InlineKeyboardButton("Ctrl+C", callback_data="terminal_ctrl_c"),
-                InlineKeyboardButton("Ctrl+D", callback_data="terminal_ctrl_d")
-            ],
-            [
-                InlineKeyboardButton("Restart container", callback_data="terminal_restart_container"),
-                InlineKeyboardButton("Reboot", callback_data="terminal_reboot")
-            ],
-            [InlineKeyboardButton("Выход (exit)", callback_data="terminal_exit")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Отключаем цветной вывод для улучшения читаемости
-        ssh_manager.send_shell_command("export TERM=dumb")
-        # Отключаем редактор строки (команды будут отображаться без лишних кодов)
-        ssh_manager.send_shell_command("set +o emacs")
-        ssh_manager.send_shell_command("stty -echo")
+        # Добавляем кнопки для управления терминалом и быстрых команд
+        reply_markup = get_terminal_inline_keyboard()
         
         # Получаем hostname для приветствия
-        success, hostname = ssh_manager.send_shell_command("hostname")
+        success, hostname = ssh_manager.send_shell_command("hostname", chat_id)
         if not success or not hostname.strip():
             hostname = ssh_manager.server_ip
         
         # Очищаем и форматируем вывод приветствия
         # Удаляем лишние пустые строки и приглашение bash
         if output:
-            output_lines = output.splitlines()
-            # Удаляем ANSI escape-коды и другие служебные символы
             clean_lines = []
-            for line in output_lines:
-                # Удаляем ANSI escape-коды (цвета, форматирование)
-                line = re.sub(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])', '', line)
-                # Удаляем коды readline и другие управляющие последовательности
-                line = re.sub(r'\[\?[0-9]*[a-z]', '', line)
+            # Удаляем ANSI escape-коды и другие служебные символы
+            for line in sanitize(output, drop_blank_lines=True).splitlines():
                 # Удаляем приглашение bash
                 if not re.search(r'^[^:]*[\$#>]\s*$', line) and line.strip():
                     clean_lines.append(line)
@@ -229,11 +442,8 @@ def start_terminal(update: Update, context: CallbackContext) -> int:
             parse_mode=ParseMode.MARKDOWN,
             reply_markup=reply_markup
         )
-        
-        return TERMINAL_MODE
     else:
         message.edit_text(f"❌ Не удалось запустить терминал:\n```\n{output}\n```", parse_mode=ParseMode.MARKDOWN)
-        return ConversationHandler.END
 
 def terminal_callback(update: Update, context: CallbackContext) -> int:
     """Обработка нажатий на кнопки в терминале"""
@@ -241,70 +451,52 @@ def terminal_callback(update: Update, context: CallbackContext) -> int:
     query.answer()
     
     if not check_authorization(update):
-        query.edit_message_text("У вас нет доступа к этому боту.")
+        edit_reply(query, context, "У вас нет доступа к этому боту.")
         return ConversationHandler.END
     
     chat_id = update.effective_chat.id
     
+    # Перезапуск контейнеров и перезагрузка доступны только администратору
+    if query.data.startswith(("terminal_restart", "terminal_reboot")) and not check_authorization(update, ADMIN):
+        context.bot.send_message(chat_id=chat_id, text="⛔ Это действие доступно только администратору", wait=False)
+        return TERMINAL_MODE
+    
+    # Управляющие кнопки обрабатываются сразу, не дожидаясь выполняемой команды
     if query.data == "terminal_exit":
-        # Отправляем команду exit в терминал
-        ssh_manager.send_shell_command("exit")
-        ssh_manager.stop_shell_session()
-        
-        # Удаляем информацию о сессии
-        if chat_id in active_sessions:
-            del active_sessions[chat_id]
+        # Отправляем exit и закрываем канал: если в терминале еще выполняется
+        # команда, ожидание ее вывода тоже прервется
+        ssh_manager.send_shell_input(chat_id, "exit\n")
+        ssh_manager.stop_shell_session(chat_id)
         
-        query.edit_message_text("Терминальная сессия завершена.")
+        edit_reply(query, context, "Терминальная сессия завершена.")
         return ConversationHandler.END
     
     elif query.data == "terminal_ctrl_c":
         # Отправляем Ctrl+C в терминал
-        ssh_manager.shell.send("\x03")
+        ssh_manager.interrupt_shell(chat_id)
+        # Уведомления не ждут отправки: подряд идущие склеиваются очередью
         context.bot.send_message(
             chat_id=chat_id,
             text="*Отправлен сигнал:* `Ctrl+C`",
-            parse_mode=ParseMode.MARKDOWN
+            parse_mode=ParseMode.MARKDOWN,
+            wait=False
         )
         return TERMINAL_MODE
     
     elif query.data == "terminal_ctrl_d":
         # Отправляем Ctrl+D в терминал
-        ssh_manager.shell.send("\x04")
+        ssh_manager.send_shell_input(chat_id, "\x04")
         context.bot.send_message(
             chat_id=chat_id,
             text="*Отправлен сигнал:* `Ctrl+D`",
-            parse_mode=ParseMode.MARKDOWN
+            parse_mode=ParseMode.MARKDOWN,
+            wait=False
         )
         return TERMINAL_MODE
     
     elif query.data == "terminal_restart_container":
-        # Выполняем команду перезапуска контейнера
-        context.bot.send_message(
-            chat_id=chat_id,
-            text="🔄 *Выполнение:* `docker compose up -d --build`",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        
-        # Отображаем индикатор ввода
-        context.bot.send_chat_action(chat_id=chat_id, action="typing")
-        
-        # Выполняем команду
-        success, output = ssh_manager.send_shell_command("docker compose up -d --build")
-        
-        if success:
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="✅ *Контейнеры успешно перезапущены*\n```\n" + (output or "Нет вывода") + "\n```",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        else:
-            context.bot.send_message(
-                chat_id=chat_id,
-                text="❌ *Ошибка при перезапуске контейнеров:*\n```\n" + output + "\n```",
-                parse_mode=ParseMode.MARKDOWN
-            )
-        
+        # Перезапуск идет в сессии терминала, после уже отправленных команд
+        schedule(update, context, chat_id, terminal_restart_containers, context, chat_id, role=ADMIN)
         return TERMINAL_MODE
     
     elif query.data == "terminal_reboot":
@@ -312,7 +504,8 @@ def terminal_callback(update: Update, context: CallbackContext) -> int:
         context.bot.send_message(
             chat_id=chat_id,
             text="🔄 *Выполнение:* `reboot`\n⚠️ *Внимание:* Сервер будет перезагружен!",
-            parse_mode=ParseMode.MARKDOWN
+            parse_mode=ParseMode.MARKDOWN,
+            wait=False
         )
         
         # Запрашиваем подтверждение перед перезагрузкой
@@ -328,28 +521,15 @@ def terminal_callback(update: Update, context: CallbackContext) -> int:
             chat_id=chat_id,
             text="⚠️ *Подтвердите перезагрузку сервера*\nВы уверены, что хотите перезагрузить сервер?",
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup
+            reply_markup=reply_markup,
+            wait=False
         )
         
         return TERMINAL_MODE
     
     elif query.data == "terminal_reboot_confirm":
-        # Выполняем команду перезагрузки после подтверждения
-        ssh_manager.send_shell_command("reboot")
-        
-        context.bot.send_message(
-            chat_id=chat_id,
-            text="🔄 *Сервер перезагружается...*\nПодключение будет потеряно. После перезагрузки запустите новую сессию.",
-            parse_mode=ParseMode.MARKDOWN
-        )
-        
-        # Закрываем сессию, так как сервер перезагружается
-        ssh_manager.stop_shell_session()
-        
-        # Удаляем информацию о сессии
-        if chat_id in active_sessions:
-            del active_sessions[chat_id]
-        
+        # Перезагрузка идет в отдельной сессии, не дожидаясь команд терминала
+        schedule(update, context, (chat_id, "reboot"), reboot_server, context, chat_id, role=ADMIN)
         return ConversationHandler.END
     
     elif query.data == "terminal_reboot_cancel":
@@ -357,7 +537,8 @@ def terminal_callback(update: Update, context: CallbackContext) -> int:
         context.bot.send_message(
             chat_id=chat_id,
             text="❌ *Перезагрузка отменена*",
-            parse_mode=ParseMode.MARKDOWN
+            parse_mode=ParseMode.MARKDOWN,
+            wait=False
         )
         
         return TERMINAL_MODE
@@ -365,170 +546,680 @@ def terminal_callback(update: Update, context: CallbackContext) -> int:
     elif query.data.startswith("terminal_cmd_"):
         # Извлекаем команду из callback_data
         cmd_name = query.data.replace("terminal_cmd_", "")
-        
-        # Добавляем опции к командам
-        command_map = {
-            "ls": "ls -la --color=never",
-            "ps": "ps aux | head -20",
-            "top": "top -n 1 -b",
-            "htop": "htop -C -n 1",
-            "df": "df -h",
-            "free": "free -h",
-            "uptime": "uptime",
-            "w": "w",
-            "netstat": "netstat -tuln",
-            "ifconfig": "ifconfig || ip a"
-        }
-        
-        command = command_map.get(cmd_name, cmd_name)
-        
-        # Отправляем команду и получаем вывод
+        schedule(update, context, chat_id, terminal_quick_command, context, chat_id, cmd_name)
+    
+    elif query.data.startswith("terminal_refresh_"):
+        # Повторное выполнение команды в обход кэша
+        cmd_name = query.data.replace("terminal_refresh_", "")
+        schedule(update, context, chat_id, terminal_quick_command, context, chat_id, cmd_name, True)
+    
+    return TERMINAL_MODE
+
+def terminal_restart_containers(context: CallbackContext, chat_id: int) -> None:
+    """Перезапуск контейнеров из терминала с потоковым выводом (выполняется в фоне)"""
+    context.bot.send_message(
+        chat_id=chat_id,
+        text="🔄 *Выполнение:* `docker compose up -d --build`",
+        parse_mode=ParseMode.MARKDOWN,
+        wait=False
+    )
+    
+    # Отображаем индикатор ввода
+    context.bot.send_chat_action(chat_id=chat_id, action="typing")
+    
+    # Выполняем команду, показывая вывод по мере поступления
+    streamer = MessageStreamer(context.bot, chat_id)
+    started = time.monotonic()
+    success, output = ssh_manager.send_shell_command(
+        "docker compose up -d --build", chat_id,
+        timeout=LONG_COMMAND_TIMEOUT, on_output=streamer.feed
+    )
+    record_command(chat_id, "docker compose up -d --build", output, ssh_manager.last_exit_status(chat_id), started)
+    result_cache.invalidate(ssh_manager.server_ip)
+    
+    # Если вывод уже показан потоком, итог дописан в то же сообщение
+    if streamer.finish(restart_footer(success, output)):
+        return
+    
+    if success:
         context.bot.send_message(
             chat_id=chat_id,
-            text=f"*Выполнение команды:* `{command}`",
+            text="✅ *Контейнеры успешно перезапущены*\n```\n" + (output or "Нет вывода") + "\n```",
             parse_mode=ParseMode.MARKDOWN
         )
-        
-        # Отображаем индикатор ввода
-        context.bot.send_chat_action(chat_id=chat_id, action="typing")
-        
-        success, output = ssh_manager.send_shell_command(command)
-        
-        if success:
-            if not output.strip():
-                output = "[Команда выполнена, нет вывода]"
-            
-            # Разбиваем длинный вывод на части
-            if len(output) > 4000:
-                parts = []
-                for i in range(0, len(output), 4000):
-                    parts.append(output[i:i+4000])
-                
-                for part in parts:
-                    context.bot.send_message(
-                        chat_id=chat_id,
-                        text=f"```\n{part}\n```",
-                        parse_mode=ParseMode.MARKDOWN
-                    )
-            else:
-                context.bot.send_message(
-                    chat_id=chat_id,
-                    text=f"```\n{output}\n```",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-        else:
-            context.bot.send_message(
-                chat_id=chat_id,
-                text=f"❌ Ошибка при выполнении команды:\n```\n{output}\n```",
-                parse_mode=ParseMode.MARKDOWN
-            )
+    else:
+        context.bot.send_message(
+            chat_id=chat_id,
+            text="❌ *Ошибка при перезапуске контейнеров:*\n```\n" + output + "\n```",
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+def reboot_server(context: CallbackContext, chat_id: int) -> None:
+    """Перезагрузка сервера из терминала (выполняется в фоне)"""
+    # Ждем, пока сервер не закроет соединение, но не дольше таймаута
+    reboot_session = (chat_id, "reboot")
+    ssh_manager.send_shell_command("reboot", reboot_session, timeout=5)
+    ssh_manager.stop_shell_session(reboot_session)
+    result_cache.invalidate(ssh_manager.server_ip)
+    
+    context.bot.send_message(
+        chat_id=chat_id,
+        text="🔄 *Сервер перезагружается...*\nПодключение будет потеряно. После перезагрузки запустите новую сессию.",
+        parse_mode=ParseMode.MARKDOWN
+    )
     
-    return TERMINAL_MODE
+    # Закрываем сессию, так как сервер перезагружается
+    ssh_manager.stop_shell_session(chat_id)
+
+def terminal_quick_command(context: CallbackContext, chat_id: int, cmd_name: str, refresh: bool = False) -> None:
+    """Выполнение команды с кнопки терминала (выполняется в фоне)"""
+    # Добавляем опции к командам
+    command_map = {
+        "ls": "ls -la --color=never",
+        "ps": "ps aux | head -20",
+        "top": "top -n 1 -b",
+        "htop": "htop -C -n 1",
+        "df": "df -h",
+        "free": "free -h",
+        "uptime": "uptime",
+        "w": "w",
+        "netstat": "netstat -tuln",
+        "ifconfig": "ifconfig || ip a"
+    }
+    
+    command = command_map.get(cmd_name, cmd_name)
+    screen = cmd_name in SCREEN_QUICK_COMMANDS
+    
+    # Недавний результат команды, не меняющей сервер, показываем сразу
+    cached = None if refresh else result_cache.get(ssh_manager.server_ip, command)
+    if cached is not None:
+        output, age = cached
+        deliver_output(
+            context.bot, chat_id, output,
+            filename=document_name(command),
+            title=f"🕒 `{command}`, результат {format_age(age)} назад\n",
+            reply_markup=get_refresh_keyboard(f"terminal_refresh_{cmd_name}")
+        )
+        return
+    
+    # Отправляем команду и получаем вывод
+    context.bot.send_message(
+        chat_id=chat_id,
+        text=f"*Выполнение команды:* `{command}`",
+        parse_mode=ParseMode.MARKDOWN,
+        wait=False
+    )
+    
+    # Отображаем индикатор ввода
+    context.bot.send_chat_action(chat_id=chat_id, action="typing")
+    
+    started = time.monotonic()
+    if screen:
+        # htop рисует экран управляющими последовательностями - снимок
+        # делается через модель экрана, а не через сессию терминала
+        success, output = capture_screen(ssh_manager, command, cwd=ssh_manager.shell_cwd(chat_id))
+        exit_status = 0 if success else None
+    else:
+        success, output = ssh_manager.send_shell_command(command, chat_id)
+        exit_status = ssh_manager.last_exit_status(chat_id)
+    record_command(chat_id, command, output, exit_status, started)
+    
+    if success:
+        if not output.strip():
+            output = "[Команда выполнена, нет вывода]"
+        result_cache.put(ssh_manager.server_ip, command, output, QUICK_COMMAND_TTLS.get(cmd_name, 0))
+    
+        # Длинный вывод уходит одним файлом вместо пачки сообщений
+        deliver_output(
+            context.bot, chat_id, output,
+            filename=document_name(command),
+            source=None if screen else lambda fileobj: ssh_manager.write_last_output(chat_id, fileobj)
+        )
+    else:
+        context.bot.send_message(
+            chat_id=chat_id,
+            text=f"❌ Ошибка при выполнении команды:\n```\n{output}\n```",
+            parse_mode=ParseMode.MARKDOWN
+        )
 
 def terminal_command(update: Update, context: CallbackContext) -> int:
     """Обработчик команд в режиме терминала"""
     if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
+        reply(update, context, "У вас нет доступа к этому боту.")
         return ConversationHandler.END
     
     chat_id = update.effective_chat.id
     
-    # Проверяем, активна ли сессия
-    if chat_id not in active_sessions:
-        update.message.reply_text("Терминальная сессия не активна. Запустите её с помощью /terminal")
+    # Проверяем, активна ли сессия (или еще запускается в фоне)
+    queued = background.pending(chat_id)
+    if not queued and not ssh_manager.has_shell_session(chat_id):
+        reply(update, context, "Терминальная сессия не активна. Запустите её с помощью /terminal")
         return ConversationHandler.END
     
     command = update.message.text
     
-    # Выполняем команду немедленно
-    success, output = ssh_manager.send_shell_command(command)
+    # Пока открыт живой экран, сообщения - это ввод для программы
+    if screen_manager.active(chat_id):
+        screen_manager.send_keys(chat_id, command + "\r")
+        return TERMINAL_MODE
+    
+    # Полноэкранная программа открывается живым экраном на отдельном канале:
+    # в сессии терминала она бы ждала ввода до таймаута
+    if (command.split() or [""])[0] in FULLSCREEN_PROGRAMS:
+        schedule(update, context, chat_id, open_screen, context, chat_id, command, ssh_manager.shell_cwd(chat_id))
+        return TERMINAL_MODE
+    
+    # Команды терминала выполняются в фоне строго по очереди
+    schedule(update, context, chat_id, run_terminal_command, context, chat_id, command)
+    return TERMINAL_MODE
+
+def run_terminal_command(context: CallbackContext, chat_id: int, command: str) -> None:
+    """Выполнение команды терминала и отправка вывода (выполняется в фоне)"""
+    # Сессия могла не запуститься или быть закрыта, пока команда ждала очереди
+    if not ssh_manager.has_shell_session(chat_id):
+        context.bot.send_message(
+            chat_id=chat_id,
+            text="Терминальная сессия не активна. Запустите её с помощью /terminal"
+        )
+        return
+    
+    # Если команда работает дольше секунды, вывод показывается
+    # по мере поступления в редактируемом сообщении
+    streamer = MessageStreamer(context.bot, chat_id)
+    started = time.monotonic()
+    # Если команда ждала ввода, сообщение - ответ ей (возможно, пароль)
+    answer = ssh_manager.shell_waiting_for_input(chat_id)
+    success, output = ssh_manager.send_shell_command(command, chat_id, on_output=streamer.feed)
+    exit_status = ssh_manager.last_exit_status(chat_id)
+    waiting = ssh_manager.shell_waiting_for_input(chat_id)
+    # Ответ не попадает в журнал и имена файлов
+    label = "[ввод]" if answer else command
+    record_command(chat_id, label, output, exit_status, started)
+    status_text = f" (код {exit_status})" if exit_status is not None else ""
+    
+    if success:
+        footer = "✅ Команда выполнена"
+    elif waiting:
+        footer = "⌨️ Команда ждет ввода - отправьте ответ следующим сообщением"
+    elif exit_status is None:
+        # Таймаут или закрытая сессия - пояснение в последней строке вывода
+        footer = "❌ " + (output.splitlines() or [""])[-1]
+    else:
+        footer = f"❌ Ошибка выполнения команды{status_text}"
+    
+    # Полный вывод последней команды пишется в файл прямо из буфера сессии
+    write_output = lambda fileobj: ssh_manager.write_last_output(chat_id, fileobj)
+    
+    if streamer.finish(footer):
+        # В сообщении показан только хвост - длинный вывод досылаем файлом
+        if len(output) > INLINE_LIMIT:
+            send_output_document(context.bot, chat_id, document_name(label), write_output)
+        return
     
     # Проверяем результат
     if not success:
-        update.message.reply_text(
-            f"❌ Ошибка выполнения команды:\n```\n{output}\n```",
-            parse_mode='Markdown'
+        deliver_output(
+            context.bot, chat_id, output,
+            filename=document_name(label), source=write_output,
+            title=f"{footer}:\n" if waiting else f"❌ Ошибка выполнения команды{status_text}:\n"
         )
-        return TERMINAL_MODE
+        return
     
     # Обрабатываем вывод
     if output:
-        # Разбиваем вывод на части если он слишком длинный
-        max_length = 4000  # Максимальная длина сообщения в Telegram
-        
-        if len(output) <= max_length:
-            # Отправляем результат без inline клавиатуры
-            try:
-                update.message.reply_text(
-                    f"```\n{output}\n```",
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                # Если не удалось отформатировать (например, из-за разметки), отправляем без разметки
-                update.message.reply_text(output)
-        else:
-            # Разбиваем вывод на части
-            parts = [output[i:i+max_length] for i in range(0, len(output), max_length)]
-            
-            for i, part in enumerate(parts):
-                if i == 0:
-                    update.message.reply_text(
-                        f"Часть {i+1}/{len(parts)}:\n```\n{part}\n```",
-                        parse_mode='Markdown'
-                    )
-                else:
-                    context.bot.send_message(
-                        chat_id=chat_id,
-                        text=f"Часть {i+1}/{len(parts)}:\n```\n{part}\n```",
-                        parse_mode='Markdown'
-                    )
+        # Небольшой вывод - сообщением, длинный - превью и файлом
+        deliver_output(
+            context.bot, chat_id, output,
+            filename=document_name(label), source=write_output
+        )
     else:
         # Если вывода нет, просто показываем сообщение об успешном выполнении
-        update.message.reply_text("✅ Команда выполнена успешно (нет вывода)")
-    
-    return TERMINAL_MODE
+        context.bot.send_message(chat_id=chat_id, text="✅ Команда выполнена успешно (нет вывода)")
 
+@run_in_background("exec", VIEWER)
 def status_command(update: Update, context: CallbackContext) -> None:
     """Обработчик команды /status"""
+    message = update.message.reply_text("Проверка статуса сервера...")
+    show_status(message)
+
+def show_status(message, refresh: bool = False) -> None:
+    """Вывод панели статуса в сообщение message (выполняется в фоне)"""
+    # Повторный /status в течение STATUS_CACHE_TTL не ходит на сервер
+    cached = None if refresh else result_cache.get(ssh_manager.server_ip, PROBE_SCRIPT)
+    if cached is not None:
+        snapshot, age = cached
+    else:
+        # Проверяем подключение
+        if not ssh_manager.ensure_connected():
+            message.edit_text("❌ Не удалось подключиться к серверу.")
+            return
+        
+        # Вся информация о системе собирается одной командой
+        success, snapshot = status_probe.probe()
+        if not success:
+            message.edit_text(f"❌ Не удалось получить данные о сервере:\n{snapshot}")
+            return
+        result_cache.put(ssh_manager.server_ip, PROBE_SCRIPT, snapshot, STATUS_CACHE_TTL)
+        age = 0
+    
+    status_text = format_dashboard(snapshot, ssh_manager.server_ip) + "\n\n"
+    stats = ssh_manager.connection_stats()
+    status_text += f"🔌 Подключений: {stats['connects']}, переподключений: {stats['reconnects']}"
+    if stats['last_handshake_time'] is not None:
+        status_text += f", рукопожатие: {stats['last_handshake_time'] * 1000:.0f} мс"
+    if cached is not None:
+        status_text += f"\n🕒 Данные {format_age(age)} назад"
+    
+    message.edit_text(
+        status_text,
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=get_refresh_keyboard("status_refresh")
+    )
+
+def status_refresh_callback(update: Update, context: CallbackContext) -> None:
+    """Обработчик кнопки обновления /status"""
+    query = update.callback_query
+    query.answer()
+    
+    if not check_authorization(update, VIEWER):
+        edit_reply(query, context, "У вас нет доступа к этому боту.")
+        return
+    
+    schedule(update, context, (update.effective_chat.id, "exec"), show_status, query.message, True, role=VIEWER)
+
+def graph_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /graph: графики из истории фонового сбора метрик"""
+    if not check_authorization(update, VIEWER):
+        reply(update, context, "У вас нет доступа к этому боту.")
+        return
+    
+    args = context.args or []
+    names = list(METRICS)
+    window = 3600
+    if args and args[0] in METRICS:
+        names = [args.pop(0)]
+    if args:
+        window = parse_window(args[0])
+    if window is None or len(args) > 1:
+        reply(
+            update, context,
+            "Использование: /graph [метрика] [окно]\n"
+            f"Метрики: {', '.join(METRICS)}\n"
+            "Окно с единицей: 90s, 30m, 6h, 1d (по умолчанию 1h)"
+        )
+        return
+    
+    if metrics_sampler.interval <= 0:
+        reply(update, context, "Сбор метрик отключен (METRICS_INTERVAL=0).")
+        return
+    
+    graphs = [format_graph(name, metrics_sampler.window(name, window)) for name in names]
+    reply(update, context, "\n\n".join(graphs), parse_mode=ParseMode.MARKDOWN)
+
+def alerts_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /alerts: правила тревог и их текущее состояние"""
+    if not check_authorization(update, VIEWER):
+        reply(update, context, "У вас нет доступа к этому боту.")
+        return
+    
+    if not alert_engine.rules:
+        reply(update, context, "Правила тревог не заданы (ALERT_RULES).")
+        return
+    
+    lines = ["🚨 *Правила тревог*"]
+    for rule, firing, value in alert_engine.status():
+        state = "🔴" if firing else "🟢"
+        current = "нет данных" if value is None else format_metric_value(rule.metric, value)
+        lines.append(f"{state} `{rule.text}` - {current}")
+    if not alert_chats():
+        lines.append("\n⚠️ Чат для уведомлений неизвестен: задайте ALERT_CHAT_ID или администратора в AUTHORIZED_USERS")
+    reply(update, context, "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+def metrics_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /metrics: где бот тратит время"""
+    if not check_authorization(update, ADMIN):
+        reply(update, context, "У вас нет доступа к этому боту.")
+        return
+    
+    summary = instrumentation.summary()
+    endpoint = ""
+    if METRICS_PORT:
+        endpoint = f"\nPrometheus: `http://{METRICS_ADDRESS}:{METRICS_PORT}/metrics`"
+    reply(
+        update, context,
+        f"⏱ *Метрики бота* с запуска\n```\n{summary}\n```{endpoint}",
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+@run_in_background("exec")
+def job_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /job: запуск, вывод и остановка фоновых задач"""
+    args = context.args or []
+    if not args:
+        update.message.reply_text(
+            "Использование:\n"
+            "/job <команда> - запустить команду в фоне\n"
+            "/job tail <id> [строк] - последние строки вывода\n"
+            "/job kill <id> - остановить задачу\n"
+            "/jobs - список задач"
+        )
+        return
+    
+    chat_id = update.effective_chat.id
+    if args[0] == "tail" and len(args) in (2, 3):
+        lines = int(args[2]) if len(args) == 3 and args[2].isdigit() else 50
+        success, output = job_manager.tail(args[1], lines)
+        if success:
+            deliver_output(context.bot, chat_id, output or "Нет вывода", filename=f"job_{args[1]}.txt")
+        else:
+            update.message.reply_text(f"❌ {output}")
+        return
+    
+    if args[0] == "kill" and len(args) == 2:
+        success, output = job_manager.kill(args[1])
+        if success:
+            update.message.reply_text(f"🛑 Задаче `{args[1]}` отправлен SIGTERM", parse_mode=ParseMode.MARKDOWN)
+        else:
+            update.message.reply_text(f"❌ {output}")
+        return
+    
+    command = ' '.join(args)
+    success, job_id = job_manager.start_job(command, chat_id)
+    if success:
+        update.message.reply_text(
+            f"🚀 Задача `{job_id}` запущена: {escape_markdown(command)}\n"
+            f"Вывод: `/job tail {job_id}`, остановить: `/job kill {job_id}`.\n"
+            "О завершении придет уведомление.",
+            parse_mode=ParseMode.MARKDOWN
+        )
+    else:
+        update.message.reply_text(f"❌ Не удалось запустить задачу:\n{job_id}")
+
+@run_in_background("exec", VIEWER)
+def jobs_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /jobs"""
+    success, statuses = job_manager.list_jobs()
+    if not success:
+        update.message.reply_text(f"❌ Не удалось получить список задач:\n{statuses}")
+        return
+    if not statuses:
+        update.message.reply_text("Фоновых задач нет. Запустить: /job <команда>")
+        return
+    
+    lines = ["📋 *Фоновые задачи*"] + [format_job(status) for status in statuses[:20]]
+    update.message.reply_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+@run_in_background("exec")
+def follow_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /follow: новые строки лога по мере появления"""
+    if not context.args:
+        update.message.reply_text(
+            "Использование: /follow <файл|контейнер|юнит> [шаблон grep -E]\n"
+            "Пример: /follow /var/log/nginx/error.log timeout|refused"
+        )
+        return
+    
+    chat_id = update.effective_chat.id
+    # Путь к файлу считается от текущего каталога терминала; имя без "/" -
+    # это контейнер или юнит systemd
+    source = context.args[0]
+    if '/' in source or source.startswith(('~', '.')):
+        source = resolve_path(source, ssh_manager.shell_cwd(chat_id))
+    pattern = ' '.join(context.args[1:]) or None
+    success, error = follow_manager.start(context.bot, chat_id, source, pattern)
+    if not success:
+        update.message.reply_text(f"❌ Не удалось начать слежение:\n{error}")
+
+def follow_stop_callback(update: Update, context: CallbackContext) -> None:
+    """Обработчик кнопки остановки /follow"""
+    query = update.callback_query
+    query.answer()
+    
     if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
+        edit_reply(query, context, "У вас нет доступа к этому боту.")
         return
     
-    message = update.message.reply_text("Проверка статуса сервера...")
+    # Итог слежения допишет в сообщение сам поток слежения
+    follow_manager.stop(update.effective_chat.id)
+
+@run_in_background("exec")
+def screen_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /screen: полноэкранная программа в редактируемом сообщении"""
+    chat_id = update.effective_chat.id
+    command = ' '.join(context.args) or "top"
+    open_screen(context, chat_id, command, ssh_manager.shell_cwd(chat_id))
+
+def open_screen(context: CallbackContext, chat_id: int, command: str, cwd) -> None:
+    """Запуск живого экрана (выполняется в фоне)"""
+    success, error = screen_manager.start(context.bot, chat_id, command, cwd)
+    if not success:
+        context.bot.send_message(chat_id=chat_id, text=f"❌ Не удалось открыть экран:\n{error}")
+
+def screen_callback(update: Update, context: CallbackContext) -> None:
+    """Обработчик кнопок живого экрана: клавиши и закрытие"""
+    query = update.callback_query
+    query.answer()
     
-    # Проверяем подключение
-    if not ssh_manager.client:
-        if not ssh_manager.connect():
-            message.edit_text("❌ Не удалось подключиться к серверу.")
-            return
+    if not check_authorization(update):
+        edit_reply(query, context, "У вас нет доступа к этому боту.")
+        return
+    
+    chat_id = update.effective_chat.id
+    if query.data == "screen_stop":
+        # Последний кадр и итог допишет в сообщение сам поток экрана
+        screen_manager.stop(chat_id)
+    elif query.data.startswith("screen_key_"):
+        keys = SCREEN_KEYS.get(query.data[len("screen_key_"):])
+        if keys:
+            screen_manager.send_keys(chat_id, keys)
+
+def screen_input(update: Update, context: CallbackContext) -> None:
+    """Текст вне терминала при открытом живом экране передается программе"""
+    chat_id = update.effective_chat.id
+    if not check_authorization(update) or not screen_manager.active(chat_id):
+        return
+    screen_manager.send_keys(chat_id, update.message.text + "\r")
+
+def history_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /history: поиск по журналу команд чата"""
+    if not check_authorization(update, VIEWER):
+        reply(update, context, "У вас нет доступа к этому боту.")
+        return
+    
+    if not transcript.enabled:
+        reply(update, context, "Журнал команд отключен (TRANSCRIPT_DIR).")
+        return
     
-    # Получаем информацию о системе
-    success, uptime = ssh_manager.execute_command("uptime")
+    pattern = ' '.join(context.args or []) or None
+    entries = transcript.search(update.effective_chat.id, pattern)
+    if not entries:
+        reply(update, context, "Команды не найдены." if pattern else "Журнал команд пуст.")
+        return
+    
+    # Команды произвольные: обратная кавычка внутри `...` ломала разметку,
+    # поэтому текст экранируется, а не оборачивается в код
+    lines = ["📜 *Выполненные команды*" + (f" с {escape_markdown(pattern)}" if pattern else "")]
+    for entry in reversed(entries):
+        if entry.exit_status is None:
+            state = "❔"
+        else:
+            state = "✅" if entry.exit_status == 0 else f"❌{entry.exit_status}"
+        when = datetime.fromtimestamp(entry.timestamp).strftime('%d.%m %H:%M')
+        lines.append(f"{entry.number}. {when} {state} {entry.duration:.1f} с {escape_markdown(entry.command[:100])}")
+    lines.append("\nВывод команды: /show <номер>")
+    reply(update, context, "\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+
+@run_in_background("show", VIEWER)
+def show_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /show: сохраненный вывод без обращения к серверу.
+    
+    Длинный вывод уходит файлом, поэтому отправка идет в фоне
+    """
+    if not context.args or not context.args[0].isdigit():
+        update.message.reply_text("Укажите номер команды из /history.\nПример: /show 12")
+        return
+    
+    found = transcript.get(update.effective_chat.id, int(context.args[0]))
+    if found is None:
+        update.message.reply_text("❌ Команды с таким номером нет в журнале.")
+        return
+    
+    entry, output = found
+    when = datetime.fromtimestamp(entry.timestamp).strftime('%d.%m.%Y %H:%M:%S')
+    deliver_output(
+        context.bot, update.effective_chat.id, output or "Нет вывода",
+        filename=document_name(entry.command),
+        title=f"#{entry.number} {escape_markdown(entry.command[:200])}, {when}:\n"
+    )
+
+@run_in_background("ls", VIEWER)
+def ls_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /ls: каталог по SFTP с кнопками листания"""
+    chat_id = update.effective_chat.id
+    # Без пути - текущий каталог терминала или домашний
+    cwd = ssh_manager.shell_cwd(chat_id)
+    path = resolve_path(' '.join(context.args), cwd) if context.args else cwd or '.'
+    success, view = dir_browser.open(path)
+    if not success:
+        update.message.reply_text(f"❌ Не удалось прочитать каталог:\n{view}")
+        return
+    success, page = dir_browser.render(view)
     if not success:
-        message.edit_text("❌ Не удалось получить данные о сервере.")
+        update.message.reply_text(f"❌ Не удалось прочитать каталог:\n{page}")
         return
+    text, markup = page
+    message = update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=markup)
+    dir_browser.remember(chat_id, message.message_id, view)
+
+def ls_callback(update: Update, context: CallbackContext) -> None:
+    """Обработчик кнопок /ls: страницы, сортировка, переход в подкаталог"""
+    query = update.callback_query
+    query.answer()
     
-    success, disk = ssh_manager.execute_command("df -h | grep -v tmpfs")
-    success2, memory = ssh_manager.execute_command("free -h")
+    if not check_authorization(update, VIEWER):
+        edit_reply(query, context, "У вас нет доступа к этому боту.")
+        return
     
-    status_text = f"📊 Статус сервера ({ssh_manager.server_ip}):\n\n"
-    status_text += f"Аптайм:\n```\n{uptime.strip()}\n```\n\n"
+    chat_id = update.effective_chat.id
+    # Переход в каталог может потребовать чтения по SFTP - в фоне, в своей очереди
+    schedule(update, context, (chat_id, "ls"), browse_directory, query, chat_id, query.data[len("ls_"):], role=VIEWER)
+
+def browse_directory(query, chat_id: int, action: str) -> None:
+    """Действие с сообщением /ls (выполняется в фоне)"""
+    view = dir_browser.view(chat_id, query.message.message_id)
+    if view is None:
+        query.edit_message_reply_markup(reply_markup=None)
+        query.message.reply_text("Список устарел, откройте его заново командой /ls")
+        return
     
+    success, error = dir_browser.navigate(view, action)
     if success:
-        status_text += f"Использование диска:\n```\n{disk.strip()}\n```\n\n"
+        success, page = dir_browser.render(view)
+    if not success:
+        query.message.reply_text(f"❌ Не удалось прочитать каталог:\n{error or page}")
+        return
+    text, markup = page
+    try:
+        query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=markup)
+    except BadRequest as e:
+        # Повторное нажатие текущей сортировки или страницы ничего не меняет
+        if 'not modified' not in str(e):
+            raise
+
+def transfer_progress(context: CallbackContext, message, label: str) -> TransferProgress:
+    """Прогресс передачи файла, не чаще раза в пару секунд правит сообщение message"""
+    def report(text: str) -> None:
+        context.bot.edit_message_text(text, chat_id=message.chat_id, message_id=message.message_id, wait=False)
+    return TransferProgress(report, label)
+
+@run_in_background("exec")
+def get_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик команды /get: скачивание файла с сервера через SFTP"""
+    if not context.args:
+        update.message.reply_text("Укажите путь к файлу.\nПример: /get /var/log/syslog")
+        return
+    
+    chat_id = update.effective_chat.id
+    # Относительный путь считается от текущего каталога терминала
+    path = resolve_path(' '.join(context.args), ssh_manager.shell_cwd(chat_id))
+    message = update.message.reply_text(f"⬇️ Скачивание `{path}`...", parse_mode=ParseMode.MARKDOWN)
+    
+    success, sftp = ssh_manager.open_sftp()
+    if not success:
+        message.edit_text(f"❌ Не удалось открыть SFTP:\n{sftp}")
+        return
+    
+    progress = transfer_progress(context, message, "⬇️ Скачивание")
+    try:
+        fileobj, size, filename = download(sftp, path, progress=progress)
+    except Exception as e:
+        logger.warning(f"Could not download {path}: {str(e)}")
+        message.edit_text(f"❌ Не удалось скачать файл:\n{str(e)}")
+        return
+    finally:
+        sftp.close()
+    
+    try:
+        message.edit_text(f"📤 Отправка в Telegram: {format_size(size)}...")
+        send_file(context.bot, chat_id, fileobj, size, filename, caption=path)
+    finally:
+        fileobj.close()
+    message.edit_text(f"✅ Файл `{path}` отправлен: `{filename}`, {format_size(size)}", parse_mode=ParseMode.MARKDOWN)
+
+@run_in_background("exec")
+def put_command(update: Update, context: CallbackContext) -> None:
+    """Обработчик /put: загрузка файла на сервер через SFTP"""
+    # Файл приходит с подписью "/put путь" или команда - ответ на сообщение с файлом
+    reply = update.message.reply_to_message
+    document = update.message.document or (reply.document if reply else None)
+    if document is None:
+        update.message.reply_text(
+            "Отправьте файл с подписью /put [путь] или ответьте командой /put [путь] на сообщение с файлом.\n"
+            "Без пути файл сохраняется в домашний каталог."
+        )
+        return
+    if document.file_size and document.file_size > DOWNLOAD_LIMIT:
+        update.message.reply_text(f"❌ Telegram отдает ботам файлы не больше {format_size(DOWNLOAD_LIMIT)}.")
+        return
+    
+    chat_id = update.effective_chat.id
+    args = (update.message.text or update.message.caption or "").split(maxsplit=1)[1:]
+    path = resolve_path(args[0].strip() if args else "~/", ssh_manager.shell_cwd(chat_id))
+    filename = document.file_name or document.file_unique_id
+    message = update.message.reply_text(f"📥 Получение `{filename}` из Telegram...", parse_mode=ParseMode.MARKDOWN)
+    
+    success, sftp = ssh_manager.open_sftp()
+    if not success:
+        message.edit_text(f"❌ Не удалось открыть SFTP:\n{sftp}")
+        return
     
-    if success2:
-        status_text += f"Использование памяти:\n```\n{memory.strip()}\n```"
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    try:
+        context.bot.get_file(document.file_id).download(out=spool)
+        size = spool.tell()
+        spool.seek(0)
+        progress = transfer_progress(context, message, "⬆️ Загрузка")
+        target = upload(sftp, spool, size, path, filename, progress=progress)
+    except Exception as e:
+        logger.warning(f"Could not upload {filename} to {path}: {str(e)}")
+        message.edit_text(f"❌ Не удалось загрузить файл:\n{str(e)}")
+        return
+    finally:
+        spool.close()
+        sftp.close()
     
-    message.edit_text(status_text, parse_mode=ParseMode.MARKDOWN)
+    result_cache.invalidate(ssh_manager.server_ip)
+    dir_browser.cache.invalidate(ssh_manager.server_ip)
+    message.edit_text(f"✅ Файл сохранен: `{target}` ({format_size(size)})", parse_mode=ParseMode.MARKDOWN)
 
 def request_password(update: Update, context: CallbackContext) -> int:
     """Запрос пароля для SSH"""
-    if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
+    if not check_authorization(update, ADMIN):
+        reply(update, context, "У вас нет доступа к этому боту.")
         return ConversationHandler.END
     
-    update.message.reply_text(
+    reply(
+        update, context,
         "Пожалуйста, введите пароль для SSH подключения.\n"
         "Внимание: После обработки ваше сообщение с паролем будет удалено для безопасности."
     )
@@ -536,8 +1227,8 @@ def request_password(update: Update, context: CallbackContext) -> int:
 
 def receive_password(update: Update, context: CallbackContext) -> int:
     """Получение пароля и его установка"""
-    if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
+    if not check_authorization(update, ADMIN):
+        reply(update, context, "У вас нет доступа к этому боту.")
         return ConversationHandler.END
     
     # Получаем пароль из сообщения
@@ -552,138 +1243,225 @@ def receive_password(update: Update, context: CallbackContext) -> int:
     except Exception as e:
         logger.warning(f"Could not delete message with password: {e}")
     
-    update.message.reply_text("✅ Пароль успешно установлен. Теперь можно подключиться к серверу командой /terminal или /cmd")
+    reply(update, context, "✅ Пароль успешно установлен. Теперь можно подключиться к серверу командой /terminal или /cmd")
     
     return ConversationHandler.END
 
 def cancel(update: Update, context: CallbackContext) -> int:
     """Отмена операции установки пароля"""
-    if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
+    if not check_authorization(update, VIEWER):
+        reply(update, context, "У вас нет доступа к этому боту.")
         return ConversationHandler.END
     
-    update.message.reply_text("Операция отменена.")
+    reply(update, context, "Операция отменена.")
     return ConversationHandler.END
 
 # Добавляем новый обработчик для кнопок меню
 def handle_menu_buttons(update: Update, context: CallbackContext) -> None:
     """Обработчик кнопок из основного меню"""
     if not check_authorization(update):
-        update.message.reply_text("У вас нет доступа к этому боту.")
+        reply(update, context, "У вас нет доступа к этому боту.")
         return
     
     command = update.message.text
     chat_id = update.effective_chat.id
     
-    # Проверяем, активна ли сессия терминала
-    is_terminal_active = chat_id in active_sessions
+    if command in ("Restart container", "Reboot") and not check_authorization(update, ADMIN):
+        reply(update, context, "⛔ Это действие доступно только администратору")
+        return
     
     if command == "Ctrl+C":
-        if is_terminal_active and ssh_manager.shell:
-            ssh_manager.shell.send("\x03")
-            update.message.reply_text("*Отправлен сигнал:* `Ctrl+C`", parse_mode=ParseMode.MARKDOWN)
+        if ssh_manager.interrupt_shell(chat_id):
+            reply(update, context, "*Отправлен сигнал:* `Ctrl+C`", parse_mode=ParseMode.MARKDOWN)
         else:
-            update.message.reply_text("❌ Нет активной терминальной сессии. Запустите сессию командой /terminal")
+            reply(update, context, "❌ Нет активной терминальной сессии. Запустите сессию командой /terminal")
     
     elif command == "Ctrl+D":
-        if is_terminal_active and ssh_manager.shell:
-            ssh_manager.shell.send("\x04")
-            update.message.reply_text("*Отправлен сигнал:* `Ctrl+D`", parse_mode=ParseMode.MARKDOWN)
+        if ssh_manager.send_shell_input(chat_id, "\x04"):
+            reply(update, context, "*Отправлен сигнал:* `Ctrl+D`", parse_mode=ParseMode.MARKDOWN)
         else:
-            update.message.reply_text("❌ Нет активной терминальной сессии. Запустите сессию командой /terminal")
+            reply(update, context, "❌ Нет активной терминальной сессии. Запустите сессию командой /terminal")
     
     elif command == "Restart container":
-        # Проверяем, есть ли соединение с сервером
-        if not ssh_manager.client and not ssh_manager.connect():
-            update.message.reply_text("❌ Не удалось подключиться к серверу")
-            return
-        
-        message = update.message.reply_text("🔄 *Выполнение:* `docker compose up -d --build`", parse_mode=ParseMode.MARKDOWN)
-        context.bot.send_chat_action(chat_id=chat_id, action="typing")
-        
-        # Используем send_shell_command вместо execute_command для лучшей обработки параметров
-        if is_terminal_active and ssh_manager.shell:
-            # Если уже есть активная сессия, используем её
-            success, output = ssh_manager.send_shell_command("cd /root/ssh-tg && docker compose up -d --build")
-        else:
-            # Иначе создаем новую сессию и выполняем команду
-            if ssh_manager.connect():
-                temp_active = True
-                ssh_manager.start_shell_session()
-                success, output = ssh_manager.send_shell_command("cd /root/ssh-tg && docker compose up -d --build")
-                ssh_manager.stop_shell_session()
-                temp_active = False
-            else:
-                success = False
-                output = "Не удалось подключиться к серверу"
-        
-        if success:
-            message.edit_text("✅ *Контейнеры успешно перезапущены*\n```\n" + (output or "Нет вывода") + "\n```", parse_mode=ParseMode.MARKDOWN)
-        else:
-            message.edit_text("❌ *Ошибка при перезапуске контейнеров:*\n```\n" + output + "\n```", parse_mode=ParseMode.MARKDOWN)
+        # Пересборка идет в фоне, кнопки Ctrl+C и /status остаются доступны
+        schedule(update, context, (chat_id, "restart"), restart_containers, update, context, role=ADMIN)
     
     elif command == "Reboot":
-        # Проверяем, есть ли соединение с сервером
-        if not ssh_manager.client and not ssh_manager.connect():
-            update.message.reply_text("❌ Не удалось подключиться к серверу")
-            return
-        
-        # Запрашиваем подтверждение
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ Да, перезагрузить", callback_data="reboot_confirm"),
-                InlineKeyboardButton("❌ Отмена", callback_data="reboot_cancel")
-            ]
+        schedule(update, context, (chat_id, "exec"), ask_reboot_confirmation, update, role=ADMIN)
+
+def restart_containers(update: Update, context: CallbackContext) -> None:
+    """Перезапуск контейнеров из меню с потоковым выводом (выполняется в фоне)"""
+    chat_id = update.effective_chat.id
+    
+    # Проверяем, есть ли соединение с сервером
+    if not ssh_manager.ensure_connected():
+        update.message.reply_text("❌ Не удалось подключиться к серверу")
+        return
+    
+    message = update.message.reply_text("🔄 *Выполнение:* `docker compose up -d --build`", parse_mode=ParseMode.MARKDOWN)
+    context.bot.send_chat_action(chat_id=chat_id, action="typing")
+    
+    # Используем send_shell_command вместо execute_command для лучшей обработки параметров.
+    # Отдельная временная сессия не меняет каталог и вывод терминала этого чата
+    restart_session = (chat_id, "restart")
+    streamer = MessageStreamer(context.bot, chat_id)
+    started = time.monotonic()
+    success, output = ssh_manager.send_shell_command(
+        "cd /root/ssh-tg && docker compose up -d --build", restart_session,
+        timeout=LONG_COMMAND_TIMEOUT, on_output=streamer.feed
+    )
+    record_command(
+        chat_id, "cd /root/ssh-tg && docker compose up -d --build", output,
+        ssh_manager.last_exit_status(restart_session), started
+    )
+    ssh_manager.stop_shell_session(restart_session)
+    result_cache.invalidate(ssh_manager.server_ip)
+    
+    if streamer.finish(restart_footer(success, output)):
+        message.edit_text("🔄 *Выполнено:* `docker compose up -d --build`", parse_mode=ParseMode.MARKDOWN)
+    elif success:
+        message.edit_text("✅ *Контейнеры успешно перезапущены*\n```\n" + (output or "Нет вывода") + "\n```", parse_mode=ParseMode.MARKDOWN)
+    else:
+        message.edit_text("❌ *Ошибка при перезапуске контейнеров:*\n```\n" + output + "\n```", parse_mode=ParseMode.MARKDOWN)
+
+def ask_reboot_confirmation(update: Update) -> None:
+    """Запрос подтверждения перезагрузки (выполняется в фоне)"""
+    # Проверяем, есть ли соединение с сервером
+    if not ssh_manager.ensure_connected():
+        update.message.reply_text("❌ Не удалось подключиться к серверу")
+        return
+    
+    # Запрашиваем подтверждение
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ Да, перезагрузить", callback_data="reboot_confirm"),
+            InlineKeyboardButton("❌ Отмена", callback_data="reboot_cancel")
         ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        update.message.reply_text(
-            "⚠️ *Подтвердите перезагрузку сервера*\n"
-            "Вы уверены, что хотите перезагрузить сервер?",
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=reply_markup
-        )
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    update.message.reply_text(
+        "⚠️ *Подтвердите перезагрузку сервера*\n"
+        "Вы уверены, что хотите перезагрузить сервер?",
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=reply_markup
+    )
 
 def general_callback_handler(update: Update, context: CallbackContext) -> None:
     """Обработчик callback-кнопок вне терминала"""
     query = update.callback_query
     query.answer()
     
-    if not check_authorization(update):
-        query.edit_message_text("У вас нет доступа к этому боту.")
+    if not check_authorization(update, ADMIN):
+        edit_reply(query, context, "У вас нет доступа к этому боту.")
         return
     
     chat_id = update.effective_chat.id
     
     if query.data == "reboot_confirm":
-        if not ssh_manager.client and not ssh_manager.connect():
-            query.edit_message_text("❌ Не удалось подключиться к серверу")
-            return
-        
-        # Выполняем команду перезагрузки через interactive shell
-        query.edit_message_text("🔄 *Выполнение команды перезагрузки...*", parse_mode=ParseMode.MARKDOWN)
-        
-        # Создаем временную сессию
-        ssh_manager.start_shell_session()
-        ssh_manager.send_shell_command("reboot")
-        ssh_manager.stop_shell_session()
-        
-        query.edit_message_text("🔄 *Сервер перезагружается...*\n"
-                               "Подключение будет потеряно. После перезагрузки запустите бота снова.",
-                               parse_mode=ParseMode.MARKDOWN)
-        
-        # Закрываем все соединения
-        ssh_manager.disconnect()
-        
-        # Очищаем все активные сессии
-        active_sessions.clear()
+        # Перезагрузка не ждет команд, выполняющихся в терминале
+        schedule(update, context, (chat_id, "reboot"), confirm_reboot, query, chat_id, role=ADMIN)
     
     elif query.data == "reboot_cancel":
-        query.edit_message_text("❌ *Перезагрузка отменена*", parse_mode=ParseMode.MARKDOWN)
+        edit_reply(query, context, "❌ *Перезагрузка отменена*", parse_mode=ParseMode.MARKDOWN)
+
+def alert_callback(update: Update, context: CallbackContext) -> None:
+    """Обработчик кнопок быстрых действий под тревогой"""
+    query = update.callback_query
+    query.answer()
+    
+    if not check_authorization(update):
+        edit_reply(query, context, "У вас нет доступа к этому боту.")
+        return
+    
+    chat_id = update.effective_chat.id
+    action = query.data[len("alert_"):]
+    if action == "cancel":
+        edit_reply(query, context, "❌ *Действие отменено*", parse_mode=ParseMode.MARKDOWN)
+        return
+    confirmed = action.startswith("confirm_")
+    if confirmed:
+        action = action[len("confirm_"):]
+    if action not in ACTIONS:
+        return
+    
+    # Очистка Docker и журналов удаляет данные: только администратору и после подтверждения
+    if action in DESTRUCTIVE_ACTIONS:
+        label, command = ACTIONS[action]
+        if not check_authorization(update, ADMIN):
+            context.bot.send_message(chat_id=chat_id, text="⛔ Это действие доступно только администратору", wait=False)
+            return
+        if not confirmed:
+            context.bot.send_message(
+                chat_id=chat_id,
+                text=f"⚠️ *Подтвердите действие*\n{label}: `{command}`",
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=confirm_keyboard(action),
+                wait=False
+            )
+            return
+        # Убираем кнопки, чтобы повторное нажатие не запустило команду еще раз
+        edit_reply(query, context, f"✅ *Подтверждено:* `{command}`", parse_mode=ParseMode.MARKDOWN)
+    
+    schedule(update, context, (chat_id, "exec"), run_alert_action, context, chat_id, action, role=ADMIN if action in DESTRUCTIVE_ACTIONS else OPERATOR)
+
+def run_alert_action(context: CallbackContext, chat_id: int, action: str) -> None:
+    """Выполнение быстрого действия из тревоги (выполняется в фоне)"""
+    label, command = ACTIONS[action]
+    context.bot.send_message(chat_id=chat_id, text=f"{label}: `{command}`", parse_mode=ParseMode.MARKDOWN)
+    
+    started = time.monotonic()
+    exit_status, output, error = ssh_manager.run_command(command)
+    record_command(chat_id, command, output + error, exit_status, started)
+    # Очистка меняет занятое место, прежние df и /status устарели
+    result_cache.invalidate(ssh_manager.server_ip)
+    if exit_status is None:
+        context.bot.send_message(chat_id=chat_id, text=f"❌ Ошибка при выполнении команды:\n{error}")
+        return
+    
+    title = "✅ Готово:\n" if exit_status == 0 else f"⚠️ Код завершения {exit_status}:\n"
+    deliver_output(context.bot, chat_id, sanitize(output + error) or "Нет вывода", document_name(command), title=title)
+
+def confirm_reboot(query, chat_id: int) -> None:
+    """Перезагрузка сервера после подтверждения (выполняется в фоне)"""
+    if not ssh_manager.ensure_connected():
+        query.edit_message_text("❌ Не удалось подключиться к серверу")
+        return
+    
+    # Выполняем команду перезагрузки через interactive shell
+    query.edit_message_text("🔄 *Выполнение команды перезагрузки...*", parse_mode=ParseMode.MARKDOWN)
+    
+    # Создаем временную сессию
+    reboot_session = (chat_id, "reboot")
+    ssh_manager.send_shell_command("reboot", reboot_session, timeout=5)
+    ssh_manager.stop_shell_session(reboot_session)
+    result_cache.invalidate(ssh_manager.server_ip)
+    
+    query.edit_message_text("🔄 *Сервер перезагружается...*\n"
+                           "Подключение будет потеряно. После перезагрузки запустите бота снова.",
+                           parse_mode=ParseMode.MARKDOWN)
+    
+    # Закрываем все соединения и терминальные сессии
+    ssh_manager.disconnect()
+
+def restart_footer(success: bool, output: str) -> str:
+    """Итоговая строка для потокового вывода перезапуска контейнеров"""
+    if success:
+        return "✅ *Контейнеры успешно перезапущены*"
+    last_line = output.splitlines()[-1] if output else ""
+    return f"❌ *Ошибка при перезапуске контейнеров:* {last_line}"
 
 def get_terminal_inline_keyboard():
     """Возвращает клавиатуру с кнопками для терминала"""
+    # Быстрые команды, не меняющие сервер: их результат кэшируется (QUICK_COMMAND_TTLS)
+    quick_commands = ["ps", "top", "htop", "df", "free", "uptime", "w", "netstat", "ifconfig"]
     keyboard = [
+        [
+            InlineKeyboardButton(name, callback_data=f"terminal_cmd_{name}")
+            for name in quick_commands[i:i + 3]
+        ]
+        for i in range(0, len(quick_commands), 3)
+    ] + [
         [
             InlineKeyboardButton("Ctrl+C", callback_data="terminal_ctrl_c"),
             InlineKeyboardButton("Ctrl+D", callback_data="terminal_ctrl_d")
@@ -696,6 +1474,10 @@ def get_terminal_inline_keyboard():
     ]
     return InlineKeyboardMarkup(keyboard)
 
+def get_refresh_keyboard(callback_data: str):
+    """Кнопка повторного выполнения для результата из кэша"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Обновить", callback_data=callback_data)]])
+
 def get_terminal_keyboard():
     """Возвращает основную клавиатуру для режима терминала"""
     keyboard = [
@@ -709,8 +1491,17 @@ def get_terminal_keyboard():
 
 def main() -> None:
     """Запуск бота"""
-    # Создаем Updater и передаем ему токен бота с увеличенным таймаутом
-    updater = Updater(TELEGRAM_TOKEN, request_kwargs={'read_timeout': 30, 'connect_timeout': 30})
+    # Все ответы бота идут через очередь отправки с учетом лимитов Telegram.
+    # Пул соединений: 8 для Updater с 4 воркерами, по одному на поток отправки
+    # и на фоновый обработчик (индикатор набора и ответы на кнопки идут напрямую)
+    request = Request(
+        con_pool_size=8 + SEND_WORKERS + HANDLER_WORKERS, read_timeout=30, connect_timeout=30
+    )
+    bot = QueuedBot(
+        TELEGRAM_TOKEN, request=request,
+        base_url=f"{TELEGRAM_API_URL}/bot", base_file_url=f"{TELEGRAM_API_URL}/file/bot"
+    )
+    updater = Updater(bot=bot)
 
     # Получаем диспетчер для регистрации обработчиков
     dispatcher = updater.dispatcher
@@ -734,7 +1525,10 @@ def main() -> None:
                 CallbackQueryHandler(terminal_callback, pattern="^terminal_")
             ]
         },
-        fallbacks=[CommandHandler("exit", lambda u, c: ConversationHandler.END)]
+        fallbacks=[CommandHandler("exit", lambda u, c: ConversationHandler.END)],
+        # Терминал запускается в фоне: /terminal должен работать и в режиме
+        # терминала, если предыдущий запуск не удался
+        allow_reentry=True
     )
 
     # Регистрируем обработчики команд
@@ -743,7 +1537,21 @@ def main() -> None:
     dispatcher.add_handler(CommandHandler("connect", connect_command))
     dispatcher.add_handler(CommandHandler("disconnect", disconnect_command))
     dispatcher.add_handler(CommandHandler("cmd", execute_command))
+    dispatcher.add_handler(CommandHandler("fleet", fleet_command))
     dispatcher.add_handler(CommandHandler("status", status_command))
+    dispatcher.add_handler(CommandHandler("graph", graph_command))
+    dispatcher.add_handler(CommandHandler("alerts", alerts_command))
+    dispatcher.add_handler(CommandHandler("metrics", metrics_command))
+    dispatcher.add_handler(CommandHandler("job", job_command))
+    dispatcher.add_handler(CommandHandler("jobs", jobs_command))
+    dispatcher.add_handler(CommandHandler("follow", follow_command))
+    dispatcher.add_handler(CommandHandler("screen", screen_command))
+    dispatcher.add_handler(CommandHandler("ls", ls_command))
+    dispatcher.add_handler(CommandHandler("get", get_command))
+    dispatcher.add_handler(CommandHandler("history", history_command))
+    dispatcher.add_handler(CommandHandler("show", show_command))
+    dispatcher.add_handler(CommandHandler("put", put_command))
+    dispatcher.add_handler(MessageHandler(Filters.document & Filters.caption_regex(r'^/put(\s|$)'), put_command))
     
     # Добавляем обработчик для кнопок меню
     dispatcher.add_handler(MessageHandler(
@@ -753,19 +1561,39 @@ def main() -> None:
     
     # Добавляем обработчик для callback-кнопок вне терминала
     dispatcher.add_handler(CallbackQueryHandler(general_callback_handler, pattern="^reboot_"))
+    dispatcher.add_handler(CallbackQueryHandler(alert_callback, pattern="^alert_"))
+    dispatcher.add_handler(CallbackQueryHandler(status_refresh_callback, pattern="^status_refresh$"))
+    dispatcher.add_handler(CallbackQueryHandler(follow_stop_callback, pattern="^follow_stop$"))
+    dispatcher.add_handler(CallbackQueryHandler(screen_callback, pattern="^screen_"))
+    dispatcher.add_handler(CallbackQueryHandler(ls_callback, pattern="^ls_"))
     
     # Добавляем обработчик разговора для установки пароля
     dispatcher.add_handler(password_handler)
     
     # Добавляем обработчик терминала
     dispatcher.add_handler(terminal_handler)
+    
+    # Остальной текст при открытом живом экране - ввод для программы
+    dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, screen_input))
 
     # Запускаем бота
+    global alert_bot
+    alert_bot = bot
     updater.start_polling()
+    metrics_sampler.start()
+    if start_metrics_server():
+        logger.info(f"Метрики доступны на {METRICS_ADDRESS}:{METRICS_PORT}/metrics")
     logger.info("Бот запущен")
     
     # Запускаем бота до нажатия Ctrl-C или получения сигнала остановки
     updater.idle()
+    metrics_sampler.stop()
+    job_manager.stop()
+    follow_manager.stop_all()
+    screen_manager.stop_all()
+    background.shutdown()
+    fleet.shutdown()
+    bot.send_queue.stop()
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
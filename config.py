@@ -0,0 +1,17 @@
+import os
+
+
+def env_int(name, default):
+    """Integer setting from the environment; unset or empty means default.
+
+    docker-compose passes a variable left empty in .env as "", which
+    int() would reject.
+    """
+    value = os.getenv(name, '').strip()
+    return int(value) if value else default
+
+
+def env_float(name, default):
+    """Float setting from the environment; unset or empty means default"""
+    value = os.getenv(name, '').strip()
+    return float(value) if value else default
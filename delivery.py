@@ -0,0 +1,134 @@
+import gzip
+import logging
+import re
+import shutil
+from tempfile import SpooledTemporaryFile
+
+from telegram import ParseMode
+
+from config import env_int
+from instrumentation import span
+
+# Вывод длиннее этого числа символов отправляется файлом, а не сообщениями
+INLINE_LIMIT = env_int('OUTPUT_INLINE_LIMIT', 4000)
+# Сколько строк начала и конца показывать в превью перед файлом
+PREVIEW_LINES = 10
+PREVIEW_MAX_LENGTH = 1500
+# До этого размера файл собирается в памяти, дальше - на диске
+SPOOL_MAX_SIZE = 1024 * 1024
+# Сжимаем, только если gzip экономит хотя бы 10%
+GZIP_MIN_SAVING = 0.9
+
+logger = logging.getLogger(__name__)
+
+
+def document_name(command):
+    """File name for a command's output, e.g. "docker_logs_web.txt" """
+    name = re.sub(r'[^\w.-]+', '_', command).strip('_.')[:40]
+    return f"{name or 'output'}.txt"
+
+
+def format_size(size):
+    if size < 1024:
+        return f"{size:.0f} Б"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.0f} КБ"
+    for unit in ("МБ", "ГБ"):
+        size /= 1024
+        if size < 1024 * 1024:
+            return f"{size / 1024:.1f} {unit}"
+    return f"{size / 1024 / 1024:.1f} ТБ"
+
+
+def preview(text, lines=PREVIEW_LINES, max_length=PREVIEW_MAX_LENGTH):
+    """First and last lines of text with the number of lines in between"""
+    all_lines = text.splitlines()
+    half = max_length // 2
+    if len(all_lines) <= lines * 2:
+        head, tail = all_lines, []
+    else:
+        head, tail = all_lines[:lines], all_lines[-lines:]
+
+    head_text = "\n".join(head)[:half]
+    tail_text = "\n".join(tail)[-half:]
+    if not tail:
+        return head_text
+    skipped = len(all_lines) - len(head) - len(tail)
+    return f"{head_text}\n... [{skipped} строк пропущено] ...\n{tail_text}"
+
+
+def _build_document(source):
+    """Write the output via source(fileobj) and gzip it if that pays off.
+
+    Returns (fileobj, size, compressed); both temporary files spill to disk
+    once they outgrow SPOOL_MAX_SIZE, so the output is never held as one string.
+    """
+    raw = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    source(raw)
+    raw_size = raw.tell()
+    raw.seek(0)
+
+    packed = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with gzip.GzipFile(fileobj=packed, mode='wb', compresslevel=6) as archive:
+        shutil.copyfileobj(raw, archive)
+    packed_size = packed.tell()
+
+    if packed_size < raw_size * GZIP_MIN_SAVING:
+        raw.close()
+        packed.seek(0)
+        return packed, packed_size, True
+
+    packed.close()
+    raw.seek(0)
+    return raw, raw_size, False
+
+
+def send_output_document(bot, chat_id, filename, source, caption=None):
+    """Upload the output written by source(fileobj) as a single document"""
+    with span('render'):
+        document, size, compressed = _build_document(source)
+    if compressed:
+        filename += ".gz"
+    try:
+        bot.send_document(
+            chat_id=chat_id,
+            document=document,
+            filename=filename,
+            caption=caption or f"📎 Полный вывод, {format_size(size)}"
+        )
+    finally:
+        document.close()
+
+
+def deliver_output(bot, chat_id, text, filename="output.txt", source=None, title="", reply_markup=None):
+    """Send command output inline if it is small, otherwise as a file.
+
+    Large output gets a short head/tail preview message and one document
+    upload. source(fileobj) writes the full output as bytes; by default
+    it is text itself.
+    """
+    if len(text) <= INLINE_LIMIT:
+        try:
+            bot.send_message(
+                chat_id=chat_id,
+                text=f"{title}```\n{text}\n```",
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=reply_markup
+            )
+        except Exception as e:
+            # Если не удалось отформатировать (например, из-за разметки), отправляем без разметки
+            logger.warning(f"Could not send formatted output: {e}")
+            bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+        return
+
+    with span('render'):
+        text_preview = preview(text)
+    bot.send_message(
+        chat_id=chat_id,
+        text=f"{title}```\n{text_preview}\n```\n📎 Вывод слишком длинный, полная версия во вложении",
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=reply_markup
+    )
+    if source is None:
+        source = lambda fileobj: fileobj.write(text.encode('utf-8'))
+    send_output_document(bot, chat_id, filename, source)
@@ -0,0 +1,229 @@
+import html
+import posixpath
+import stat
+import time
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import env_int
+from delivery import format_size
+from instrumentation import span
+from result_cache import ResultCache
+
+# Сколько списков каталогов хранится в памяти
+DEFAULT_MAX_LISTINGS = env_int('DIR_CACHE_SIZE', 8)
+# Список моложе стольких секунд показывается при /ls и переходах без обращения к серверу
+LISTING_TTL = env_int('DIR_CACHE_TTL', 30)
+# Листание и сортировка используют список, пока он в кэше, но не дольше этого
+LISTING_LIFETIME = 3600
+PAGE_SIZE = 20
+# Сколько сообщений со списками помнят свое положение (каталог, страница, сортировка)
+MAX_VIEWS = 64
+MAX_NAME_LENGTH = 48
+MAX_BUTTON_LENGTH = 28
+# Сколько запросов READDIR отправляется, не дожидаясь ответов: каждый ответ -
+# порядка сотни имен, и без этого большой каталог читается тысячей RTT
+READ_AHEADS = 64
+
+SORTS = {'name': "имя", 'size': "размер", 'mtime': "время"}
+
+DirEntry = namedtuple('DirEntry', ['name', 'size', 'mtime', 'kind'])
+
+
+def _kind(mode):
+    if mode is None:
+        return '?'
+    if stat.S_ISDIR(mode):
+        return 'd'
+    if stat.S_ISLNK(mode):
+        return 'l'
+    return '-'
+
+
+def _printable(name, limit):
+    """Name safe to show: control characters replaced, long names cut"""
+    name = ''.join(char if char.isprintable() else '?' for char in name)
+    return name if len(name) <= limit else name[:limit - 1] + '…'
+
+
+class Listing:
+    """Entries of one directory, with each sort order computed once on demand"""
+
+    def __init__(self, path, entries):
+        self.path = path
+        self.entries = entries
+        self.orders = {}
+
+    def ordered(self, sort):
+        order = self.orders.get(sort)
+        if order is None:
+            if sort == 'size':
+                key = lambda entry: (-entry.size, entry.name)
+            elif sort == 'mtime':
+                key = lambda entry: (-entry.mtime, entry.name)
+            else:
+                key = lambda entry: (entry.kind != 'd', entry.name)
+            order = self.orders[sort] = sorted(self.entries, key=key)
+        return order
+
+
+class _View:
+    """Position of one browser message: directory, sort and page"""
+
+    def __init__(self, path, sort='name'):
+        self.path = path
+        self.sort = sort
+        self.page = 0
+        # Подкаталоги текущей страницы по номерам кнопок
+        self.dirs = []
+
+
+class DirBrowser:
+    """Paged directory listings over SFTP.
+
+    A directory is listed once over SFTP into structured entries, with
+    pipelined READDIR requests (listdir_iter, the streaming listdir_attr),
+    and kept in an LRU cache; paging and sorting only slice the cached
+    sorted order, so even a directory of 100k entries pages without
+    another round trip. Each bot message with a listing keeps its own view.
+    """
+
+    def __init__(self, manager, max_listings=DEFAULT_MAX_LISTINGS):
+        self.manager = manager
+        self.cache = ResultCache(max_listings)
+        self.views = OrderedDict()
+        self.lock = Lock()
+
+    def fetch(self, path, max_age=LISTING_TTL):
+        """(True, Listing) of path, from the cache if younger than max_age, or (False, error).
+
+        max_age None takes any cached listing.
+        """
+        cached = self.cache.get(self.manager.server_ip, path)
+        if cached is not None:
+            listing, age = cached
+            if max_age is None or age < max_age:
+                return True, listing
+
+        success, sftp = self.manager.open_sftp()
+        if not success:
+            return False, sftp
+        try:
+            with span('sftp.listdir'):
+                absolute = sftp.normalize(path)
+                entries = [
+                    DirEntry(attribute.filename, attribute.st_size or 0, attribute.st_mtime or 0, _kind(attribute.st_mode))
+                    for attribute in sftp.listdir_iter(absolute, read_aheads=READ_AHEADS)
+                ]
+        except Exception as e:
+            return False, f"{path}: {e.strerror if isinstance(e, OSError) and e.strerror else str(e)}"
+        finally:
+            sftp.close()
+
+        listing = Listing(absolute, entries)
+        # Каталог доступен и по исходному пути, и по абсолютному
+        for key in {path, absolute}:
+            self.cache.put(self.manager.server_ip, key, listing, LISTING_LIFETIME)
+        return True, listing
+
+    def open(self, path):
+        """New view of path; returns (True, view) or (False, error)"""
+        success, listing = self.fetch(path)
+        if not success:
+            return False, listing
+        return True, _View(listing.path)
+
+    def remember(self, chat_id, message_id, view):
+        with self.lock:
+            self.views[(chat_id, message_id)] = view
+            self.views.move_to_end((chat_id, message_id))
+            while len(self.views) > MAX_VIEWS:
+                self.views.popitem(last=False)
+
+    def view(self, chat_id, message_id):
+        with self.lock:
+            return self.views.get((chat_id, message_id))
+
+    def navigate(self, view, action):
+        """Apply a keyboard action to view; returns (True, None) or (False, error).
+
+        Actions: page_<n>, sort_<key>, cd_<n>, up, refresh.
+        """
+        if action.startswith('page_'):
+            view.page = int(action[len('page_'):])
+            return True, None
+        if action.startswith('sort_'):
+            sort = action[len('sort_'):]
+            if sort in SORTS and sort != view.sort:
+                view.sort = sort
+                view.page = 0
+            return True, None
+        if action == 'refresh':
+            success, error = self.fetch(view.path, max_age=0)
+            return success, None if success else error
+
+        if action == 'up':
+            path = posixpath.dirname(view.path.rstrip('/')) or '/'
+        elif action.startswith('cd_'):
+            index = int(action[len('cd_'):])
+            if not 0 <= index < len(view.dirs):
+                return False, "Каталог не найден"
+            path = posixpath.join(view.path, view.dirs[index])
+        else:
+            return False, f"Unknown action: {action}"
+        success, listing = self.fetch(path)
+        if not success:
+            return False, listing
+        view.path = listing.path
+        view.page = 0
+        return True, None
+
+    def render(self, view):
+        """(True, (text, markup)) of the view's current page, or (False, error)"""
+        success, listing = self.fetch(view.path, max_age=None)
+        if not success:
+            return False, listing
+
+        entries = listing.ordered(view.sort)
+        pages = max(1, (len(entries) + PAGE_SIZE - 1) // PAGE_SIZE)
+        view.page = min(max(view.page, 0), pages - 1)
+        page = entries[view.page * PAGE_SIZE:(view.page + 1) * PAGE_SIZE]
+
+        lines = []
+        for entry in page:
+            size = "" if entry.kind == 'd' else format_size(entry.size)
+            modified = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.mtime))
+            suffix = {'d': '/', 'l': '@'}.get(entry.kind, '')
+            lines.append(f"{size:>9}  {modified}  {_printable(entry.name, MAX_NAME_LENGTH)}{suffix}")
+        header = (
+            f"📂 {html.escape(_printable(listing.path, 200))}\n"
+            f"элементов: {len(entries)}, стр. {view.page + 1}/{pages}, сортировка: {SORTS[view.sort]}"
+        )
+        body = "\n".join(lines) or "(пусто)"
+        text = f"{header}\n<pre>{html.escape(body)}</pre>"
+
+        view.dirs = [entry.name for entry in page if entry.kind == 'd']
+        buttons = [
+            InlineKeyboardButton(f"📁 {_printable(name, MAX_BUTTON_LENGTH)}", callback_data=f"ls_cd_{index}")
+            for index, name in enumerate(view.dirs)
+        ]
+        keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+
+        navigation = []
+        if listing.path != '/':
+            navigation.append(InlineKeyboardButton("⬆️ ..", callback_data="ls_up"))
+        if view.page > 0:
+            navigation.append(InlineKeyboardButton("⏮", callback_data="ls_page_0"))
+            navigation.append(InlineKeyboardButton("◀️", callback_data=f"ls_page_{view.page - 1}"))
+        if view.page < pages - 1:
+            navigation.append(InlineKeyboardButton("▶️", callback_data=f"ls_page_{view.page + 1}"))
+            navigation.append(InlineKeyboardButton("⏭", callback_data=f"ls_page_{pages - 1}"))
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([
+            InlineKeyboardButton(f"• {label}" if sort == view.sort else label, callback_data=f"ls_sort_{sort}")
+            for sort, label in SORTS.items()
+        ] + [InlineKeyboardButton("🔄", callback_data="ls_refresh")])
+        return True, (text, InlineKeyboardMarkup(keyboard))
@@ -0,0 +1,167 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from telegram.utils.helpers import escape_markdown
+
+from config import env_int
+from ssh_manager import SSHManager
+
+# Максимальное число одновременных подключений при рассылке команды
+DEFAULT_MAX_WORKERS = env_int('FLEET_MAX_WORKERS', 10)
+DEFAULT_FLEET_TIMEOUT = env_int('FLEET_COMMAND_TIMEOUT', 60)
+
+HostResult = namedtuple('HostResult', ['host', 'exit_status', 'output', 'duration'])
+
+
+def parse_host_groups(value):
+    """Parse "web=10.0.0.1,10.0.0.2;db=10.0.1.5" into {group: [hosts]}"""
+    groups = {}
+    for group_spec in (value or '').split(';'):
+        if '=' not in group_spec:
+            continue
+        name, hosts = group_spec.split('=', 1)
+        hosts = [host.strip() for host in hosts.split(',') if host.strip()]
+        if name.strip() and hosts:
+            groups[name.strip()] = hosts
+    return groups
+
+
+class Fleet:
+    """Runs one command on every host of a group over a bounded worker pool"""
+
+    def __init__(self, groups, credentials, max_workers=DEFAULT_MAX_WORKERS):
+        self.groups = groups
+        # Логин, пароль и ключ берем у основного менеджера, чтобы пароль,
+        # заданный через /password, действовал и для группы
+        self.credentials = credentials
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fleet')
+        # Подключения к хостам переиспользуются между вызовами
+        self.managers = {}
+        # Число выполняющихся команд на менеджере и менеджеры, вытесненные
+        # из пула, но еще занятые
+        self.busy = {}
+        self.retired = set()
+        self.managers_lock = Lock()
+
+    @classmethod
+    def from_env(cls, credentials):
+        return cls(parse_host_groups(os.getenv('HOST_GROUPS')), credentials)
+
+    def _acquire_manager(self, host):
+        """Manager for host, counted as busy until _release_manager"""
+        stale = None
+        with self.managers_lock:
+            manager = self.managers.get(host)
+            if manager is not None and manager.password != self.credentials.password:
+                # Пароль поменяли через /password - подключаемся новым менеджером,
+                # старый закроется, когда его перестанут использовать
+                stale = self._retire(host, manager)
+                manager = None
+            if manager is None:
+                manager = SSHManager(
+                    server_ip=host,
+                    username=self.credentials.username,
+                    password=self.credentials.password,
+                    key_path=self.credentials.key_path
+                )
+                self.managers[host] = manager
+            self.busy[manager] = self.busy.get(manager, 0) + 1
+        if stale:
+            stale.disconnect()
+        return manager
+
+    def _release_manager(self, manager):
+        with self.managers_lock:
+            self.busy[manager] -= 1
+            if self.busy[manager]:
+                return
+            del self.busy[manager]
+            if manager not in self.retired:
+                return
+            self.retired.discard(manager)
+        manager.disconnect()
+
+    def _retire(self, host, manager):
+        """Drop manager from the pool (under managers_lock); returns it if idle.
+
+        A manager can be shared by concurrent /fleet calls, so it is
+        closed only once none of them uses it anymore.
+        """
+        if self.managers.get(host) is manager:
+            del self.managers[host]
+        if self.busy.get(manager):
+            self.retired.add(manager)
+            return None
+        return manager
+
+    def _run_on_host(self, host, command, timeout):
+        start_time = time.monotonic()
+        manager = self._acquire_manager(host)
+        try:
+            exit_status, output, error = manager.run_command(command, timeout=timeout)
+            if exit_status is None:
+                # Следующий вызов подключится заново
+                with self.managers_lock:
+                    self._retire(host, manager)
+        finally:
+            self._release_manager(manager)
+        return HostResult(host, exit_status, output + error, time.monotonic() - start_time)
+
+    def run(self, group, command, timeout=DEFAULT_FLEET_TIMEOUT):
+        """Run command on all hosts of group concurrently, results in group order"""
+        hosts = self.groups.get(group)
+        if not hosts:
+            raise KeyError(group)
+
+        futures = [self.executor.submit(self._run_on_host, host, command, timeout) for host in hosts]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        """Stop the worker pool and close all host connections"""
+        self.executor.shutdown(wait=False)
+        with self.managers_lock:
+            managers = list(self.managers.values()) + list(self.retired)
+            self.managers.clear()
+            self.retired.clear()
+        for manager in managers:
+            manager.disconnect()
+
+
+def group_results(results):
+    """Group host results with identical output, largest group first"""
+    groups = {}
+    for result in results:
+        groups.setdefault(result.output.strip(), []).append(result)
+    return sorted(groups.items(), key=lambda item: -len(item[1]))
+
+
+def _format_host(result):
+    status = "нет связи" if result.exit_status is None else f"код {result.exit_status}"
+    return f"{escape_markdown(result.host)} ({status}, {result.duration:.1f} с)"
+
+
+def format_results(group, command, results, max_length=4000):
+    """Render aggregated fleet results as a compact Markdown reply"""
+    failed = sum(1 for result in results if result.exit_status != 0)
+    slowest = max((result.duration for result in results), default=0)
+
+    # Команда и имена задаются пользователем: "_" или "`" в них ломали разметку
+    text = f"🖥 {escape_markdown(command)} на группе *{escape_markdown(group)}*: {len(results)} хостов, "
+    text += f"ошибок: {failed}, {slowest:.1f} с\n"
+
+    for output, host_results in group_results(results):
+        hosts = ", ".join(_format_host(result) for result in host_results)
+        header = f"\n*{len(host_results)}×* {hosts}\n"
+        room = max_length - len(text) - len(header) - 16
+        if room < 100:
+            text += "\n...\n[Вывод слишком длинный и был обрезан]"
+            break
+        output = output or 'Нет вывода'
+        if len(output) > room:
+            output = output[:room] + "\n..."
+        text += f"{header}```\n{output}\n```"
+
+    return text
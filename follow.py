@@ -0,0 +1,250 @@
+import html
+import logging
+import select
+import shlex
+import time
+from collections import deque
+from threading import Lock, Thread
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
+
+from config import env_int
+from sanitizer import sanitize
+
+# Как часто новые строки попадают в чат
+FLUSH_INTERVAL = 2.0
+# Слежение само останавливается через столько секунд
+MAX_DURATION = env_int('FOLLOW_TIMEOUT', 3600)
+# Строк, ждущих отправки; если Telegram не успевает, старые выбрасываются
+MAX_PENDING_LINES = 500
+MAX_MESSAGE_LENGTH = 3500
+INITIAL_LINES = 20
+READ_CHUNK_SIZE = 65536
+OPEN_TIMEOUT = 10
+
+STOP_KEYBOARD = InlineKeyboardMarkup([[InlineKeyboardButton("⏹ Остановить", callback_data="follow_stop")]])
+
+
+def follow_command(source, pattern=None):
+    """Remote command that follows a file, a docker container or a systemd unit.
+
+    Lines are filtered by grep on the server, so only matches are sent.
+    """
+    quoted = shlex.quote(source)
+    command = (
+        f"if [ -e {quoted} ]; then exec tail -n {INITIAL_LINES} -F {quoted}; "
+        f"elif docker inspect {quoted} >/dev/null 2>&1; then exec docker logs -f --tail {INITIAL_LINES} {quoted}; "
+        f"else exec journalctl -f -n {INITIAL_LINES} -o short -u {quoted}; fi"
+    )
+    command = f"{{ {command}; }} 2>&1"
+    if pattern:
+        command += f" | grep --line-buffered -E -e {shlex.quote(pattern)}"
+    return command
+
+
+class Follower:
+    """Follows one remote log and posts its new lines to a chat.
+
+    A single thread reads the channel and every FLUSH_INTERVAL appends the
+    collected lines to the current message, starting a new one when it is
+    full. While the previous request is still in the send queue nothing
+    new is sent; lines pile up to MAX_PENDING_LINES and older ones are
+    dropped and counted, so a chatty log cannot outrun the bot.
+    bot is expected to be a send_queue.QueuedBot.
+    """
+
+    def __init__(self, bot, chat_id, channel, title, on_finish=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.channel = channel
+        self.title = title
+        self.on_finish = on_finish
+        self.pending = deque()
+        self.dropped = 0
+        self.received = 0
+        self.message_id = None
+        self.text = ""
+        self.request = None
+        self.stopping = False
+        self.stop_reason = None
+        self.logger = logging.getLogger(__name__)
+        self.thread = Thread(target=self._run, name=f'follow-{chat_id}', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, reason="остановлено"):
+        self.stop_reason = self.stop_reason or reason
+        self.stopping = True
+        # Закрытие канала снимает удаленный процесс (SIGHUP через pty)
+        self.channel.close()
+
+    def _run(self):
+        remainder = b''
+        started = time.monotonic()
+        next_flush = started + FLUSH_INTERVAL
+        try:
+            while not self.stopping:
+                now = time.monotonic()
+                if now - started > MAX_DURATION:
+                    self.stop_reason = f"прошло {MAX_DURATION // 60} мин"
+                    break
+                if now >= next_flush:
+                    self._flush()
+                    next_flush = now + FLUSH_INTERVAL
+
+                select.select([self.channel], [], [], max(0, next_flush - now))
+                if not self.channel.recv_ready():
+                    if self.channel.exit_status_ready() or self.channel.closed:
+                        self.stop_reason = self.stop_reason or "процесс на сервере завершился"
+                        break
+                    continue
+
+                data = self.channel.recv(READ_CHUNK_SIZE)
+                if not data:
+                    self.stop_reason = self.stop_reason or "процесс на сервере завершился"
+                    break
+                *lines, remainder = (remainder + data).split(b'\n')
+                self._add(lines)
+        except Exception as e:
+            self.logger.warning(f"Follow in chat {self.chat_id} failed: {str(e)}")
+            self.stop_reason = self.stop_reason or f"ошибка: {str(e)}"
+        finally:
+            self.channel.close()
+            if remainder:
+                self._add([remainder])
+            self._wait_for_request()
+            self._flush(final=True)
+            if self.on_finish:
+                self.on_finish(self)
+
+    def _add(self, lines):
+        self.received += len(lines)
+        self.pending.extend(lines)
+        overflow = len(self.pending) - MAX_PENDING_LINES
+        if overflow > 0:
+            # Telegram не успевает - выбрасываем самые старые строки
+            for _ in range(overflow):
+                self.pending.popleft()
+            self.dropped += overflow
+
+    def _wait_for_request(self):
+        if self.request is not None and not self.request.done():
+            try:
+                self.request.result(timeout=10)
+            except Exception:
+                pass
+
+    def _flush(self, final=False):
+        # Предыдущая отправка еще в очереди - копим строки до следующего раза
+        if self.request is not None:
+            if not self.request.done():
+                return
+            if self.message_id is None:
+                try:
+                    self.message_id = self.request.result().message_id
+                except Exception:
+                    # Сообщение не отправилось - начнем новое
+                    self.text = ""
+            self.request = None
+        if not self.pending and not final:
+            return
+
+        batch = self._take_batch()
+        if self.message_id is not None and len(self.text) + len(batch) + 1 > MAX_MESSAGE_LENGTH:
+            # Текущее сообщение заполнено - продолжаем в новом
+            self.message_id = None
+            self.text = ""
+        if batch:
+            self.text = f"{self.text}\n{batch}" if self.text else batch
+
+        footer = f"⏹ {self.stop_reason}, строк: {self.received}" if final else f"▶️ строк: {self.received}"
+        body = f"📜 {html.escape(self.title)}\n<pre>{html.escape(self.text or '...')}</pre>\n{footer}"
+        markup = None if final else STOP_KEYBOARD
+        # Отправку не ждем: чтение канала не должно стоять из-за Telegram
+        if self.message_id is None:
+            self.request = self.bot.send_message(
+                chat_id=self.chat_id, text=body, parse_mode=ParseMode.HTML, reply_markup=markup,
+                wait=False, coalesce=False
+            )
+        else:
+            self.request = self.bot.edit_message_text(
+                chat_id=self.chat_id, message_id=self.message_id, text=body,
+                parse_mode=ParseMode.HTML, reply_markup=markup, wait=False
+            )
+
+    def _take_batch(self):
+        """Newest pending lines that fit in one message, with a note about the dropped ones"""
+        lines = list(self.pending)
+        self.pending.clear()
+        budget = MAX_MESSAGE_LENGTH - 100
+        keep = 0
+        for line in reversed(lines):
+            budget -= len(line) + 1
+            if budget < 0:
+                break
+            keep += 1
+        if lines and not keep:
+            # Одна строка длиннее сообщения - показываем ее конец
+            lines[-1] = lines[-1][-(MAX_MESSAGE_LENGTH - 100):]
+            keep = 1
+        self.dropped += len(lines) - keep
+
+        batch = sanitize(b'\n'.join(lines[len(lines) - keep:]).decode('utf-8', errors='replace').replace('\r', ''))
+        if self.dropped:
+            batch = f"… пропущено строк: {self.dropped}\n{batch}".rstrip('\n')
+            self.dropped = 0
+        return batch
+
+
+class FollowManager:
+    """At most one follow per chat, each on its own channel of the shared connection"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.followers = {}
+        self.lock = Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def start(self, bot, chat_id, source, pattern=None):
+        """Start following source in chat_id; returns (success, error)"""
+        self.stop(chat_id)
+        if not self.manager.ensure_connected():
+            return False, "Failed to connect to server"
+
+        try:
+            channel = self.manager.client.get_transport().open_session(timeout=OPEN_TIMEOUT)
+            # С pty удаленный процесс получит SIGHUP, когда канал закроется
+            channel.get_pty(width=500)
+            channel.exec_command(follow_command(source, pattern))
+        except Exception as e:
+            self.logger.error(f"Error starting follow: {str(e)}")
+            return False, f"Error: {str(e)}"
+
+        title = source + (f" | grep {pattern}" if pattern else "")
+        follower = Follower(bot, chat_id, channel, title, on_finish=self._finished)
+        with self.lock:
+            self.followers[chat_id] = follower
+        follower.start()
+        return True, None
+
+    def stop(self, chat_id):
+        """Stop the chat's follow; returns False if there was none"""
+        with self.lock:
+            follower = self.followers.pop(chat_id, None)
+        if follower is None:
+            return False
+        follower.stop()
+        return True
+
+    def stop_all(self):
+        with self.lock:
+            followers = list(self.followers.values())
+            self.followers.clear()
+        for follower in followers:
+            follower.stop()
+
+    def _finished(self, follower):
+        with self.lock:
+            if self.followers.get(follower.chat_id) is follower:
+                del self.followers[follower.chat_id]
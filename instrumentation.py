@@ -0,0 +1,197 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+from config import env_int
+
+# Порт HTTP-эндпоинта с метриками в формате Prometheus; 0 - не запускать
+METRICS_PORT = env_int('METRICS_PORT', 0)
+# По умолчанию эндпоинт доступен только с этой машины
+METRICS_ADDRESS = os.getenv('METRICS_ADDRESS', '127.0.0.1')
+PREFIX = 'sshbot'
+
+# Верхние границы корзин гистограмм в секундах
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Известные этапы в порядке вывода /metrics; этапы api.<метод> добавляются по мере вызовов
+STAGES = (
+    'handler.queue', 'handler.run',
+    'ssh.connect', 'ssh.channel_open', 'ssh.send', 'ssh.first_byte', 'ssh.command', 'ssh.exec',
+    'sftp.listdir',
+    'sanitize', 'render', 'api.queue',
+)
+
+COUNTERS = {
+    'ssh.bytes_received': "Bytes read from SSH channels",
+    'ssh.bytes_sent': "Bytes written to SSH channels",
+    'ssh.reconnects': "Successful reconnects after a lost connection",
+    'ssh.connect_failures': "Failed connection attempts",
+    'ssh.timeouts': "Commands that did not finish in time",
+    'api.retries': "Bot API calls retried after a flood limit",
+    'api.errors': "Bot API calls that failed",
+    'handler.errors': "Background handlers that raised",
+    'scheduler.rejected': "Tasks rejected because the user's queue was full",
+}
+
+
+class Histogram:
+    """Observation counts per bucket of BUCKETS, with their sum"""
+
+    def __init__(self):
+        # Последняя корзина - все, что больше BUCKETS[-1]
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction):
+        """Estimate of the fraction quantile, interpolated within its bucket.
+
+        Never exceeds the largest observation, so coarse buckets do not
+        inflate the tail of a few fast samples.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(BUCKETS):
+                    return self.max
+                lower = BUCKETS[index - 1] if index else 0.0
+                return min(lower + (BUCKETS[index] - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class Registry:
+    """Stage timings and counters of the whole process"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.lock = Lock()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, stage):
+        """Time the with-block as stage, even if it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def _stage_order(self):
+        known = [stage for stage in STAGES if stage in self.histograms]
+        return known + sorted(stage for stage in self.histograms if stage not in STAGES)
+
+    def exposition(self):
+        """All metrics in the Prometheus text format"""
+        with self.lock:
+            lines = [
+                f"# HELP {PREFIX}_stage_seconds Time spent in each stage of command handling",
+                f"# TYPE {PREFIX}_stage_seconds histogram",
+            ]
+            for stage in self._stage_order():
+                histogram = self.histograms[stage]
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            for name in sorted(set(COUNTERS) | set(self.counters)):
+                metric = f"{PREFIX}_{name.replace('.', '_')}_total"
+                lines.append(f"# HELP {metric} {COUNTERS.get(name, name)}")
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {self.counters.get(name, 0)}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Text table of stage latencies and counters for the /metrics command"""
+        with self.lock:
+            rows = [
+                (stage, histogram.count, histogram.quantile(0.5), histogram.quantile(0.95), histogram.sum / histogram.count)
+                for stage, histogram in ((stage, self.histograms[stage]) for stage in self._stage_order())
+            ]
+            counters = dict(self.counters)
+
+        lines = [f"{'этап':<22}{'n':>7}{'p50':>9}{'p95':>9}{'сред.':>9}"]
+        for stage, count, p50, p95, mean in rows:
+            lines.append(
+                f"{stage:<22}{count:>7}{format_seconds(p50):>9}{format_seconds(p95):>9}{format_seconds(mean):>9}"
+            )
+        if not rows:
+            lines.append("замеров пока нет")
+        lines.append("")
+        for name in COUNTERS:
+            value = counters.get(name, 0)
+            lines.append(f"{name:<22}{value:>14}")
+        return "\n".join(lines)
+
+
+def format_seconds(seconds):
+    """Short latency, e.g. "850мкс", "12мс" or "1.5с" """
+    if seconds < 0.001:
+        return f"{seconds * 1e6:.0f}мкс"
+    if seconds < 1:
+        return f"{seconds * 1000:.3g}мс"
+    return f"{seconds:.3g}с"
+
+
+registry = Registry()
+observe = registry.observe
+count = registry.count
+span = registry.span
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=METRICS_PORT, address=METRICS_ADDRESS):
+    """Serve /metrics on address:port in a daemon thread; returns the server or None"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    except OSError as e:
+        logging.getLogger(__name__).error(f"Could not start metrics endpoint on {address}:{port}: {str(e)}")
+        return None
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
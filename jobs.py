@@ -0,0 +1,220 @@
+import logging
+import re
+import secrets
+import shlex
+from collections import namedtuple
+from threading import Event, Lock, Thread
+
+from telegram.utils.helpers import escape_markdown
+
+from config import env_int
+from sanitizer import sanitize
+from status_probe import format_duration
+
+# Как часто проверять, завершились ли запущенные задачи
+POLL_INTERVAL = env_int('JOB_POLL_INTERVAL', 10)
+# Каталоги задач старше этого числа дней удаляются при запуске новой задачи
+RETENTION_DAYS = env_int('JOB_RETENTION_DAYS', 7)
+JOBS_DIR = '$HOME/.tgjobs'
+SUMMARY_LINES = 20
+COMMAND_TIMEOUT = 30
+# Сколько проверок подряд пытаться отправить уведомление о завершении
+NOTIFY_ATTEMPTS = 5
+
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{6}')
+
+JobStatus = namedtuple('JobStatus', ['job_id', 'state', 'exit_status', 'started', 'finished', 'command'])
+
+# Задача выполняется в своей группе процессов (setsid), чтобы kill остановил
+# и ее дочерние процессы; вывод пишется в out, код завершения - в exit
+START_SCRIPT = """D="{jobs_dir}/{job_id}"
+mkdir -p "$D" && cd && printf '%s\\n' {command} > "$D/cmd" && date +%s > "$D/start" || exit 1
+find "{jobs_dir}" -mindepth 1 -maxdepth 1 -mtime +{retention} -exec rm -rf {{}} + 2>/dev/null
+nohup $(command -v setsid) sh -c '"${{SHELL:-sh}}" -c "$1" > "$2/out" 2>&1 < /dev/null
+echo $? > "$2/exit.tmp"; date +%s > "$2/end"; mv "$2/exit.tmp" "$2/exit"' sh {command} "$D" > /dev/null 2>&1 < /dev/null &
+echo $! > "$D/pid"
+"""
+
+# Строка на задачу: id|состояние|код|начало|конец|команда
+STATUS_SCRIPT = """cd "{jobs_dir}" 2>/dev/null || exit 0
+for d in {job_ids}; do
+  [ -d "$d" ] || continue
+  code=""
+  if [ -f "$d/exit" ]; then state=done; code=$(cat "$d/exit")
+  elif kill -0 "$(cat "$d/pid" 2>/dev/null)" 2>/dev/null; then state=running
+  else state=lost; fi
+  printf '%s|%s|%s|%s|%s|%s\\n' "$d" "$state" "$code" "$(cat "$d/start" 2>/dev/null)" \\
+    "$(cat "$d/end" 2>/dev/null)" "$(head -n 1 "$d/cmd" 2>/dev/null | cut -c 1-200)"
+done
+"""
+
+# Если процесс убит вместе с оберткой, код записываем сами: 143 = 128 + SIGTERM
+KILL_SCRIPT = """D="{jobs_dir}/{job_id}"
+P=$(cat "$D/pid") || exit 1
+kill -TERM "-$P" 2>/dev/null || kill -TERM "$P" || exit 1
+sleep 1
+[ -f "$D/exit" ] || {{ echo 143 > "$D/exit"; date +%s > "$D/end"; }}
+"""
+
+TAIL_SCRIPT = 'tail -n {lines} "{jobs_dir}/{job_id}/out"'
+
+
+def _int_or_none(value):
+    return int(value) if value.strip().lstrip('-').isdigit() else None
+
+
+def parse_statuses(output):
+    statuses = []
+    for line in output.splitlines():
+        fields = line.split('|', 5)
+        if len(fields) < 6:
+            continue
+        job_id, state, exit_status, started, finished, command = fields
+        statuses.append(JobStatus(
+            job_id, state, _int_or_none(exit_status), _int_or_none(started), _int_or_none(finished), command
+        ))
+    return statuses
+
+
+def format_job(status):
+    """One line of /jobs output"""
+    if status.state == 'running':
+        icon, state = "⏳", "выполняется"
+    elif status.state == 'lost':
+        icon, state = "❔", "процесс пропал"
+    elif status.exit_status == 0:
+        icon, state = "✅", "код 0"
+    else:
+        icon, state = "❌", f"код {status.exit_status}"
+    if status.started and status.finished:
+        state += f", {format_duration(status.finished - status.started)}"
+    # Команда - произвольный текст: в `...` обратная кавычка сломала бы разметку
+    return f"{icon} `{status.job_id}` {state}: {escape_markdown(status.command)}"
+
+
+class JobManager:
+    """Detached remote jobs with output spooled to ~/.tgjobs/<id>/out.
+
+    One watcher thread checks all running jobs with a single exec per
+    poll and calls notify(chat_id, title, output) when a job finishes.
+    """
+
+    def __init__(self, manager, notify, poll_interval=POLL_INTERVAL):
+        self.manager = manager
+        self.notify = notify
+        self.poll_interval = poll_interval
+        # id задачи -> чат, которому сообщить о завершении
+        self.watched = {}
+        # id задачи -> сколько раз не удалось отправить уведомление
+        self.failures = {}
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.stopping = False
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def _run(self, script, **kwargs):
+        return self.manager.run_command(script.format(jobs_dir=JOBS_DIR, **kwargs), timeout=COMMAND_TIMEOUT)
+
+    def start_job(self, command, chat_id):
+        """Start command detached; returns (True, job id) or (False, error)"""
+        job_id = secrets.token_hex(3)
+        exit_status, output, error = self._run(
+            START_SCRIPT, job_id=job_id, command=shlex.quote(command), retention=RETENTION_DAYS
+        )
+        if exit_status != 0:
+            return False, error or output or "Could not start job"
+
+        with self.lock:
+            self.watched[job_id] = chat_id
+            if self.thread is None:
+                self.thread = Thread(target=self._watch, name='job-watcher', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return True, job_id
+
+    def list_jobs(self):
+        """(True, [JobStatus]) for all jobs on the host, newest first, or (False, error)"""
+        exit_status, output, error = self._run(STATUS_SCRIPT, job_ids='*')
+        if exit_status is None:
+            return False, error
+        statuses = parse_statuses(output)
+        statuses.sort(key=lambda status: status.started or 0, reverse=True)
+        return True, statuses
+
+    def tail(self, job_id, lines=SUMMARY_LINES):
+        """(True, last lines of the job output) or (False, error)"""
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return False, f"Invalid job id: {job_id}"
+        exit_status, output, error = self._run(TAIL_SCRIPT, job_id=job_id, lines=int(lines))
+        if exit_status != 0:
+            return False, error or f"Job {job_id} not found"
+        return True, sanitize(output)
+
+    def kill(self, job_id):
+        """Send SIGTERM to the job's process group; returns (success, message)"""
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            return False, f"Invalid job id: {job_id}"
+        exit_status, output, error = self._run(KILL_SCRIPT, job_id=job_id)
+        if exit_status != 0:
+            return False, error or f"Job {job_id} is not running"
+        return True, output
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+
+    def _watch(self):
+        while not self.stopping:
+            with self.lock:
+                job_ids = list(self.watched)
+            if not job_ids:
+                # Нечего проверять - ждем новую задачу
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            try:
+                self._check(job_ids)
+            except Exception as e:
+                self.logger.exception(f"Error checking jobs: {str(e)}")
+
+    def _check(self, job_ids):
+        exit_status, output, error = self._run(STATUS_SCRIPT, job_ids=' '.join(job_ids))
+        if exit_status is None:
+            # Сервер недоступен - проверим в следующий раз
+            self.logger.warning(f"Could not check jobs: {error}")
+            return
+
+        statuses = parse_statuses(output)
+        found = {status.job_id for status in statuses}
+        with self.lock:
+            for job_id in job_ids:
+                if job_id not in found:
+                    # Каталог задачи удалили - следить больше не за чем
+                    self.logger.warning(f"Job {job_id} disappeared from the server")
+                    self.watched.pop(job_id, None)
+
+        for status in statuses:
+            if status.state == 'running':
+                continue
+            with self.lock:
+                chat_id = self.watched.get(status.job_id)
+            if chat_id is None:
+                continue
+            success, tail = self.tail(status.job_id)
+            title = f"🏁 Задача `{status.job_id}` завершена\n{format_job(status)}\n"
+            try:
+                self.notify(chat_id, title, tail if success else "")
+            except Exception as e:
+                # Задача остается под наблюдением: уведомление повторится при следующей проверке
+                attempts = self.failures.get(status.job_id, 0) + 1
+                self.logger.warning(f"Could not notify about job {status.job_id} (attempt {attempts}): {str(e)}")
+                if attempts < NOTIFY_ATTEMPTS:
+                    self.failures[status.job_id] = attempts
+                    continue
+            with self.lock:
+                self.watched.pop(status.job_id, None)
+            self.failures.pop(status.job_id, None)
@@ -0,0 +1,248 @@
+import logging
+import math
+import re
+import select
+import time
+from array import array
+from threading import Event, Lock, Thread
+
+from config import env_int
+from status_probe import PROBE_SCRIPT, PROBE_TIMEOUT, parse_snapshot
+
+# Интервал опроса сервера в секундах; 0 отключает сбор метрик
+SAMPLE_INTERVAL = env_int('METRICS_INTERVAL', 15)
+# Сколько точек хранится по каждой метрике (5760 по 15 с - сутки)
+HISTORY_SIZE = env_int('METRICS_HISTORY', 5760)
+# Пауза перед повторным открытием канала растет до этого значения
+MAX_RETRY_DELAY = 300
+READ_CHUNK_SIZE = 32768
+BLOCK_END = b'@@end\n'
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+SPARK_WIDTH = 30
+
+# Метрика -> (описание, единица измерения)
+METRICS = {
+    'load': ("Load average (1 мин)", ""),
+    'cpu': ("Загрузка CPU", "%"),
+    'mem': ("Занято памяти", "%"),
+    'swap': ("Занято swap", "%"),
+    'disk': ("Самый заполненный диск", "%"),
+    'rx': ("Входящий трафик", "КБ/с"),
+    'tx': ("Исходящий трафик", "КБ/с"),
+}
+
+
+class TimeSeries:
+    """Fixed-size ring buffer of (timestamp, value) samples.
+
+    Both columns are preallocated arrays of doubles, so memory does not
+    grow with uptime: the oldest sample is overwritten by the newest.
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.times = array('d', bytes(8 * size))
+        self.values = array('d', bytes(8 * size))
+        self.size = size
+        self.count = 0
+        self.next = 0
+
+    def append(self, timestamp, value):
+        self.times[self.next] = timestamp
+        self.values[self.next] = value
+        self.next = (self.next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def window(self, since):
+        """Samples taken at or after since, oldest first"""
+        samples = []
+        # Идем от новых к старым, пока не выйдем за начало окна
+        for offset in range(1, self.count + 1):
+            index = self.next - offset
+            if self.times[index] < since:
+                break
+            samples.append((self.times[index], self.values[index]))
+        samples.reverse()
+        return samples
+
+
+def _metric_values(snapshot, previous):
+    """Metric values of a snapshot; rates need the previous one"""
+    values = {
+        'load': snapshot.load[0],
+        'mem': 100.0 * snapshot.memory_used / snapshot.memory_total if snapshot.memory_total else 0.0,
+        'swap': 100.0 * snapshot.swap_used / snapshot.swap_total if snapshot.swap_total else 0.0,
+        'disk': max((100.0 * mount.used / mount.total for mount in snapshot.mounts), default=0.0),
+    }
+    if snapshot.cpu_percent is not None:
+        values['cpu'] = snapshot.cpu_percent
+
+    elapsed = snapshot.taken_at - previous.taken_at if previous else 0
+    # После перезагрузки счетчики сбрасываются - такой интервал пропускаем
+    if elapsed > 0 and snapshot.net_received >= previous.net_received and snapshot.net_sent >= previous.net_sent:
+        values['rx'] = (snapshot.net_received - previous.net_received) / 1024 / elapsed
+        values['tx'] = (snapshot.net_sent - previous.net_sent) / 1024 / elapsed
+    return values
+
+
+class MetricsSampler:
+    """Background collector of server metrics.
+
+    One exec channel runs PROBE_SCRIPT in a remote loop, so the server
+    forks only the probe itself every interval and no new channel is set
+    up per sample. Parsed samples go into one TimeSeries per metric.
+    """
+
+    def __init__(self, manager, interval=SAMPLE_INTERVAL, history=HISTORY_SIZE):
+        self.manager = manager
+        self.interval = interval
+        self.series = {name: TimeSeries(history) for name in METRICS}
+        self.latest = None
+        # Вызываются в потоке сборщика с (snapshot, values) каждой новой точки
+        self.listeners = []
+        self.lock = Lock()
+        self.stopping = Event()
+        self.channel = None
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def start(self):
+        if self.interval <= 0 or self.thread is not None:
+            return
+        self.thread = Thread(target=self._run, name='metrics-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        channel = self.channel
+        if channel is not None:
+            channel.close()
+
+    def window(self, metric, seconds):
+        """Samples of metric from the last seconds, oldest first"""
+        with self.lock:
+            return self.series[metric].window(time.time() - seconds)
+
+    def _run(self):
+        failures = 0
+        while not self.stopping.is_set():
+            if self._sample_loop():
+                failures = 0
+            else:
+                failures += 1
+            delay = min(self.interval * 2 ** max(failures - 1, 0), MAX_RETRY_DELAY)
+            self.stopping.wait(delay)
+
+    def _sample_loop(self):
+        """Read samples from one remote loop until it breaks; True if any arrived"""
+        if not self.manager.ensure_connected():
+            return False
+
+        command = f"while :; do {PROBE_SCRIPT}; echo @@end; sleep {self.interval}; done"
+        received = False
+        buffer = b''
+        try:
+            self.channel = self.manager.client.get_transport().open_session(timeout=PROBE_TIMEOUT)
+            self.channel.exec_command(command)
+            deadline = time.monotonic() + self.interval + PROBE_TIMEOUT
+
+            while not self.stopping.is_set():
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    self.logger.warning("Metrics probe stalled, reopening the channel")
+                    return received
+                select.select([self.channel], [], [], wait)
+                # stderr тоже будит select: без чтения цикл крутится вхолостую,
+                # а заполненное окно канала останавливает удаленный цикл
+                if self.channel.recv_stderr_ready():
+                    self.logger.debug(f"Metrics probe stderr: {self.channel.recv_stderr(READ_CHUNK_SIZE)!r}")
+                    continue
+                if self.channel.recv_ready():
+                    data = self.channel.recv(READ_CHUNK_SIZE)
+                elif self.channel.exit_status_ready() or self.channel.closed:
+                    return received
+                else:
+                    continue
+                if not data:
+                    return received
+
+                buffer += data
+                *blocks, buffer = buffer.split(BLOCK_END)
+                for block in blocks:
+                    self._record(block.decode('utf-8', errors='replace'))
+                    received = True
+                if blocks:
+                    deadline = time.monotonic() + self.interval + PROBE_TIMEOUT
+        except Exception as e:
+            self.logger.warning(f"Metrics sampling interrupted: {str(e)}")
+        finally:
+            if self.channel is not None:
+                self.channel.close()
+                self.channel = None
+        return received
+
+    def _record(self, output):
+        try:
+            snapshot = parse_snapshot(output, self.latest)
+        except ValueError as e:
+            self.logger.warning(str(e))
+            return
+
+        values = _metric_values(snapshot, self.latest)
+        with self.lock:
+            for name, value in values.items():
+                self.series[name].append(snapshot.taken_at, value)
+            self.latest = snapshot
+
+        for listener in self.listeners:
+            try:
+                listener(snapshot, values)
+            except Exception as e:
+                self.logger.exception(f"Metrics listener failed: {str(e)}")
+
+
+def parse_window(text):
+    """Window length like "90s", "30m", "6h" or "1d" in seconds, None if invalid.
+
+    The unit is required: a bare number is ambiguous and rejected.
+    """
+    match = re.fullmatch(r'(\d+)([smhd])', text.strip().lower())
+    if not match:
+        return None
+    number, unit = match.groups()
+    return int(number) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[unit]
+
+
+def sparkline(values, width=SPARK_WIDTH):
+    """Values averaged into width buckets and drawn with block characters"""
+    if len(values) > width:
+        step = len(values) / width
+        buckets = [values[int(i * step):int((i + 1) * step)] for i in range(width)]
+        values = [math.fsum(bucket) / len(bucket) for bucket in buckets]
+    low, high = min(values), max(values)
+    span = high - low
+    if not span:
+        return SPARK_CHARS[0] * len(values)
+    top = len(SPARK_CHARS) - 1
+    return "".join(SPARK_CHARS[round((value - low) / span * top)] for value in values)
+
+
+def format_value(value, unit):
+    return f"{value:.2f}" if not unit else f"{value:.1f}{' ' if unit != '%' else ''}{unit}"
+
+
+def format_graph(metric, samples):
+    """Markdown block with a sparkline and min/avg/max of samples"""
+    title, unit = METRICS[metric]
+    if not samples:
+        return f"*{title}*: нет данных"
+    values = [value for _, value in samples]
+    average = math.fsum(values) / len(values)
+    stats = "  ".join(
+        f"{name} {format_value(value, unit)}"
+        for name, value in (("мин", min(values)), ("ср", average), ("макс", max(values)), ("сейчас", values[-1]))
+    )
+    return f"*{title}* (`{metric}`)\n```\n{sparkline(values)}\n{stats}\n```"
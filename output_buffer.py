@@ -0,0 +1,136 @@
+class RingBuffer:
+    """Fixed-capacity byte ring buffer addressed by absolute stream offsets.
+
+    Offsets count every byte ever written, so a consumer can remember where
+    it stopped reading and later tell how much was overwritten meanwhile:
+    readable data always spans [start, end).
+    """
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("Ring buffer capacity must be positive")
+        self.capacity = capacity
+        self.data = bytearray(capacity)
+        self.end = 0
+
+    @property
+    def start(self):
+        """Oldest offset that is still stored"""
+        return max(0, self.end - self.capacity)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def write(self, data):
+        data = memoryview(data)
+        written = len(data)
+        # Из слишком большого куска сохранится только хвост
+        if written > self.capacity:
+            self.end += written - self.capacity
+            data = data[-self.capacity:]
+
+        pos = self.end % self.capacity
+        first = min(len(data), self.capacity - pos)
+        self.data[pos:pos + first] = data[:first]
+        self.data[:len(data) - first] = data[first:]
+        self.end += len(data)
+
+    def _clamp(self, begin, end):
+        begin = max(begin, self.start)
+        end = self.end if end is None else min(end, self.end)
+        return begin, max(begin, end)
+
+    def views(self, begin, end=None):
+        """Zero-copy memoryviews covering [begin, end), at most two segments.
+
+        The views alias the buffer, so they are only valid until the next
+        write; callers must hold the writer's lock while using them.
+        """
+        begin, end = self._clamp(begin, end)
+        if begin == end:
+            return []
+        data = memoryview(self.data)
+        pos = begin % self.capacity
+        length = end - begin
+        if pos + length <= self.capacity:
+            return [data[pos:pos + length]]
+        return [data[pos:], data[:pos + length - self.capacity]]
+
+    def read(self, begin, end=None):
+        """Copy [begin, end) out of the buffer"""
+        return b"".join(self.views(begin, end))
+
+    def find(self, sub, begin, end=None):
+        """Absolute offset of sub within [begin, end), or -1"""
+        begin, end = self._clamp(begin, end)
+        if end - begin < len(sub):
+            return -1
+
+        pos = begin % self.capacity
+        length = end - begin
+        if pos + length <= self.capacity:
+            index = self.data.find(sub, pos, pos + length)
+            return -1 if index == -1 else begin + index - pos
+
+        # Сегмент до конца массива
+        index = self.data.find(sub, pos, self.capacity)
+        if index != -1:
+            return begin + index - pos
+        # Вхождение, пересекающее точку переноса
+        wrap = begin + self.capacity - pos
+        overlap_begin = max(begin, wrap - len(sub) + 1)
+        index = self.read(overlap_begin, min(end, wrap + len(sub) - 1)).find(sub)
+        if index != -1:
+            return overlap_begin + index
+        # Сегмент с начала массива
+        index = self.data.find(sub, 0, end - wrap)
+        return -1 if index == -1 else wrap + index
+
+    def rfind(self, sub, begin, end=None):
+        """Absolute offset of the last sub within [begin, end), or -1"""
+        begin, end = self._clamp(begin, end)
+        pos = begin % self.capacity
+        length = end - begin
+        if pos + length <= self.capacity:
+            index = self.data.rfind(sub, pos, pos + length)
+            return -1 if index == -1 else begin + index - pos
+
+        wrap = begin + self.capacity - pos
+        index = self.data.rfind(sub, 0, end - wrap)
+        if index != -1:
+            return wrap + index
+        index = self.read(max(begin, wrap - len(sub) + 1), min(end, wrap + len(sub) - 1)).rfind(sub)
+        if index != -1:
+            return max(begin, wrap - len(sub) + 1) + index
+        index = self.data.rfind(sub, pos, self.capacity)
+        return -1 if index == -1 else begin + index - pos
+
+
+class CappedOutput:
+    """Byte sink that keeps the first and last limit/2 bytes of a stream"""
+
+    def __init__(self, limit):
+        self.head_limit = limit // 2
+        self.head = bytearray()
+        self.tail = RingBuffer(max(1, limit - self.head_limit))
+
+    @property
+    def skipped(self):
+        """Bytes dropped between head and tail"""
+        return self.tail.start
+
+    def write(self, data):
+        if len(self.head) < self.head_limit:
+            take = self.head_limit - len(self.head)
+            self.head += data[:take]
+            data = data[take:]
+        if data:
+            # Середина вывода не хранится, но продолжает вычитываться из канала
+            self.tail.write(data)
+
+    def getvalue(self):
+        head = self.head.decode('utf-8', errors='replace')
+        tail = self.tail.read(0).decode('utf-8', errors='replace')
+        if self.skipped:
+            return f"{head}\n... [{self.skipped} bytes skipped] ...\n{tail}"
+        return head + tail
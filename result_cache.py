@@ -0,0 +1,64 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from config import env_int
+
+# Сколько результатов хранится; 0 отключает кэш
+DEFAULT_MAX_ENTRIES = env_int('RESULT_CACHE_SIZE', 64)
+
+
+class ResultCache:
+    """Results of read-only commands keyed by (host, command).
+
+    Every entry has its own TTL; when the cache is full the least recently
+    used entry is evicted. Mutating actions drop a host's entries with
+    invalidate().
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # (host, command) -> (value, stored_at, ttl); порядок - от давно использованных к недавним
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, host, command):
+        """(value, age in seconds) of a fresh entry, or None"""
+        key = (host, command)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at, ttl = entry
+            age = time.monotonic() - stored_at
+            if age >= ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value, age
+
+    def put(self, host, command, value, ttl):
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+        key = (host, command)
+        with self.lock:
+            self.entries[key] = (value, time.monotonic(), ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, host=None):
+        """Drop all entries of host, or everything"""
+        with self.lock:
+            if host is None:
+                self.entries.clear()
+                return
+            for key in [key for key in self.entries if key[0] == host]:
+                del self.entries[key]
+
+
+def format_age(seconds):
+    """Age of a cached result, e.g. "12 с" or "3 мин" """
+    if seconds < 60:
+        return f"{seconds:.0f} с"
+    return f"{seconds // 60:.0f} мин"
@@ -0,0 +1,173 @@
+import logging
+import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future
+from threading import Condition, Thread
+
+from config import env_int
+from instrumentation import count, observe, span
+
+# Сколько обработчиков с SSH-операциями выполняется одновременно
+DEFAULT_MAX_WORKERS = env_int('HANDLER_WORKERS', 8)
+# Сколько задач одного пользователя выполняется одновременно
+USER_CONCURRENCY = env_int('USER_CONCURRENCY', 2)
+# Сколько задач пользователя может ждать очереди; следующие отклоняются
+USER_QUEUE_LIMIT = env_int('USER_QUEUE_LIMIT', 20)
+# Сколько задач одновременно работает с одним сервером
+HOST_CONCURRENCY = env_int('HOST_CONCURRENCY', 8)
+
+_Task = namedtuple('_Task', ['future', 'func', 'args', 'kwargs', 'key', 'user', 'host', 'submitted'])
+
+
+class QuotaExceeded(Exception):
+    """The user already has the maximum number of tasks waiting"""
+
+
+class FairScheduler:
+    """Bounded worker pool that shares the SSH connection fairly between users.
+
+    Tasks with the same key (e.g. one chat's terminal) run one at a time
+    in submission order. Every user has their own queue and free workers
+    take tasks from the users in turn, skipping users already running
+    user_limit tasks and tasks whose key or host is busy, so a flood from
+    one operator delays the others by at most one task per round. A user
+    with queue_limit tasks waiting gets QuotaExceeded instead of a longer
+    queue.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, user_limit=USER_CONCURRENCY,
+                 queue_limit=USER_QUEUE_LIMIT, host_limit=HOST_CONCURRENCY):
+        self.user_limit = user_limit
+        self.queue_limit = queue_limit
+        self.host_limit = host_limit
+        # Очереди ожидающих задач по пользователям; порядок - очередность обхода
+        self.queues = OrderedDict()
+        # Ожидающие задачи по ключам: выполнить можно только первую из них
+        self.keys = {}
+        self.running_keys = {}
+        self.running_users = {}
+        self.running_hosts = {}
+        self.idle = 0
+        self.condition = Condition()
+        self.stopped = False
+        self.logger = logging.getLogger(__name__)
+        for number in range(max_workers):
+            Thread(target=self._work, name=f'handler-{number}', daemon=True).start()
+
+    def submit(self, key, func, *args, user=None, host=None, **kwargs):
+        """Schedule func(*args, **kwargs) after earlier tasks of key; returns a Future.
+
+        Raises QuotaExceeded if user already has queue_limit tasks waiting.
+        """
+        task = _Task(Future(), func, args, kwargs, key, user, host, time.perf_counter())
+        with self.condition:
+            queue = self.queues.get(user)
+            if queue is None:
+                queue = self.queues[user] = deque()
+            elif user is not None and len(queue) >= self.queue_limit:
+                count('scheduler.rejected')
+                raise QuotaExceeded(f"{len(queue)} tasks are already waiting")
+            queue.append(task)
+            self.keys.setdefault(key, deque()).append(task)
+            self.condition.notify()
+        return task.future
+
+    def pending(self, key):
+        """Number of tasks of key that are running or waiting"""
+        with self.condition:
+            return len(self.keys.get(key, ())) + self.running_keys.get(key, 0)
+
+    def position(self, future):
+        """Estimated number of tasks that run before future's task; 0 if it already runs.
+
+        Counts the running task of the same key, the user's own earlier
+        tasks and, for every other user, as many tasks as one round robin
+        pass takes from them before this task's turn.
+        """
+        with self.condition:
+            for user, queue in self.queues.items():
+                for index, task in enumerate(queue):
+                    if task.future is future:
+                        if self.idle and self._runnable(task) and self._user_free(user):
+                            # Свободный поток заберет задачу сразу
+                            return 0
+                        others = sum(
+                            min(len(other), index + 1) for other_user, other in self.queues.items() if other_user != user
+                        )
+                        return self.running_keys.get(task.key, 0) + index + others
+            return 0
+
+    def shutdown(self):
+        """Let workers exit once nothing runnable is left"""
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def _runnable(self, task):
+        return (
+            not self.running_keys.get(task.key)
+            and self.keys[task.key][0] is task
+            and self.running_hosts.get(task.host, 0) < self.host_limit
+        )
+
+    def _user_free(self, user):
+        return user is None or self.running_users.get(user, 0) < self.user_limit
+
+    def _take(self):
+        """Next task in round robin order, or None; called with the lock held"""
+        for user, queue in self.queues.items():
+            if not self._user_free(user):
+                continue
+            for task in queue:
+                if self._runnable(task):
+                    queue.remove(task)
+                    if queue:
+                        # Пользователь уходит в конец круга
+                        self.queues.move_to_end(user)
+                    else:
+                        del self.queues[user]
+                    keyed = self.keys[task.key]
+                    keyed.popleft()
+                    if not keyed:
+                        del self.keys[task.key]
+                    return task
+        return None
+
+    def _acquire(self, task):
+        for running, name in ((self.running_keys, task.key), (self.running_users, task.user), (self.running_hosts, task.host)):
+            running[name] = running.get(name, 0) + 1
+
+    def _release(self, task):
+        for running, name in ((self.running_keys, task.key), (self.running_users, task.user), (self.running_hosts, task.host)):
+            running[name] -= 1
+            if not running[name]:
+                del running[name]
+
+    def _work(self):
+        while True:
+            with self.condition:
+                task = self._take()
+                while task is None:
+                    if self.stopped:
+                        return
+                    self.idle += 1
+                    self.condition.wait()
+                    self.idle -= 1
+                    task = self._take()
+                self._acquire(task)
+
+            if task.future.set_running_or_notify_cancel():
+                observe('handler.queue', time.perf_counter() - task.submitted)
+                try:
+                    with span('handler.run'):
+                        result = task.func(*task.args, **task.kwargs)
+                    task.future.set_result(result)
+                except Exception as e:
+                    count('handler.errors')
+                    self.logger.exception(f"Error in background task for {task.key}: {str(e)}")
+                    task.future.set_exception(e)
+
+            with self.condition:
+                self._release(task)
+                # Освободились ключ, место пользователя и сервера - задачи могли стать доступны
+                self.condition.notify_all()
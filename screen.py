@@ -0,0 +1,519 @@
+import codecs
+import html
+import logging
+import select
+import shlex
+import time
+from threading import Lock, Thread
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ParseMode
+
+from config import env_float, env_int
+from ssh_manager import PTY_COLUMNS, PTY_ROWS
+
+# Как часто показывать новый кадр; сообщение правится, только если экран изменился
+FRAME_INTERVAL = env_float('SCREEN_FRAME_INTERVAL', 1.0)
+# Живой экран сам закрывается через столько секунд
+MAX_DURATION = env_int('SCREEN_TIMEOUT', 600)
+# Сколько ждать завершения программы при снимке одного экрана
+SNAPSHOT_TIMEOUT = 5
+READ_CHUNK_SIZE = 65536
+OPEN_TIMEOUT = 10
+MAX_SEQUENCE_LENGTH = 64
+
+# Программы, которые рисуют экран целиком; в терминале они открываются живым экраном
+FULLSCREEN_PROGRAMS = {
+    'top', 'htop', 'btop', 'atop', 'iotop', 'iftop', 'nload', 'glances', 'watch',
+    'less', 'more', 'man', 'vi', 'vim', 'nano', 'mc',
+}
+
+STOP_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton("q", callback_data="screen_key_q"),
+    InlineKeyboardButton("Ctrl+C", callback_data="screen_key_ctrl_c"),
+    InlineKeyboardButton("⏹ Закрыть", callback_data="screen_stop"),
+]])
+KEYS = {'q': "q", 'ctrl_c': "\x03"}
+
+# Состояния разбора управляющих последовательностей
+_GROUND, _ESCAPE, _CSI, _OSC, _OSC_ESCAPE, _SKIP_ONE = range(6)
+
+
+class Screen:
+    """Incremental VT100/xterm screen model.
+
+    feed() applies output bytes as they arrive: cursor movement, erasing,
+    scroll regions, insert/delete and the alternate screen are applied to
+    a character grid, colours and other attributes are dropped. lines()
+    returns the visible rows as text.
+    """
+
+    def __init__(self, columns=PTY_COLUMNS, rows=PTY_ROWS):
+        self.columns = columns
+        self.rows = rows
+        self.grid = [self._blank_row() for _ in range(rows)]
+        self.x = 0
+        self.y = 0
+        # После записи в последний столбец перенос откладывается до следующего символа
+        self.wrap_pending = False
+        self.saved_cursor = (0, 0)
+        self.scroll_top = 0
+        self.scroll_bottom = rows - 1
+        # Основной экран, пока программа работает на альтернативном
+        self.main_screen = None
+        # Альтернативный экран в момент выхода из него (последний кадр htop, less)
+        self.closed_alternate = None
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.state = _GROUND
+        self.sequence = ''
+        # Изменился ли экран с последнего вызова lines()
+        self.dirty = True
+
+    def _blank_row(self):
+        return [' '] * self.columns
+
+    def feed(self, data):
+        for char in self.decoder.decode(data):
+            state = self.state
+            if state == _GROUND:
+                if char >= ' ' and char != '\x7f':
+                    self._put(char)
+                else:
+                    self._control(char)
+            elif state == _ESCAPE:
+                self._escape(char)
+            elif state == _CSI:
+                if '@' <= char <= '~':
+                    self.state = _GROUND
+                    self._csi(self.sequence, char)
+                elif char == '\x1b':
+                    self.state = _ESCAPE
+                elif char < ' ':
+                    self._control(char)
+                elif len(self.sequence) < MAX_SEQUENCE_LENGTH:
+                    self.sequence += char
+                else:
+                    self.state = _GROUND
+            elif state == _OSC:
+                # Заголовок окна и прочие OSC: пропускаем до BEL или ST
+                if char == '\x07':
+                    self.state = _GROUND
+                elif char == '\x1b':
+                    self.state = _OSC_ESCAPE
+            elif state == _OSC_ESCAPE:
+                self.state = _GROUND
+            else:
+                self.state = _GROUND
+
+    def lines(self):
+        """Visible rows without trailing blanks; clears the dirty flag"""
+        self.dirty = False
+        return [''.join(row).rstrip() for row in self.grid]
+
+    def render(self, closed_alternate=False):
+        """Screen as text, without blank rows at the bottom.
+
+        With closed_alternate, a program that drew on the alternate screen
+        and has already left it is shown as it was when it left.
+        """
+        lines = self.lines()
+        if closed_alternate and self.main_screen is None and self.closed_alternate is not None:
+            lines = [''.join(row).rstrip() for row in self.closed_alternate]
+        while lines and not lines[-1]:
+            lines.pop()
+        return "\n".join(lines)
+
+    def _put(self, char):
+        if self.wrap_pending:
+            self.x = 0
+            self.wrap_pending = False
+            self._index()
+        self.grid[self.y][self.x] = char
+        self.dirty = True
+        if self.x == self.columns - 1:
+            self.wrap_pending = True
+        else:
+            self.x += 1
+
+    def _control(self, char):
+        if char == '\x1b':
+            self.state = _ESCAPE
+        elif char == '\r':
+            self._move(0, self.y)
+        elif char in '\n\x0b\x0c':
+            self.wrap_pending = False
+            self._index()
+        elif char == '\x08':
+            self._move(self.x - 1, self.y)
+        elif char == '\t':
+            self._move((self.x // 8 + 1) * 8, self.y)
+
+    def _escape(self, char):
+        self.state = _GROUND
+        if char == '[':
+            self.state = _CSI
+            self.sequence = ''
+        elif char == ']':
+            self.state = _OSC
+        elif char in '()*+#%':
+            # Выбор набора символов: один символ параметра, на экран не влияет
+            self.state = _SKIP_ONE
+        elif char == '7':
+            self.saved_cursor = (self.x, self.y)
+        elif char == '8':
+            self._move(*self.saved_cursor)
+        elif char == 'D':
+            self._index()
+        elif char == 'E':
+            self._move(0, self.y)
+            self._index()
+        elif char == 'M':
+            self._reverse_index()
+        elif char == 'c':
+            self.__init__(self.columns, self.rows)
+
+    def _move(self, x, y):
+        self.x = min(max(x, 0), self.columns - 1)
+        self.y = min(max(y, 0), self.rows - 1)
+        self.wrap_pending = False
+
+    def _index(self):
+        """Line feed: move down, scrolling the region at its bottom"""
+        if self.y == self.scroll_bottom:
+            self._scroll_up(self.scroll_top, 1)
+        elif self.y < self.rows - 1:
+            self.y += 1
+
+    def _reverse_index(self):
+        if self.y == self.scroll_top:
+            self._scroll_down(self.scroll_top, 1)
+        elif self.y > 0:
+            self.y -= 1
+
+    def _scroll_up(self, top, count):
+        count = min(count, self.scroll_bottom - top + 1)
+        del self.grid[top:top + count]
+        for _ in range(count):
+            self.grid.insert(self.scroll_bottom - count + 1, self._blank_row())
+        self.dirty = True
+
+    def _scroll_down(self, top, count):
+        count = min(count, self.scroll_bottom - top + 1)
+        del self.grid[self.scroll_bottom - count + 1:self.scroll_bottom + 1]
+        for _ in range(count):
+            self.grid.insert(top, self._blank_row())
+        self.dirty = True
+
+    def _erase(self, row, start, end):
+        self.grid[row][start:end] = [' '] * (end - start)
+        self.dirty = True
+
+    def _csi(self, sequence, final):
+        private = sequence[:1] in ('?', '>', '=', '<')
+        params = [int(part) if part.isdigit() else 0 for part in sequence.lstrip('?>=<').split(';')]
+        count = max(params[0], 1)
+
+        if private:
+            if final in 'hl' and any(mode in (47, 1047, 1049) for mode in params):
+                self._alternate_screen(final == 'h')
+        elif final == 'A':
+            self._move(self.x, self.y - count)
+        elif final in 'Be':
+            self._move(self.x, self.y + count)
+        elif final in 'Ca':
+            self._move(self.x + count, self.y)
+        elif final == 'D':
+            self._move(self.x - count, self.y)
+        elif final == 'E':
+            self._move(0, self.y + count)
+        elif final == 'F':
+            self._move(0, self.y - count)
+        elif final in 'G`':
+            self._move(count - 1, self.y)
+        elif final == 'd':
+            self._move(self.x, count - 1)
+        elif final in 'Hf':
+            column = params[1] if len(params) > 1 else 0
+            self._move(max(column, 1) - 1, count - 1)
+        elif final == 'J':
+            self._erase_display(params[0])
+        elif final == 'K':
+            start, end = {0: (self.x, self.columns), 1: (0, self.x + 1)}.get(params[0], (0, self.columns))
+            self._erase(self.y, start, end)
+        elif final == 'X':
+            self._erase(self.y, self.x, min(self.x + count, self.columns))
+        elif final == '@':
+            row = self.grid[self.y]
+            row[self.x:self.x] = [' '] * count
+            del row[self.columns:]
+            self.dirty = True
+        elif final == 'P':
+            row = self.grid[self.y]
+            del row[self.x:self.x + count]
+            row.extend([' '] * (self.columns - len(row)))
+            self.dirty = True
+        elif final in 'LM':
+            if self.scroll_top <= self.y <= self.scroll_bottom:
+                if final == 'L':
+                    self._scroll_down(self.y, count)
+                else:
+                    self._scroll_up(self.y, count)
+                self.x = 0
+        elif final == 'S':
+            self._scroll_up(self.scroll_top, count)
+        elif final == 'T':
+            self._scroll_down(self.scroll_top, count)
+        elif final == 'r':
+            top = max(params[0], 1) - 1
+            bottom = (params[1] if len(params) > 1 and params[1] else self.rows) - 1
+            if top < bottom < self.rows:
+                self.scroll_top, self.scroll_bottom = top, bottom
+                self._move(0, 0)
+        elif final == 's':
+            self.saved_cursor = (self.x, self.y)
+        elif final == 'u':
+            self._move(*self.saved_cursor)
+
+    def _erase_display(self, mode):
+        if mode == 0:
+            self._erase(self.y, self.x, self.columns)
+            rows = range(self.y + 1, self.rows)
+        elif mode == 1:
+            self._erase(self.y, 0, self.x + 1)
+            rows = range(self.y)
+        else:
+            rows = range(self.rows)
+        for row in rows:
+            self._erase(row, 0, self.columns)
+
+    def _alternate_screen(self, enable):
+        if enable and self.main_screen is None:
+            self.main_screen = (self.grid, self.x, self.y)
+            self.grid = [self._blank_row() for _ in range(self.rows)]
+        elif not enable and self.main_screen is not None:
+            self.closed_alternate = self.grid
+            self.grid, x, y = self.main_screen
+            self.main_screen = None
+            self._move(x, y)
+        self.dirty = True
+
+
+def open_pty_channel(manager, command, cwd=None):
+    """Run command on its own channel with an xterm PTY of the shell's size.
+
+    Returns (True, channel) or (False, error).
+    """
+    if not manager.ensure_connected():
+        return False, "Failed to connect to server"
+    if cwd:
+        command = f"cd {shlex.quote(cwd)} && {command}"
+    try:
+        channel = manager.client.get_transport().open_session(timeout=OPEN_TIMEOUT)
+        # С pty удаленный процесс получит SIGHUP, когда канал закроется
+        channel.get_pty(term='xterm', width=PTY_COLUMNS, height=PTY_ROWS)
+        channel.exec_command(command)
+        return True, channel
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Error opening screen channel: {str(e)}")
+        return False, f"Error: {str(e)}"
+
+
+def capture(manager, command, timeout=SNAPSHOT_TIMEOUT, cwd=None):
+    """Screen left by a full-screen program after it exits or after timeout.
+
+    Returns (True, text) or (False, error).
+    """
+    success, channel = open_pty_channel(manager, command, cwd)
+    if not success:
+        return False, channel
+    screen = Screen()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            select.select([channel], [], [], remaining)
+            data = channel.recv(READ_CHUNK_SIZE) if channel.recv_ready() else b''
+            if data:
+                screen.feed(data)
+            elif channel.exit_status_ready() or channel.closed or channel.eof_received:
+                break
+        # Программа, работающая до таймаута, дает снимок; завершившаяся с
+        # ошибкой (например, не установленная) - ошибку
+        exit_status = channel.recv_exit_status() if channel.exit_status_ready() else 0
+    finally:
+        channel.close()
+    # Программа на альтернативном экране при выходе возвращает прежний -
+    # показываем то, что она нарисовала
+    text = screen.render(closed_alternate=True)
+    if exit_status != 0:
+        return False, text.strip() or f"Exit status {exit_status}"
+    return True, text
+
+
+class LiveScreen:
+    """Shows a full-screen program in one message, edited as the screen changes.
+
+    A single thread reads the channel into a Screen and every
+    FRAME_INTERVAL, if visible rows changed and the previous edit has
+    been sent, edits the message with the new frame. Frames produced
+    while Telegram is busy are skipped, only the latest one is shown.
+    bot is expected to be a send_queue.QueuedBot.
+    """
+
+    def __init__(self, bot, chat_id, channel, title, on_finish=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.channel = channel
+        self.title = title
+        self.on_finish = on_finish
+        self.screen = Screen()
+        self.shown = None
+        self.message_id = None
+        self.request = None
+        self.frames = 0
+        self.stopping = False
+        self.stop_reason = None
+        self.logger = logging.getLogger(__name__)
+        self.thread = Thread(target=self._run, name=f'screen-{chat_id}', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, reason="закрыто"):
+        self.stop_reason = self.stop_reason or reason
+        self.stopping = True
+        self.channel.close()
+
+    def send_keys(self, keys):
+        """Type keys into the program"""
+        try:
+            self.channel.sendall(keys.encode('utf-8'))
+            return True
+        except Exception as e:
+            self.logger.warning(f"Could not send keys to screen in chat {self.chat_id}: {str(e)}")
+            return False
+
+    def _run(self):
+        started = time.monotonic()
+        next_frame = started
+        try:
+            while not self.stopping:
+                now = time.monotonic()
+                if now - started > MAX_DURATION:
+                    self.stop_reason = f"прошло {MAX_DURATION // 60} мин"
+                    break
+                if now >= next_frame:
+                    self._show()
+                    next_frame = now + FRAME_INTERVAL
+
+                select.select([self.channel], [], [], max(0, next_frame - now))
+                if not self.channel.recv_ready():
+                    if self.channel.exit_status_ready() or self.channel.closed or self.channel.eof_received:
+                        self.stop_reason = self.stop_reason or "программа завершилась"
+                        break
+                    continue
+                data = self.channel.recv(READ_CHUNK_SIZE)
+                if not data:
+                    self.stop_reason = self.stop_reason or "программа завершилась"
+                    break
+                self.screen.feed(data)
+        except Exception as e:
+            self.logger.warning(f"Screen in chat {self.chat_id} failed: {str(e)}")
+            self.stop_reason = self.stop_reason or f"ошибка: {str(e)}"
+        finally:
+            self.channel.close()
+            if self.request is not None and not self.request.done():
+                try:
+                    self.request.result(timeout=10)
+                except Exception:
+                    pass
+            self._show(final=True)
+            if self.on_finish:
+                self.on_finish(self)
+
+    def _show(self, final=False):
+        # Предыдущий кадр еще в очереди - этот пропускаем
+        if self.request is not None:
+            if not self.request.done():
+                return
+            if self.message_id is None:
+                try:
+                    self.message_id = self.request.result().message_id
+                except Exception:
+                    pass
+            self.request = None
+        if not self.screen.dirty and not final:
+            return
+        lines = self.screen.lines()
+        if lines == self.shown and not final:
+            return
+        self.shown = lines
+        self.frames += 1
+
+        text = "\n".join(lines).rstrip('\n') or ' '
+        footer = f"⏹ {self.stop_reason}" if final else "⌨️ сообщения боту передаются программе как ввод"
+        body = f"🖥 {html.escape(self.title)}\n<pre>{html.escape(text)}</pre>\n{footer}"
+        markup = None if final else STOP_KEYBOARD
+        # Отправку не ждем: чтение канала не должно стоять из-за Telegram
+        if self.message_id is None:
+            self.request = self.bot.send_message(
+                chat_id=self.chat_id, text=body, parse_mode=ParseMode.HTML, reply_markup=markup,
+                wait=False, coalesce=False
+            )
+        else:
+            self.request = self.bot.edit_message_text(
+                chat_id=self.chat_id, message_id=self.message_id, text=body,
+                parse_mode=ParseMode.HTML, reply_markup=markup, wait=False
+            )
+
+
+class ScreenManager:
+    """At most one live screen per chat, each on its own channel of the shared connection"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.screens = {}
+        self.lock = Lock()
+
+    def start(self, bot, chat_id, command, cwd=None):
+        """Show command live in chat_id; returns (success, error)"""
+        self.stop(chat_id)
+        success, channel = open_pty_channel(self.manager, command, cwd)
+        if not success:
+            return False, channel
+        live = LiveScreen(bot, chat_id, channel, command, on_finish=self._finished)
+        with self.lock:
+            self.screens[chat_id] = live
+        live.start()
+        return True, None
+
+    def active(self, chat_id):
+        with self.lock:
+            return chat_id in self.screens
+
+    def send_keys(self, chat_id, keys):
+        with self.lock:
+            live = self.screens.get(chat_id)
+        return live.send_keys(keys) if live else False
+
+    def stop(self, chat_id):
+        """Close the chat's screen; returns False if there was none"""
+        with self.lock:
+            live = self.screens.pop(chat_id, None)
+        if live is None:
+            return False
+        live.stop()
+        return True
+
+    def stop_all(self):
+        with self.lock:
+            screens = list(self.screens.values())
+            self.screens.clear()
+        for live in screens:
+            live.stop()
+
+    def _finished(self, live):
+        with self.lock:
+            if self.screens.get(live.chat_id) is live:
+                del self.screens[live.chat_id]
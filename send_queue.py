@@ -0,0 +1,263 @@
+import inspect
+import logging
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition, Thread
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+
+from config import env_float
+from instrumentation import count, observe, span
+
+# Лимиты Telegram: около 1 сообщения в секунду в один чат и 30 в секунду всего
+CHAT_RATE = env_float('SEND_CHAT_RATE', 1.0)
+CHAT_BURST = 3
+GLOBAL_RATE = env_float('SEND_GLOBAL_RATE', 30.0)
+# Сколько запросов к Bot API выполняется одновременно (в разные чаты)
+SEND_WORKERS = 4
+# Сколько раз повторять запрос после RetryAfter
+MAX_RETRIES = 5
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """rate tokens per second, at most burst of them saved up"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available"""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds, now):
+        """Hold back the next token for the given number of seconds"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class _Request:
+    """A queued Bot API call and the futures waiting for its result"""
+
+    def __init__(self, method, arguments, coalesce, key):
+        self.method = method
+        self.arguments = arguments
+        self.coalesce = coalesce and arguments.get('reply_markup') is None
+        self.key = key
+        self.futures = [Future()]
+        self.retries = 0
+        self.queued_at = time.perf_counter()
+
+    def can_merge(self, other):
+        if not (self.coalesce and other.coalesce):
+            return False
+        if len(self.arguments['text']) + len(other.arguments['text']) + 2 > MAX_MESSAGE_LENGTH:
+            return False
+        # Склеиваем только сообщения с одинаковыми параметрами, кроме текста
+        return all(
+            self.arguments.get(name) == other.arguments.get(name)
+            for name in set(self.arguments) | set(other.arguments) if name != 'text'
+        )
+
+    def merge(self, other):
+        self.arguments = dict(self.arguments, text=self.arguments['text'] + "\n\n" + other.arguments['text'])
+        self.futures += other.futures
+
+
+class SendQueue:
+    """Outbound dispatcher for Bot API calls.
+
+    Calls are queued per chat and sent in order, limited by a token bucket
+    per chat and a global one. Consecutive small messages to one chat are
+    merged, a newer edit of a message replaces a queued one, and RetryAfter
+    is waited out and retried. submit() returns a Future with the result.
+    """
+
+    def __init__(self, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, global_rate=GLOBAL_RATE,
+                 workers=SEND_WORKERS):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.buckets = {}
+        # Очереди по чатам; порядок ключей - порядок обхода, чат после
+        # отправки уходит в конец, чтобы один чат не занимал всю полосу
+        self.queues = {}
+        # Чаты, запрос в которые сейчас выполняется: следующий ждет его
+        self.busy = set()
+        self.condition = Condition()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='send')
+        self.running = True
+        self.logger = logging.getLogger(__name__)
+        Thread(target=self._dispatch, daemon=True).start()
+
+    def submit(self, chat_id, method, arguments, coalesce=False, key=None):
+        """Queue method(**arguments) for chat_id and return a Future"""
+        request = _Request(method, arguments, coalesce, key)
+        with self.condition:
+            queue = self.queues.setdefault(chat_id, deque())
+            if key is not None:
+                for queued in queue:
+                    if queued.key == key:
+                        # Старая версия еще не отправлена - отправим сразу новую
+                        queued.arguments = arguments
+                        queued.futures += request.futures
+                        return request.futures[0]
+            queue.append(request)
+            self.condition.notify()
+        return request.futures[0]
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.executor.shutdown(wait=False)
+
+    def _bucket(self, chat_id):
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _dispatch(self):
+        with self.condition:
+            while self.running:
+                now = time.monotonic()
+                chat_id, wait = self._next_chat(now)
+                if chat_id is None:
+                    self.condition.wait(wait)
+                    continue
+
+                request = self._pop(chat_id)
+                self._bucket(chat_id).take(now)
+                self.global_bucket.take(now)
+                self.busy.add(chat_id)
+                self.executor.submit(self._send, chat_id, request)
+
+    def _next_chat(self, now):
+        """First chat that may send now, or (None, seconds to wait)"""
+        wait = None
+        for chat_id, queue in self.queues.items():
+            if chat_id in self.busy:
+                continue
+            delay = max(self._bucket(chat_id).delay(now), self.global_bucket.delay(now))
+            if delay == 0:
+                return chat_id, None
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _pop(self, chat_id):
+        queue = self.queues.pop(chat_id)
+        request = queue.popleft()
+        while queue and request.can_merge(queue[0]):
+            request.merge(queue.popleft())
+        if queue:
+            self.queues[chat_id] = queue
+        return request
+
+    def _send(self, chat_id, request):
+        observe('api.queue', time.perf_counter() - request.queued_at)
+        try:
+            result = request.method(**request.arguments)
+        except RetryAfter as e:
+            count('api.retries')
+            self.logger.warning(f"Flood limit hit for chat {chat_id}, retrying in {e.retry_after}s")
+            with self.condition:
+                self._bucket(chat_id).pause(e.retry_after, time.monotonic())
+                if request.retries < MAX_RETRIES:
+                    request.retries += 1
+                    # Возвращаем запрос в начало очереди чата
+                    self.queues.setdefault(chat_id, deque()).appendleft(request)
+                    self.busy.discard(chat_id)
+                    self.condition.notify()
+                    return
+            count('api.errors')
+            self._finish(chat_id, request, error=e)
+        except Exception as e:
+            count('api.errors')
+            self._finish(chat_id, request, error=e)
+        else:
+            self._finish(chat_id, request, result=result)
+
+    def _finish(self, chat_id, request, result=None, error=None):
+        with self.condition:
+            self.busy.discard(chat_id)
+            self.condition.notify()
+        for future in request.futures:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+def _call_arguments(method, args, kwargs):
+    """Map the positional and keyword arguments of a Bot method to a dict"""
+    return dict(inspect.signature(method).bind(*args, **kwargs).arguments)
+
+
+def _log_failure(future):
+    error = future.exception()
+    if error is not None:
+        logging.getLogger(__name__).warning(f"Queued Telegram request failed: {error}")
+
+
+class QueuedBot(ExtBot):
+    """ExtBot that sends messages, edits and documents through a SendQueue.
+
+    The methods block until the request is sent, as with a plain Bot, so
+    handlers and telegram.Message shortcuts work unchanged. wait=False
+    returns a Future instead; failures of such requests are logged. Only
+    wait=False messages are merged with their neighbours; pass
+    coalesce=False to keep such a message separate when its Future is used.
+    """
+
+    def __init__(self, *args, send_queue=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.send_queue = send_queue or SendQueue()
+
+    def _enqueue(self, method, args, kwargs, wait, coalesce=False, key=None):
+        arguments = _call_arguments(method, args, kwargs)
+        chat_id = arguments.get('chat_id')
+        if callable(key):
+            key = key(arguments)
+        future = self.send_queue.submit(chat_id, method, arguments, coalesce, key)
+        if wait:
+            return future.result()
+        future.add_done_callback(_log_failure)
+        return future
+
+    def send_message(self, *args, wait=True, coalesce=None, **kwargs):
+        # Склеивать можно только уведомления, чей Message никто не ждет:
+        # иначе два отправителя получат одно сообщение и будут править его оба
+        if coalesce is None:
+            coalesce = not wait
+        return self._enqueue(super().send_message, args, kwargs, wait, coalesce=coalesce)
+
+    def edit_message_text(self, *args, wait=True, **kwargs):
+        # Имеет значение только последняя версия текста сообщения
+        key = lambda arguments: ('edit', arguments.get('message_id'), arguments.get('inline_message_id'))
+        return self._enqueue(super().edit_message_text, args, kwargs, wait, key=key)
+
+    def send_document(self, *args, wait=True, **kwargs):
+        return self._enqueue(super().send_document, args, kwargs, wait)
+
+    def _post(self, endpoint, *args, **kwargs):
+        # Через _post идут все вызовы Bot API, в том числе мимо очереди;
+        # getUpdates - длинный опрос, его длительность ничего не говорит
+        if endpoint == 'getUpdates':
+            return super()._post(endpoint, *args, **kwargs)
+        with span(f'api.{endpoint}'):
+            return super()._post(endpoint, *args, **kwargs)
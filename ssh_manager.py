@@ -1,376 +1,862 @@
 import paramiko
 import os
 import logging
+import select
 import time
-from threading import Thread
-import queue
+import random
+import shlex
+from threading import Thread, Condition, Lock, RLock
 import re
+import uuid
 
-class SSHManager:
-    def __init__(self, server_ip=None, username=None, password=None, key_path=None):
-        self.server_ip = server_ip or os.getenv('SERVER_IP')
-        self.username = username or os.getenv('SSH_USERNAME', 'root')
-        self.password = password or os.getenv('SSH_PASSWORD')
-        # По умолчанию не используем ключ, если не передан явно
-        self.key_path = None
-        if key_path and os.path.isfile(key_path):
-            self.key_path = key_path
-        
-        if not self.server_ip:
-            raise ValueError("Server IP is required")
-        
-        self.client = None
+from config import env_int
+from instrumentation import count, observe, span
+from output_buffer import RingBuffer, CappedOutput
+from sanitizer import sanitize, TerminalSanitizer
+
+# Маркеры начала и конца вывода команды в интерактивной сессии
+BEGIN_MARKER = '__TG_BEGIN'
+END_MARKER = '__TG_END'
+
+# Подготовка shell: без эха, приглашений и редактора строки
+SHELL_SETUP = "stty -echo; set +o emacs +o vi; export TERM=dumb PS1='' PS2=''"
+# Размер псевдотерминала shell-сессий; тот же размер у модели экрана screen.py
+PTY_COLUMNS = 80
+PTY_ROWS = 24
+
+# Таймауты в секундах
+SHELL_READY_TIMEOUT = 10
+# Если команда молчит столько секунд, проверяем, не ждет ли она ввода,
+# и потом повторяем проверку с интервалом INPUT_CHECK_INTERVAL
+INPUT_CHECK_DELAY = 2
+INPUT_CHECK_INTERVAL = 5
+INPUT_CHECK_TIMEOUT = 5
+# Успешен, если процесс из активной группы терминала shell спит в чтении
+# с терминала: ожидание в драйвере tty и файловый дескриптор вызова - pts/tty
+INPUT_CHECK_COMMAND = (
+    'tp=$(cut -d" " -f8 /proc/{pid}/stat) || exit 1; '
+    'for p in $(pgrep -g "$tp"); do '
+    'case "$(cat /proc/$p/wchan 2>/dev/null)" in n_tty_read|wait_woken) ;; *) continue ;; esac; '
+    'set -- $(cat /proc/$p/syscall 2>/dev/null); [ $# -gt 1 ] || continue; '
+    'case "$(readlink /proc/$p/fd/$(($2)) 2>/dev/null)" in /dev/pts/*|/dev/tty*) exit 0 ;; esac; '
+    'done; exit 1'
+)
+DEFAULT_COMMAND_TIMEOUT = env_int('SSH_COMMAND_TIMEOUT', 60)
+
+# Keepalive транспорта держит открытым NAT и помогает заметить обрыв;
+# соединение, простаивавшее дольше этого интервала, проверяется перед
+# использованием открытием канала
+KEEPALIVE_INTERVAL = env_int('SSH_KEEPALIVE_INTERVAL', 30)
+PROBE_TIMEOUT = 5
+# Переподключение после обрыва: экспоненциальная задержка со случайным разбросом
+RECONNECT_ATTEMPTS = env_int('SSH_RECONNECT_ATTEMPTS', 5)
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+
+# Сколько байт вывода команды хранить (начало и конец), остальное пропускается
+DEFAULT_MAX_OUTPUT = env_int('SSH_MAX_OUTPUT_BYTES', 256 * 1024)
+READ_CHUNK_SIZE = 32768
+
+# Потолок памяти под вывод одной shell-сессии; при переполнении
+# затираются самые старые байты
+SHELL_BUFFER_SIZE = env_int('SSH_SHELL_BUFFER_BYTES', 1024 * 1024)
+
+
+class ShellSession:
+    """Interactive shell channel with its own cwd, environment and output buffer"""
+    
+    def __init__(self, session_id, command_timeout=DEFAULT_COMMAND_TIMEOUT):
+        self.session_id = session_id
         self.shell = None
-        self.shell_session_active = False
-        self.output_queue = queue.Queue()
+        self.active = False
+        # Вывод shell: поток чтения пишет байты в кольцевой буфер и будит ожидающих
+        self.output = RingBuffer(SHELL_BUFFER_SIZE)
+        self.output_ready = Condition()
+        # Одна команда за раз: маркеры разных команд не должны перемешиваться
+        self.command_lock = Lock()
+        # Токен маркеров выполняемой команды
+        self.current_token = None
+        # Токен команды, которая ждет ввода, и смещение начала ее вывода:
+        # следующее сообщение уходит ей как ввод
+        self.waiting_token = None
+        self.waiting_from = None
+        # Последнее ожидание закончилось тем, что команда ждет ввода
+        self.input_requested = False
+        # PID shell и клиент - для проверки, ждет ли команда ввода
+        self.shell_pid = None
+        self.client = None
+        self.command_timeout = command_timeout
+        self.last_exit_status = None
+        # Рабочий каталог после последней команды, для восстановления сессии
+        self.cwd = None
+        # Смещения вывода последней команды в кольцевом буфере
+        self.last_output_range = None
+        # Когда отправлена команда, ответ на которую еще не начал приходить
+        self.sent_at = None
         self.logger = logging.getLogger(__name__)
     
-    def set_password(self, password):
-        """Set SSH password manually"""
-        self.password = password
+    def send(self, data):
+        """Write raw input (e.g. control characters) to the shell"""
+        if not self.active or not self.shell:
+            return False
+        self.shell.send(data)
         return True
     
-    def connect(self):
-        """Establish SSH connection to the server"""
-        try:
-            self.client = paramiko.SSHClient()
-            self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            connect_kwargs = {
-                'hostname': self.server_ip,
-                'username': self.username,
-                'timeout': 10
-            }
-            
-            if self.password:
-                connect_kwargs['password'] = self.password
-                self.logger.info(f"Подключение с использованием пароля")
-            elif self.key_path and os.path.isfile(self.key_path):
-                connect_kwargs['key_filename'] = self.key_path
-                self.logger.info(f"Подключение с использованием SSH ключа: {self.key_path}")
-            else:
-                self.logger.error("Не указан пароль для подключения")
-                return False
-            
-            self.client.connect(**connect_kwargs)
-            return True
-        except Exception as e:
-            self.logger.error(f"Failed to connect to {self.server_ip}: {str(e)}")
+    def interrupt(self):
+        """Send Ctrl+C to the running command without waiting for it"""
+        if not self.send("\x03"):
             return False
+        token = self.current_token or self.waiting_token
+        self.waiting_token = None
+        if token:
+            # Прерванная по Ctrl+C команда обрывает всю строку, и маркер
+            # конца после нее не печатается - отправляем его отдельно
+            self.shell.send(self._end_marker_command(token) + "\n")
+        return True
     
-    def disconnect(self):
-        """Close SSH connection"""
-        self.stop_shell_session()
-        if self.client:
-            self.client.close()
-            self.client = None
-    
-    def execute_command(self, command):
-        """Execute command on the remote server"""
-        if not self.client:
-            if not self.connect():
-                return False, "Failed to connect to server"
-        
-        try:
-            stdin, stdout, stderr = self.client.exec_command(command)
-            exit_status = stdout.channel.recv_exit_status()
-            
-            output = stdout.read().decode('utf-8')
-            error = stderr.read().decode('utf-8')
-            
-            if exit_status != 0:
-                return False, f"Command failed: {error or output}"
-            
-            return True, output
-        except Exception as e:
-            self.logger.error(f"Error executing command: {str(e)}")
-            return False, f"Error: {str(e)}"
+    @property
+    def connection_lost(self):
+        """Whether the shell was closed by a dropped SSH connection"""
+        if self.active or not self.shell:
+            return False
+        transport = self.shell.get_transport()
+        return transport is None or not transport.is_active()
     
-    def start_shell_session(self):
-        """Start an interactive shell session"""
-        if self.shell_session_active:
+    def start(self, client):
+        """Open the shell channel on the given client's transport"""
+        if self.active:
             return True, "Shell session already active"
         
-        if not self.client:
-            if not self.connect():
-                return False, "Failed to connect to server"
-        
         try:
             # Открываем интерактивную сессию
-            self.shell = self.client.invoke_shell()
-            self.shell.settimeout(0.0)  # Неблокирующий режим
+            with span('ssh.channel_open'):
+                self.shell = client.invoke_shell(width=PTY_COLUMNS, height=PTY_ROWS)
+            self.shell.settimeout(None)  # Блокирующее чтение в отдельном потоке
             
             # Запускаем поток для чтения вывода
-            self.shell_session_active = True
-            Thread(target=self._read_shell_output, daemon=True).start()
+            self.client = client
+            self.active = True
+            Thread(target=self._read_output, daemon=True).start()
             
-            # Ждем, пока shell не будет готов
-            time.sleep(1)
+            # Отключаем эхо, приглашение и редактор строки: конец вывода
+            # определяется маркером, а не поиском промпта
+            self.shell.send(SHELL_SETUP + "\n")
             
-            # Получаем первоначальный вывод (обычно приветствие и промпт)
-            initial_output = ""
-            try:
-                while not self.output_queue.empty():
-                    initial_output += self.output_queue.get_nowait()
-            except queue.Empty:
-                pass
+            # Ждем, пока shell не будет готов, и получаем первоначальный
+            # вывод (обычно приветствие)
+            token = uuid.uuid4().hex
+            self.shell.send(self._end_marker_command(token) + "\n")
+            raw_output, exit_status = self._wait_for_marker(token, 0, SHELL_READY_TIMEOUT, has_begin=False)
+            if exit_status is None:
+                self.stop()
+                return False, "Shell did not become ready"
+            
+            # Убираем эхо служебных строк, отправленных до отключения эха
+            initial_output = "\n".join(
+                line for line in raw_output.splitlines()
+                if SHELL_SETUP not in line and END_MARKER not in line
+            )
             
+            # PID нужен, чтобы узнать, не ждет ли команда ввода
+            success, pid = self._send_command("echo $$", SHELL_READY_TIMEOUT)
+            self.shell_pid = int(pid) if success and pid.strip().isdigit() else None
+            self.last_exit_status = None
+            self.last_output_range = None
             return True, initial_output
         except Exception as e:
             self.logger.error(f"Error starting shell session: {str(e)}")
             return False, f"Error: {str(e)}"
     
-    def stop_shell_session(self):
-        """Stop the interactive shell session"""
-        self.shell_session_active = False
+    def stop(self):
+        """Close the shell channel"""
+        self.active = False
         if self.shell:
+            # Закрытие канала разблокирует recv в потоке чтения
             self.shell.close()
             self.shell = None
         
-        # Очищаем очередь вывода
-        while not self.output_queue.empty():
+        # Будим ожидающих
+        with self.output_ready:
+            self.output_ready.notify_all()
+    
+    @staticmethod
+    def _begin_marker_command(token):
+        # Маркер в эхе команды разбит на части, поэтому не совпадет с выводом printf
+        return f"printf '%s:%s\\n' {BEGIN_MARKER} {token}"
+    
+    @staticmethod
+    def _end_marker_command(token):
+        # Вместе с кодом завершения печатаем текущий каталог
+        return f"printf '\\n%s:%s:%d:%s\\n' {END_MARKER} {token} \"$?\" \"$PWD\""
+    
+    @classmethod
+    def _command_line(cls, token, command):
+        # Маркеры и команда - одна строка: shell разбирает ее целиком до
+        # запуска, и программа, читающая ввод, не получит маркер конца.
+        # eval сообщит о синтаксической ошибке в команде, не сломав маркеры
+        return f"{cls._begin_marker_command(token)}; eval {shlex.quote(command)}; {cls._end_marker_command(token)}\n"
+    
+    def _waiting_for_input(self):
+        """Whether the shell's foreground program is blocked reading the terminal"""
+        if self.shell_pid is None or self.client is None:
+            return False
+        try:
+            channel = self.client.get_transport().open_session(timeout=INPUT_CHECK_TIMEOUT)
+        except Exception as e:
+            self.logger.debug(f"Could not check for input wait: {str(e)}")
+            return False
+        try:
+            channel.exec_command(INPUT_CHECK_COMMAND.format(pid=self.shell_pid))
+            return channel.status_event.wait(INPUT_CHECK_TIMEOUT) and channel.exit_status == 0
+        except Exception as e:
+            self.logger.debug(f"Could not check for input wait: {str(e)}")
+            return False
+        finally:
+            channel.close()
+    
+    def _wait_for_marker(self, token, start, timeout, on_output=None, has_begin=True, on_idle=None):
+        """Wait until the end marker for token appears after offset start.
+        
+        Returns (output, exit_status) where output is the decoded text between
+        the begin and end markers; exit_status is None on timeout and output
+        then holds everything received so far. If on_output is given, complete
+        lines are passed to it as they arrive. on_idle is called when no
+        output came for INPUT_CHECK_DELAY seconds; if it returns True the wait
+        ends early like a timeout, with input_requested set.
+        """
+        begin = ("%s:%s" % (BEGIN_MARKER, token)).encode()
+        end = ("%s:%s:" % (END_MARKER, token)).encode()
+        status_pattern = re.compile(rb'(\d+):([^\r\n]*)\r?\n')
+        shell = self.shell
+        
+        # Начало вывода команды - сразу после маркера начала
+        content_start = None if has_begin else start
+        begin_scan = start
+        end_scan = start
+        stream_pos = content_start
+        # Очистка по мере поступления: escape-коды и многобайтовые символы
+        # на границе чанков не ломаются
+        sanitizer = TerminalSanitizer(drop_blank_lines=True)
+        deadline = time.monotonic() + timeout
+        self.input_requested = False
+        idle_end = None
+        idle_at = None
+        
+        with self.output_ready:
+            while True:
+                buffer = self.output
+                
+                if content_start is None:
+                    begin_pos = buffer.find(begin, begin_scan)
+                    if begin_pos != -1:
+                        content_start = stream_pos = end_scan = begin_pos + len(begin)
+                    else:
+                        begin_scan = max(begin_scan, buffer.end - len(begin) + 1)
+                
+                content_end = None
+                if content_start is not None:
+                    end_pos = buffer.find(end, end_scan)
+                    if end_pos != -1:
+                        # Маркер найден, ждем код завершения и перевод строки
+                        match = status_pattern.match(buffer.read(end_pos + len(end), end_pos + len(end) + 4096))
+                        if match:
+                            exit_status = int(match.group(1))
+                            self.cwd = match.group(2).decode('utf-8', errors='replace') or self.cwd
+                            content_end = end_pos
+                        end_scan = end_pos
+                    else:
+                        end_scan = max(end_scan, buffer.end - len(end) + 1)
+                    
+                    # Отдаем только целые строки: незавершенная строка может
+                    # оказаться началом маркера конца
+                    if on_output:
+                        if content_end is not None:
+                            line_end = content_end - 1
+                        else:
+                            line_end = buffer.rfind(b"\n", stream_pos)
+                        if line_end >= stream_pos:
+                            stream_pos = self._emit_output(on_output, sanitizer, stream_pos, line_end + 1)
+                
+                if content_end is not None:
+                    self.last_output_range = (content_start, content_end)
+                    return self._decode_range(content_start, content_end), exit_status
+                
+                # Спим, пока поток чтения не принесет новые данные
+                now = time.monotonic()
+                remaining = deadline - now
+                if on_idle is not None and remaining > 0 and content_start is not None:
+                    if buffer.end != idle_end:
+                        idle_end, idle_at = buffer.end, now + INPUT_CHECK_DELAY
+                    elif now >= idle_at:
+                        # Проверка идет по отдельному каналу - поток чтения не ждет
+                        self.output_ready.release()
+                        try:
+                            self.input_requested = on_idle()
+                        finally:
+                            self.output_ready.acquire()
+                        if self.input_requested and self.output.end == idle_end:
+                            remaining = 0
+                        else:
+                            self.input_requested = False
+                            idle_at = time.monotonic() + INPUT_CHECK_INTERVAL
+                            continue
+                    if remaining > 0:
+                        remaining = min(remaining, max(idle_at - now, 0.01))
+                # Сессию могли переоткрыть после обрыва: старый маркер уже не придет
+                if remaining <= 0 or not self.active or self.shell is not shell:
+                    if on_output and stream_pos is not None:
+                        self._emit_output(on_output, sanitizer, stream_pos, buffer.end, final=True)
+                    from_offset = content_start if content_start is not None else start
+                    self.last_output_range = (from_offset, buffer.end)
+                    return self._decode_range(from_offset, buffer.end), None
+                self.output_ready.wait(remaining)
+    
+    def _decode_range(self, begin, end):
+        """Decode [begin, end) of the output buffer, noting overwritten bytes"""
+        text = self.output.read(begin, end).decode('utf-8', errors='replace')
+        lost = self.output.start - begin
+        if lost > 0:
+            return f"[{lost} bytes dropped]\n{text}"
+        return text
+    
+    def write_last_output(self, fileobj):
+        """Write the cleaned output of the last command to a binary file.
+        
+        The output is copied straight from the ring buffer, chunk by chunk.
+        Returns False if there is no output to write.
+        """
+        if self.last_output_range is None:
+            return False
+        begin, end = self.last_output_range
+        sanitizer = TerminalSanitizer(drop_blank_lines=True)
+        
+        with self.output_ready:
+            lost = self.output.start - begin
+            if lost > 0:
+                fileobj.write(f"[{lost} bytes dropped]\n".encode())
+            for view in self.output.views(begin, end):
+                fileobj.write(sanitizer.feed_bytes(view))
+            fileobj.write(sanitizer.flush_bytes())
+        return True
+    
+    def _emit_output(self, on_output, sanitizer, begin, end, final=False):
+        """Pass cleaned output between begin and end to on_output.
+        
+        Returns the offset the next piece starts from.
+        """
+        if begin < self.output.start:
+            # Вывод обогнал потребителя и был затерт
+            begin = self.output.start
+        views = self.output.views(begin, end)
+        text = "".join(sanitizer.feed(view) for view in views)
+        if final:
+            text += sanitizer.flush()
+        
+        if text:
+            if not text.endswith("\n"):
+                text += "\n"
             try:
-                self.output_queue.get_nowait()
-            except queue.Empty:
-                break
+                on_output(text)
+            except Exception as e:
+                self.logger.error(f"Error in shell output callback: {str(e)}")
+        return end
     
-    def send_shell_command(self, command):
-        """Send a command to the active shell session"""
-        if not self.shell_session_active or not self.shell:
-            success, message = self.start_shell_session()
-            if not success:
-                return False, message
+    @staticmethod
+    def _clean_output(output):
+        """Strip control sequences and empty lines from shell output"""
+        return sanitize(output, drop_blank_lines=True).rstrip("\n")
+    
+    def send_command(self, command, timeout=None, on_output=None):
+        """Send a command to the shell, one command at a time"""
+        with self.command_lock:
+            try:
+                return self._send_command(command, timeout, on_output)
+            finally:
+                self.current_token = None
+    
+    def _send_command(self, command, timeout=None, on_output=None):
+        """Send a command to the shell.
+        
+        The command is wrapped with unique begin/end markers; the end marker
+        carries the exit status, so the call returns as soon as the command
+        finishes. The exit status is stored in last_exit_status. on_output,
+        if given, receives cleaned output lines while the command runs.
+        
+        A command that stops to read the terminal (a password prompt, [Y/n],
+        an interpreter) returns early with a waiting note; the next call then
+        sends its text to that command as input instead of as a new command.
+        """
+        if not self.active or not self.shell:
+            return False, "Shell session is not active"
+        
+        timeout = timeout or self.command_timeout
+        self.last_exit_status = None
+        self.last_output_range = None
         
         try:
             # Исправление типичных проблем с Unicode символами
             # Заменяем длинное тире (em dash) на два дефиса
             command = command.replace('—', '--')
             
-            # Для команды ls сначала задаем настройки среды для лучшего вывода
-            is_ls_command = command.strip().startswith("ls ") or command.strip() == "ls"
-            if is_ls_command:
-                # Перед выполнением ls настраиваем псевдо-терминал для лучшего вывода
-                self.shell.send("export COLUMNS=100\n")
-                self.shell.send("export TERM=dumb\n")
-                time.sleep(0.2)  # Даем время на применение настроек
+            # Вывод команды ищем только после текущего конца буфера
+            with self.output_ready:
+                start = self.output.end
+                waiting = self.waiting_token
+                if waiting and self.output.find(
+                    ("%s:%s:" % (END_MARKER, waiting)).encode(), self.waiting_from
+                ) != -1:
+                    # Команда, ждавшая ввода, уже завершилась сама
+                    waiting = None
+            self.waiting_token = None
             
-            # Очищаем очередь вывода перед отправкой команды
-            while not self.output_queue.empty():
-                try:
-                    self.output_queue.get_nowait()
-                except queue.Empty:
-                    break
+            if waiting:
+                # Текст уходит ожидающей команде как ввод, ее маркер уже отправлен
+                token = self.current_token = waiting
+                payload = (command + "\n").encode('utf-8')
+            else:
+                # Отправляем команду, обернутую маркерами начала и конца
+                token = self.current_token = uuid.uuid4().hex
+                payload = self._command_line(token, command).encode('utf-8')
+            started = self.sent_at = time.perf_counter()
+            with span('ssh.send'):
+                self.shell.sendall(payload)
+            count('ssh.bytes_sent', len(payload))
             
-            # Отправляем команду и символ новой строки 
-            self.shell.send(command + "\n")
+            output, exit_status = self._wait_for_marker(
+                token, start, timeout, on_output, has_begin=not waiting, on_idle=self._waiting_for_input
+            )
+            self.last_exit_status = exit_status
+            observe('ssh.command', time.perf_counter() - started)
             
-            # Даем время на выполнение команды
-            time.sleep(1.0)  # Увеличиваем время ожидания начала вывода
+            # Очищаем вывод от служебных символов
+            with span('sanitize'):
+                cleaned_output = self._clean_output(output)
             
-            # Собираем вывод
-            output = ""
-            timeout = 10  # Увеличиваем максимальное время ожидания вывода
-            prompt_wait = 2.0  # Дополнительное время ожидания после обнаружения промпта
-            start_time = time.time()
-            last_output_time = time.time()
-            prompt_found = False
-            prompt_found_time = None
+            if exit_status is None and self.input_requested:
+                self.waiting_token = token
+                self.waiting_from = start
+                note = "[Waiting for input]"
+                return False, f"{cleaned_output}\n{note}" if cleaned_output else note
             
-            while time.time() - start_time < timeout:
-                try:
-                    # Получаем данные из очереди, но не блокируем выполнение надолго
-                    chunk = self.output_queue.get(timeout=0.1)
-                    output += chunk
-                    last_output_time = time.time()
-                    
-                    # Проверяем наличие приглашения командной строки (prompt)
-                    if re.search(r'[\$#>]\s*$', chunk):
-                        # Нашли промпт - запоминаем время
-                        if not prompt_found:
-                            prompt_found = True
-                            prompt_found_time = time.time()
-                        # Но не выходим сразу, а ждем дополнительное время для буферизованного вывода
-                except queue.Empty:
-                    # Проверяем, должны ли мы выйти по тайм-ауту
-                    if prompt_found and time.time() - prompt_found_time > prompt_wait:
-                        # Прошло достаточно времени после обнаружения промпта
-                        break
-                    
-                    # Если давно не было вывода и есть данные и прошло достаточно времени
-                    current_time = time.time()
-                    if output and current_time - last_output_time > 2.0:
-                        # Проверяем наличие промпта во всем выводе
-                        if re.search(r'[\$#>]\s*$', output):
-                            # Нашли промпт в общем выводе
-                            break
-                    continue
+            if exit_status is None:
+                count('ssh.timeouts')
+                if not self.active:
+                    note = "[Shell session closed]"
+                else:
+                    note = f"[Timed out after {timeout}s, command is still running]"
+                return False, f"{cleaned_output}\n{note}" if cleaned_output else note
             
-            # Даем дополнительное время для получения всего вывода
-            time.sleep(0.5)
+            if exit_status != 0:
+                return False, cleaned_output or f"Exit status {exit_status}"
             
-            # Проверяем, есть ли еще данные в очереди
-            while not self.output_queue.empty():
-                try:
-                    chunk = self.output_queue.get(timeout=0.1)
-                    output += chunk
-                except queue.Empty:
-                    break
+            return True, cleaned_output
+        except Exception as e:
+            self.logger.error(f"Error sending command to shell: {str(e)}")
+            return False, f"Error: {str(e)}"
+    
+    def _read_output(self):
+        """Read output from the shell in a separate thread"""
+        shell = self.shell
+        
+        while self.active and shell:
+            try:
+                # recv блокируется до прихода данных, поэтому поток не
+                # просыпается, пока сессия простаивает
+                data = shell.recv(READ_CHUNK_SIZE)
+            except Exception as e:
+                if self.active:
+                    self.logger.error(f"Error reading from shell: {str(e)}")
+                break
             
-            # Извлекаем ошибки если они есть
-            error_pattern = r'((?:error|failed|no such|not found).*?)(?:\n|$)'
-            errors = re.findall(error_pattern, output.lower())
+            if not data:
+                # Канал закрыт удаленной стороной
+                break
             
-            # Очищаем вывод от ввода команды и приглашения командной строки
-            processed_lines = []
-            lines = output.splitlines()
+            sent_at = self.sent_at
+            if sent_at is not None:
+                self.sent_at = None
+                observe('ssh.first_byte', time.perf_counter() - sent_at)
+            count('ssh.bytes_received', len(data))
+            with self.output_ready:
+                self.output.write(data)
+                self.output_ready.notify_all()
+        
+        with self.output_ready:
+            if self.shell is shell:
+                self.active = False
+            self.output_ready.notify_all()
+
+class SSHManager:
+    def __init__(self, server_ip=None, username=None, password=None, key_path=None):
+        self.server_ip = server_ip or os.getenv('SERVER_IP')
+        self.port = env_int('SSH_PORT', 22)
+        self.username = username or os.getenv('SSH_USERNAME', 'root')
+        self.password = password or os.getenv('SSH_PASSWORD')
+        # По умолчанию не используем ключ, если не передан явно
+        self.key_path = None
+        if key_path and os.path.isfile(key_path):
+            self.key_path = key_path
+        
+        if not self.server_ip:
+            raise ValueError("Server IP is required")
+        
+        self.client = None
+        # Обработчики бота работают параллельно: подключение устанавливает один поток
+        self.connect_lock = RLock()
+        self.last_used = 0
+        self.last_error = None
+        # Счетчики подключений и время рукопожатия (SSH handshake + аутентификация)
+        self.stats = {
+            'connects': 0,
+            'reconnects': 0,
+            'failed_connects': 0,
+            'last_handshake_time': None,
+            'total_handshake_time': 0.0,
+        }
+        # Реестр shell-сессий по ключу (chat_id); все каналы открываются
+        # поверх одного транспорта self.client
+        self.sessions = {}
+        self.sessions_lock = Lock()
+        self.command_timeout = DEFAULT_COMMAND_TIMEOUT
+        self.max_output = DEFAULT_MAX_OUTPUT
+        self.logger = logging.getLogger(__name__)
+    
+    def set_password(self, password):
+        """Set SSH password manually"""
+        self.password = password
+        return True
+    
+    def connect(self):
+        """Open a new SSH connection, closing the previous one"""
+        with self.connect_lock:
+            return self._connect()
+    
+    def ensure_connected(self):
+        """Reuse the connection if it is alive, otherwise (re)connect.
+        
+        A dropped connection is re-established with jittered exponential
+        backoff, and the shell sessions it carried are reopened in their
+        last working directory.
+        """
+        with self.connect_lock:
+            if self.is_alive():
+                self.last_used = time.monotonic()
+                return True
             
-            # Флаг для отслеживания первой строки (эхо команды)
-            first_line_skipped = False
+            if self.client is None:
+                # Первое подключение не повторяем: ошибка обычно в настройках
+                connected = self._connect()
+            else:
+                self.logger.warning(f"Connection to {self.server_ip} lost, reconnecting")
+                connected = self._reconnect()
             
-            for line in lines:
-                # Пропускаем первую строку, если она содержит введенную команду
-                if not first_line_skipped and (command in line or line.strip() == ''):
-                    first_line_skipped = True
-                    continue
-                
-                # Удаляем ANSI escape-коды и другие служебные символы
-                line = re.sub(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])', '', line)
-                # Удаляем коды readline ([?2004l и [?2004h)
-                line = re.sub(r'\[\?2004[lh]', '', line)
-                # Удаляем другие возможные управляющие последовательности
-                line = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', line)
+            if connected:
+                self._restore_shell_sessions()
+            return connected
+    
+    def is_alive(self):
+        """Cheap liveness check of the current connection.
+        
+        Transport flags catch connections already found dead by keepalives
+        or TCP; after KEEPALIVE_INTERVAL seconds of disuse a channel is also
+        opened as a round-trip probe, which catches silently dropped NAT state.
+        """
+        transport = self.client.get_transport() if self.client else None
+        if not transport or not transport.is_active() or not transport.is_authenticated():
+            return False
+        if time.monotonic() - self.last_used < KEEPALIVE_INTERVAL:
+            return True
+        
+        try:
+            transport.open_session(timeout=PROBE_TIMEOUT).close()
+            return True
+        except Exception as e:
+            self.logger.warning(f"Liveness probe to {self.server_ip} failed: {str(e)}")
+            return False
+    
+    def connection_stats(self):
+        """Connection counters and handshake timings"""
+        stats = dict(self.stats)
+        connects = stats['connects']
+        stats['average_handshake_time'] = stats['total_handshake_time'] / connects if connects else None
+        return stats
+    
+    def _connect(self):
+        # Старое соединение закрываем, иначе остаются его сокет и потоки
+        self._close_client()
+        self.last_error = None
+        
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        
+        connect_kwargs = {
+            'hostname': self.server_ip,
+            'port': self.port,
+            'username': self.username,
+            'timeout': 10
+        }
+        
+        if self.password:
+            connect_kwargs['password'] = self.password
+            self.logger.info(f"Подключение с использованием пароля")
+        elif self.key_path and os.path.isfile(self.key_path):
+            connect_kwargs['key_filename'] = self.key_path
+            self.logger.info(f"Подключение с использованием SSH ключа: {self.key_path}")
+        else:
+            self.logger.error("Не указан пароль для подключения")
+            self.last_error = paramiko.AuthenticationException("No password or key")
+            return False
+        
+        start_time = time.monotonic()
+        try:
+            client.connect(**connect_kwargs)
+        except Exception as e:
+            client.close()
+            self.last_error = e
+            self.stats['failed_connects'] += 1
+            count('ssh.connect_failures')
+            self.logger.error(f"Failed to connect to {self.server_ip}: {str(e)}")
+            return False
+        
+        handshake_time = time.monotonic() - start_time
+        observe('ssh.connect', handshake_time)
+        self.stats['connects'] += 1
+        self.stats['last_handshake_time'] = handshake_time
+        self.stats['total_handshake_time'] += handshake_time
+        
+        client.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+        # Клиент виден другим потокам только после успешного подключения
+        self.client = client
+        self.last_used = time.monotonic()
+        return True
+    
+    def _reconnect(self):
+        """Reconnect with jittered exponential backoff"""
+        delay = RECONNECT_BASE_DELAY
+        for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+            if self._connect():
+                self.stats['reconnects'] += 1
+                count('ssh.reconnects')
+                self.logger.info(f"Reconnected to {self.server_ip} (attempt {attempt})")
+                return True
+            # Неверный пароль повторными попытками не исправить
+            if isinstance(self.last_error, paramiko.AuthenticationException) or attempt == RECONNECT_ATTEMPTS:
+                break
+            # Случайный разброс, чтобы после общего сбоя сети клиенты не ломились одновременно
+            time.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        return False
+    
+    def _close_client(self):
+        if self.client:
+            try:
+                self.client.close()
+            except Exception as e:
+                self.logger.warning(f"Error closing SSH connection: {str(e)}")
+            self.client = None
+    
+    def _restore_shell_sessions(self):
+        """Reopen shell sessions lost with the previous connection"""
+        with self.sessions_lock:
+            lost = [(key, session) for key, session in self.sessions.items() if session.connection_lost]
+        
+        for session_id, session in lost:
+            # start() перезапишет cwd каталогом входа, поэтому запоминаем его заранее
+            cwd = session.cwd
+            success, output = session.start(self.client)
+            if not success:
+                self.logger.warning(f"Could not restore shell session {session_id}: {output}")
+                with self.sessions_lock:
+                    if self.sessions.get(session_id) is session:
+                        del self.sessions[session_id]
+                continue
+            if cwd:
+                session.send_command(f"cd {shlex.quote(cwd)}", SHELL_READY_TIMEOUT)
+            self.logger.info(f"Restored shell session {session_id}")
+    
+    def disconnect(self):
+        """Close SSH connection"""
+        self.stop_all_shell_sessions()
+        with self.connect_lock:
+            self._close_client()
+    
+    def run_command(self, command, timeout=None, max_output=None):
+        """Execute command and return (exit_status, output, error).
+        
+        stdout and stderr are drained concurrently while the command runs,
+        so large outputs cannot fill the channel window and block the remote
+        side. Each stream keeps at most max_output bytes (head and tail).
+        exit_status is None when the command could not be run or timed out;
+        error then holds the reason.
+        """
+        if not self.ensure_connected():
+            return None, "", "Failed to connect to server"
+        
+        max_output = max_output or self.max_output
+        stdout = CappedOutput(max_output)
+        stderr = CappedOutput(max_output)
+        channel = None
+        
+        try:
+            with span('ssh.channel_open'):
+                channel = self.client.get_transport().open_session()
+            started = time.perf_counter()
+            with span('ssh.send'):
+                channel.exec_command(command)
+            count('ssh.bytes_sent', len(command))
+            deadline = time.monotonic() + timeout if timeout else None
+            received = 0
+            
+            while True:
+                # Читаем все, что уже пришло, пока удаленная сторона пишет дальше
+                while channel.recv_ready():
+                    data = channel.recv(READ_CHUNK_SIZE)
+                    if not received:
+                        observe('ssh.first_byte', time.perf_counter() - started)
+                    received += len(data)
+                    stdout.write(data)
+                while channel.recv_stderr_ready():
+                    data = channel.recv_stderr(READ_CHUNK_SIZE)
+                    if not received:
+                        observe('ssh.first_byte', time.perf_counter() - started)
+                    received += len(data)
+                    stderr.write(data)
                 
-                # Игнорируем строки, содержащие приглашение командной строки
-                if re.search(r'[@:].*[#$>]', line) or not line.strip():
-                    continue
+                # Код завершения приходит после всех данных канала
+                if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                    break
                 
-                # Специальная обработка для вывода команды ls
-                if is_ls_command:
-                    # Заменяем последовательности из более чем 2-х пробелов на один или два пробела
-                    line = re.sub(r' {3,}', '  ', line)
+                if deadline is None:
+                    wait = None
+                else:
+                    wait = deadline - time.monotonic()
+                    if wait <= 0:
+                        count('ssh.timeouts')
+                        count('ssh.bytes_received', received)
+                        return None, stdout.getvalue(), f"Timed out after {timeout}s"
                 
-                # Добавляем очищенную строку в результат
-                if line.strip():
-                    processed_lines.append(line)
-            
-            # Формируем итоговый вывод
-            cleaned_output = "\n".join(processed_lines)
-            
-            # Если это была команда ls, улучшаем форматирование вывода
-            if is_ls_command:
-                # Обрабатываем вывод ls для более аккуратного отображения
-                formatted_output = self._format_ls_output(cleaned_output)
-                return True, formatted_output
+                # Канал становится читаемым при данных в stdout/stderr и при закрытии
+                select.select([channel], [], [], wait)
             
-            # Если нашли ошибки и выход пустой, возвращаем ошибку
-            if errors and not cleaned_output.strip():
-                return False, "\n".join(errors)
-            
-            return True, cleaned_output
+            observe('ssh.exec', time.perf_counter() - started)
+            count('ssh.bytes_received', received)
+            return channel.recv_exit_status(), stdout.getvalue(), stderr.getvalue()
         except Exception as e:
-            self.logger.error(f"Error sending command to shell: {str(e)}")
+            self.logger.error(f"Error executing command: {str(e)}")
+            return None, stdout.getvalue(), f"Error: {str(e)}"
+        finally:
+            if channel:
+                channel.close()
+    
+    def open_sftp(self):
+        """Open an SFTP session over the shared connection.
+        
+        Returns (True, SFTPClient) or (False, error); the caller closes it.
+        """
+        if not self.ensure_connected():
+            return False, "Failed to connect to server"
+        
+        try:
+            return True, self.client.open_sftp()
+        except Exception as e:
+            self.logger.error(f"Error opening SFTP session: {str(e)}")
             return False, f"Error: {str(e)}"
     
-    def _format_ls_output(self, output):
-        """Форматирует вывод команды ls для лучшей читаемости"""
-        lines = output.splitlines()
-        files = []
+    def shell_cwd(self, session_id):
+        """Last known working directory of the shell session, or None"""
+        with self.sessions_lock:
+            session = self.sessions.get(session_id)
+        return session.cwd if session else None
+    
+    def get_shell_session(self, session_id):
+        """Return the active shell session for session_id, or None"""
+        with self.sessions_lock:
+            session = self.sessions.get(session_id)
+        if session and session.active:
+            return session
+        return None
+    
+    def has_shell_session(self, session_id):
+        """Check whether session_id has a shell session.
         
-        # Удаляем пустые строки и собираем файлы
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Пропускаем строки с командными промптами
-            if re.search(r'[@:].*[#$>]', line):
-                continue
-                
-            # Корректная обработка файлов с пробелами, заключенных в кавычки
-            current = ""
-            in_quotes = False
-            quote_char = None
-            
-            # Обрабатываем строку символ за символом
-            for char in line + ' ':  # Добавляем пробел в конец для обработки последнего файла
-                if (char == "'" or char == '"') and not in_quotes:
-                    # Начало строки в кавычках
-                    in_quotes = True
-                    quote_char = char
-                    current += char
-                elif char == quote_char and in_quotes:
-                    # Конец строки в кавычках
-                    in_quotes = False
-                    quote_char = None
-                    current += char
-                elif char.isspace() and not in_quotes:
-                    # Пробел вне кавычек - разделитель файлов
-                    if current:
-                        files.append(current.strip())
-                        current = ""
-                else:
-                    # Обычный символ
-                    current += char
+        Sessions lost with a dropped connection count too: they are
+        restored on the next command.
+        """
+        with self.sessions_lock:
+            session = self.sessions.get(session_id)
+        return bool(session) and (session.active or session.connection_lost)
+    
+    def start_shell_session(self, session_id):
+        """Start an interactive shell session for session_id"""
+        if not self.ensure_connected():
+            return False, "Failed to connect to server"
         
-        # Если файлов нет, возвращаем оригинальный вывод
-        if not files:
-            return output
-            
-        # Сортируем файлы для лучшей читаемости
-        files.sort()
-        
-        # Определяем максимальную длину имени файла для вычисления ширины колонки
-        max_length = max(len(file) for file in files) + 2  # +2 для дополнительного пространства
-        
-        # Форматируем вывод в таблицу с 3 колонками
-        columns = 3
-        rows = (len(files) + columns - 1) // columns  # Округление вверх для определения числа строк
-        
-        result = []
-        
-        for row in range(rows):
-            row_files = []
-            for col in range(columns):
-                idx = row + col * rows
-                if idx < len(files):
-                    # Форматируем каждый файл по фиксированной ширине колонки
-                    file_entry = files[idx].ljust(max_length)
-                    row_files.append(file_entry)
-            
-            result.append("".join(row_files))
+        if self.get_shell_session(session_id):
+            return True, "Shell session already active"
         
-        return "\n".join(result)
+        session = ShellSession(session_id, self.command_timeout)
+        success, output = session.start(self.client)
+        if success:
+            with self.sessions_lock:
+                old_session = self.sessions.get(session_id)
+                self.sessions[session_id] = session
+            if old_session:
+                old_session.stop()
+        return success, output
     
-    def _read_shell_output(self):
-        """Read output from the shell in a separate thread"""
-        buffer_size = 8192  # Увеличиваем размер буфера
+    def stop_shell_session(self, session_id):
+        """Stop the interactive shell session for session_id"""
+        with self.sessions_lock:
+            session = self.sessions.pop(session_id, None)
+        if session:
+            session.stop()
+    
+    def stop_all_shell_sessions(self):
+        """Stop every shell session"""
+        with self.sessions_lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.stop()
+    
+    def send_shell_command(self, command, session_id, timeout=None, on_output=None):
+        """Send a command to the shell session of session_id, starting it if needed"""
+        # Проверка соединения заодно восстанавливает сессии после обрыва
+        if not self.ensure_connected():
+            return False, "Failed to connect to server"
         
-        while self.shell_session_active and self.shell:
-            try:
-                if self.shell.recv_ready():
-                    # Считываем данные, пока они есть в буфере
-                    data = self.shell.recv(buffer_size).decode('utf-8', errors='replace')
-                    self.output_queue.put(data)
-                    
-                    # Продолжаем считывать, пока есть данные
-                    read_attempts = 0
-                    max_read_attempts = 5
-                    
-                    while read_attempts < max_read_attempts:
-                        if self.shell.recv_ready():
-                            more_data = self.shell.recv(buffer_size).decode('utf-8', errors='replace')
-                            if more_data:
-                                self.output_queue.put(more_data)
-                                read_attempts = 0  # Сбрасываем счетчик, если получили данные
-                            else:
-                                read_attempts += 1
-                        else:
-                            read_attempts += 1
-                        time.sleep(0.05)  # Маленькая пауза между проверками
-                else:
-                    # Нет данных - ждем немного
-                    time.sleep(0.1)
-            except Exception as e:
-                self.logger.error(f"Error reading from shell: {str(e)}")
-                self.shell_session_active = False
-                break 
\ No newline at end of file
+        session = self.get_shell_session(session_id)
+        if not session:
+            success, message = self.start_shell_session(session_id)
+            if not success:
+                return False, message
+            session = self.get_shell_session(session_id)
+        
+        return session.send_command(command, timeout, on_output)
+    
+    def send_shell_input(self, session_id, data):
+        """Write raw input (e.g. Ctrl+C) to the shell session of session_id"""
+        session = self.get_shell_session(session_id)
+        return session.send(data) if session else False
+    
+    def interrupt_shell(self, session_id):
+        """Send Ctrl+C to the command running in the shell session of session_id"""
+        session = self.get_shell_session(session_id)
+        return session.interrupt() if session else False
+    
+    def last_exit_status(self, session_id):
+        """Exit status of the last command in the shell session of session_id"""
+        with self.sessions_lock:
+            session = self.sessions.get(session_id)
+        return session.last_exit_status if session else None
+    
+    def shell_waiting_for_input(self, session_id):
+        """Whether a command in the shell session of session_id waits for input"""
+        with self.sessions_lock:
+            session = self.sessions.get(session_id)
+        return bool(session and session.waiting_token)
+    
+    def write_last_output(self, session_id, fileobj):
+        """Write the full output of the last shell command of session_id to fileobj"""
+        session = self.get_shell_session(session_id)
+        return session.write_last_output(fileobj) if session else False
@@ -0,0 +1,216 @@
+import time
+from collections import namedtuple
+
+from delivery import format_size
+
+PROBE_TIMEOUT = 10
+
+# Все данные собираются одной командой: один канал и один round trip.
+# Секции разделены строками "@@имя"
+PROBE_SCRIPT = "; ".join([
+    "echo @@hostname", "hostname",
+    "echo @@uptime", "cat /proc/uptime",
+    "echo @@loadavg", "cat /proc/loadavg",
+    "echo @@stat", "grep '^cpu' /proc/stat",
+    "echo @@meminfo", "cat /proc/meminfo",
+    "echo @@netdev", "cat /proc/net/dev",
+    # statfs через df; псевдо-ФС пропускаем, busybox df не знает -x
+    "echo @@df", "(df -P -k -x tmpfs -x devtmpfs -x squashfs -x overlay 2>/dev/null || df -P -k)",
+])
+
+Mount = namedtuple('Mount', ['mount_point', 'filesystem', 'total', 'used', 'available'])
+
+
+class StatusSnapshot(namedtuple('StatusSnapshot', [
+    'hostname', 'taken_at', 'uptime', 'load', 'running_processes', 'total_processes',
+    'cpu_count', 'cpu_total', 'cpu_idle', 'cpu_percent',
+    'memory_total', 'memory_available', 'swap_total', 'swap_free', 'mounts',
+    'net_received', 'net_sent',
+])):
+    """Parsed server status; sizes are in bytes, times in seconds"""
+
+    __slots__ = ()
+
+    @property
+    def memory_used(self):
+        return self.memory_total - self.memory_available
+
+    @property
+    def swap_used(self):
+        return self.swap_total - self.swap_free
+
+
+def _parse_sections(output):
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        if line.startswith('@@'):
+            current = sections.setdefault(line[2:].strip(), [])
+        elif current is not None:
+            current.append(line)
+    return sections
+
+
+def _parse_meminfo(lines):
+    """/proc/meminfo values in bytes"""
+    values = {}
+    for line in lines:
+        name, _, value = line.partition(':')
+        fields = value.split()
+        if fields and fields[0].isdigit():
+            values[name] = int(fields[0]) * 1024
+    return values
+
+
+def _parse_df(lines):
+    mounts = []
+    for line in lines[1:]:
+        fields = line.split()
+        # Filesystem 1024-blocks Used Available Capacity Mounted-on
+        if len(fields) < 6 or not fields[1].isdigit():
+            continue
+        total, used, available = (int(value) * 1024 for value in fields[1:4])
+        if total:
+            mounts.append(Mount(' '.join(fields[5:]), fields[0], total, used, available))
+    return mounts
+
+
+def _parse_netdev(lines):
+    """Bytes received and sent by all interfaces except loopback"""
+    received = sent = 0
+    for line in lines:
+        name, separator, counters = line.partition(':')
+        fields = counters.split()
+        # Две строки заголовка не содержат ':' с числами после него
+        if not separator or name.strip() == 'lo' or len(fields) < 9 or not fields[0].isdigit():
+            continue
+        received += int(fields[0])
+        sent += int(fields[8])
+    return received, sent
+
+
+def parse_snapshot(output, previous=None, taken_at=None):
+    """Build a StatusSnapshot from PROBE_SCRIPT output.
+
+    CPU usage needs two counter readings, so cpu_percent is computed
+    against the previous snapshot of the same host and is None without one.
+    Raises ValueError if the output lacks the /proc data.
+    """
+    sections = _parse_sections(output)
+    try:
+        uptime = float(sections['uptime'][0].split()[0])
+        loadavg = sections['loadavg'][0].split()
+        running, total = loadavg[3].split('/')
+        cpu_lines = [line.split() for line in sections['stat']]
+        meminfo = _parse_meminfo(sections['meminfo'])
+    except (KeyError, IndexError, ValueError) as e:
+        raise ValueError(f"Unexpected status probe output: {e}")
+
+    # Первая строка - сумма по всем CPU: user nice system idle iowait irq softirq steal
+    counters = [int(value) for value in cpu_lines[0][1:9]]
+    cpu_total = sum(counters)
+    cpu_idle = counters[3] + (counters[4] if len(counters) > 4 else 0)
+
+    cpu_percent = None
+    if previous is not None and cpu_total > previous.cpu_total:
+        busy = (cpu_total - previous.cpu_total) - (cpu_idle - previous.cpu_idle)
+        cpu_percent = 100.0 * busy / (cpu_total - previous.cpu_total)
+
+    hostname = sections.get('hostname') or ['']
+    memory_total = meminfo.get('MemTotal', 0)
+    net_received, net_sent = _parse_netdev(sections.get('netdev', []))
+    return StatusSnapshot(
+        hostname=hostname[0].strip(),
+        taken_at=taken_at or time.time(),
+        uptime=uptime,
+        load=tuple(float(value) for value in loadavg[:3]),
+        running_processes=int(running),
+        total_processes=int(total),
+        cpu_count=max(1, len(cpu_lines) - 1),
+        cpu_total=cpu_total,
+        cpu_idle=cpu_idle,
+        cpu_percent=cpu_percent,
+        memory_total=memory_total,
+        # MemAvailable нет в старых ядрах
+        memory_available=meminfo.get('MemAvailable', meminfo.get('MemFree', 0)),
+        swap_total=meminfo.get('SwapTotal', 0),
+        swap_free=meminfo.get('SwapFree', 0),
+        mounts=_parse_df(sections.get('df', [])),
+        net_received=net_received,
+        net_sent=net_sent,
+    )
+
+
+class StatusProbe:
+    """Takes status snapshots of one server, one exec round trip each"""
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.previous = None
+
+    def probe(self, timeout=PROBE_TIMEOUT):
+        """Return (True, StatusSnapshot) or (False, error message)"""
+        exit_status, output, error = self.manager.run_command(PROBE_SCRIPT, timeout=timeout)
+        if exit_status is None:
+            return False, error
+
+        try:
+            snapshot = parse_snapshot(output, self.previous)
+        except ValueError as e:
+            return False, f"{e}\n{error}".strip()
+
+        self.previous = snapshot
+        return True, snapshot
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days} д {hours} ч"
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    if minutes:
+        return f"{minutes} мин"
+    return f"{seconds} с"
+
+
+def usage_bar(fraction, width=10):
+    """Text progress bar, e.g. ███████░░░"""
+    filled = round(max(0.0, min(1.0, fraction)) * width)
+    return "█" * filled + "░" * (width - filled)
+
+
+def _usage_line(used, total):
+    fraction = used / total if total else 0
+    return f"{usage_bar(fraction)} {fraction * 100:3.0f}%  {format_size(used)} / {format_size(total)}"
+
+
+def format_dashboard(snapshot, server=None):
+    """Render a snapshot as a compact Markdown dashboard"""
+    title = f"`{snapshot.hostname}`" + (f" ({server})" if server else "")
+    load = " ".join(f"{value:.2f}" for value in snapshot.load)
+
+    lines = [
+        f"📊 *Статус сервера* {title}",
+        f"⏱ Аптайм: {format_duration(snapshot.uptime)}",
+        f"⚙️ Нагрузка: {load} на {snapshot.cpu_count} CPU, "
+        f"процессы: {snapshot.running_processes}/{snapshot.total_processes}",
+    ]
+    if snapshot.cpu_percent is not None:
+        lines.append(f"🔥 CPU: {snapshot.cpu_percent:.0f}% с прошлой проверки")
+
+    rows = [("RAM", _usage_line(snapshot.memory_used, snapshot.memory_total))]
+    if snapshot.swap_total:
+        rows.append(("Swap", _usage_line(snapshot.swap_used, snapshot.swap_total)))
+    for mount in snapshot.mounts:
+        rows.append((mount.mount_point, _usage_line(mount.used, mount.total)))
+
+    width = min(16, max(len(name) for name, _ in rows))
+    # У длинных точек монтирования важнее конец пути
+    table = "\n".join(
+        f"{name if len(name) <= width else '…' + name[1 - width:]:<{width}} {usage}" for name, usage in rows
+    )
+    lines.append(f"```\n{table}\n```")
+    return "\n".join(lines)
@@ -0,0 +1,133 @@
+import logging
+import time
+from threading import Lock, Timer
+
+from telegram import ParseMode
+from telegram.error import BadRequest
+
+# Не чаще одного редактирования сообщения в секунду
+DEFAULT_EDIT_INTERVAL = 1.0
+# Запас до лимита Telegram в 4096 символов на обрамление ```
+MAX_MESSAGE_LENGTH = 4000
+# Сколько сообщений может занять поток, дальше обновляется только хвост
+MAX_STREAM_MESSAGES = 3
+
+
+class MessageStreamer:
+    """Streams command output into a Telegram message via throttled edits.
+
+    Nothing is sent until the command has run for `interval` seconds, so
+    fast commands keep their usual single reply. After that the output is
+    shown in one message that is edited at most once per `interval`; when
+    it fills up the streamer continues in a new message, up to max_messages;
+    after that the last message keeps showing the tail of the output.
+    bot is expected to be a send_queue.QueuedBot.
+    """
+
+    def __init__(self, bot, chat_id, interval=DEFAULT_EDIT_INTERVAL, max_length=MAX_MESSAGE_LENGTH,
+                 max_messages=MAX_STREAM_MESSAGES):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_length = max_length
+        self.max_messages = max_messages
+        self.messages_sent = 0
+        self.message = None
+        # Текст текущего сообщения и то, что уже показано пользователю
+        self.text = ""
+        self.shown_text = None
+        self.last_edit_time = 0
+        self.started_at = time.monotonic()
+        self.finished = False
+        self.lock = Lock()
+        self.timer = None
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def started(self):
+        """Whether any output has been sent to the chat"""
+        return self.message is not None
+
+    def feed(self, text):
+        """Add a piece of output; it is shown on the next throttled edit"""
+        with self.lock:
+            if self.finished:
+                return
+            self.text += text
+            self._flush_due()
+
+    def finish(self, footer=None):
+        """Flush the remaining output. Returns False if nothing was ever sent."""
+        with self.lock:
+            self.finished = True
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.started:
+                return False
+            self._flush(footer)
+            return True
+
+    def _flush_due(self):
+        now = time.monotonic()
+        # Первое сообщение - через interval после старта, дальше не чаще interval
+        due_at = self.started_at if not self.started else self.last_edit_time
+        due_at += self.interval
+        if now >= due_at:
+            self._flush()
+        elif not self.timer:
+            # Досылаем накопленное, даже если новых данных больше не будет
+            self.timer = Timer(due_at - now, self._on_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _on_timer(self):
+        with self.lock:
+            self.timer = None
+            if not self.finished:
+                self._flush()
+
+    def _flush(self, footer=None):
+        # Переполненное сообщение закрываем и продолжаем в новом
+        while len(self.text) > self.max_length:
+            if self.messages_sent >= self.max_messages - 1:
+                # Новых сообщений больше не создаем, оставляем хвост вывода
+                cut = len(self.text) - self.max_length + 4
+                line_start = self.text.find("\n", cut) + 1
+                self.text = "...\n" + self.text[line_start or cut:]
+                break
+            split_at = self.text.rfind("\n", 0, self.max_length)
+            if split_at <= 0:
+                split_at = self.max_length
+            self._show(self.text[:split_at])
+            self.text = self.text[split_at:].lstrip("\n")
+            self.message = None
+            self.shown_text = None
+            self.messages_sent += 1
+
+        self._show(self.text, footer)
+        self.last_edit_time = time.monotonic()
+
+    def _show(self, text, footer=None):
+        body = f"```\n{text.rstrip() or '...'}\n```"
+        if footer:
+            body += f"\n{footer}"
+        if body == self.shown_text:
+            return
+
+        try:
+            if self.message is None:
+                self.message = self.bot.send_message(
+                    chat_id=self.chat_id, text=body, parse_mode=ParseMode.MARKDOWN
+                )
+            else:
+                # Правку не ждем, чтобы не тормозить чтение вывода; если
+                # очередь не успела ее отправить, она заменится следующей
+                self.bot.edit_message_text(
+                    chat_id=self.chat_id, message_id=self.message.message_id,
+                    text=body, parse_mode=ParseMode.MARKDOWN, wait=False
+                )
+            self.shown_text = body
+        except BadRequest as e:
+            # Например, "message is not modified" или сломанная разметка
+            self.logger.warning(f"Could not update streamed message: {e}")
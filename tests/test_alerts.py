@@ -0,0 +1,62 @@
+import pytest
+
+from alerts import AlertEngine, parse_rule, parse_rules
+from status_probe import Mount, StatusSnapshot
+
+
+def snapshot(taken_at, load1=0.0, root_used=0, cpu_count=2):
+    fields = dict.fromkeys(StatusSnapshot._fields)
+    fields.update(
+        hostname='web', taken_at=taken_at, load=(load1, 0.0, 0.0), cpu_count=cpu_count,
+        mounts=[Mount('/', '/dev/sda1', 100, root_used, 100 - root_used)],
+    )
+    return StatusSnapshot(**fields)
+
+
+def test_parse_rule():
+    rule = parse_rule(' Disk:/data >= 90% for 5m ')
+    assert (rule.metric, rule.operator, rule.threshold, rule.duration) == ('disk:/data', '>=', 90.0, 300)
+    rule = parse_rule('load > ncpu*2')
+    assert (rule.metric, rule.threshold, rule.per_cpu, rule.duration) == ('load1', 2.0, True, 0)
+
+
+@pytest.mark.parametrize('text', ['disk', 'foo > 1', 'mem > 90% for 5', 'mem > 90% for ever', 'cpu >'])
+def test_invalid_rules(text):
+    with pytest.raises(ValueError):
+        parse_rule(text)
+
+
+def test_parse_rules_skips_empty_parts():
+    assert [rule.metric for rule in parse_rules('mem > 90%; ;disk > 80%')] == ['mem', 'disk']
+
+
+def test_fires_after_duration_and_clears_with_hysteresis():
+    alerts = []
+    engine = AlertEngine([parse_rule('disk:/ > 90% for 30s')], alerts.append, hysteresis=0.05)
+    for taken_at, used in ((0, 95), (20, 96), (30, 95)):
+        engine.evaluate(snapshot(taken_at, root_used=used), {})
+    assert [alert.firing for alert in alerts] == [True]
+
+    # Около порога тревога не мигает: снимается только ниже 90 - 5%
+    for taken_at, used in ((40, 89), (50, 91), (60, 86)):
+        engine.evaluate(snapshot(taken_at, root_used=used), {})
+    assert [alert.firing for alert in alerts] == [True]
+    engine.evaluate(snapshot(70, root_used=85), {})
+    assert [alert.firing for alert in alerts] == [True, False]
+
+
+def test_breach_shorter_than_duration_does_not_fire():
+    alerts = []
+    engine = AlertEngine([parse_rule('mem > 90% for 1m')], alerts.append)
+    for taken_at, mem in ((0, 95), (30, 95), (45, 50), (60, 95), (100, 95)):
+        engine.evaluate(snapshot(taken_at), {'mem': mem})
+    assert alerts == []
+
+
+def test_per_cpu_threshold():
+    alerts = []
+    engine = AlertEngine([parse_rule('load1 > ncpu*2')], alerts.append)
+    engine.evaluate(snapshot(0, load1=5.0, cpu_count=4), {})
+    assert alerts == []
+    engine.evaluate(snapshot(1, load1=9.0, cpu_count=4), {})
+    assert [(alert.firing, alert.threshold) for alert in alerts] == [(True, 8.0)]
@@ -0,0 +1,23 @@
+import pytest
+
+from config import env_float, env_int
+
+
+def test_empty_value_means_default(monkeypatch):
+    monkeypatch.setenv('TEST_SETTING', '')
+    assert env_int('TEST_SETTING', 5) == 5
+    assert env_float('TEST_SETTING', 0.5) == 0.5
+
+
+def test_unset_and_set_values(monkeypatch):
+    monkeypatch.delenv('TEST_SETTING', raising=False)
+    assert env_int('TEST_SETTING', 5) == 5
+    monkeypatch.setenv('TEST_SETTING', ' 7 ')
+    assert env_int('TEST_SETTING', 5) == 7
+    assert env_float('TEST_SETTING', 0.5) == 7.0
+
+
+def test_invalid_value_is_an_error(monkeypatch):
+    monkeypatch.setenv('TEST_SETTING', 'seven')
+    with pytest.raises(ValueError):
+        env_int('TEST_SETTING', 5)
@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from output_buffer import CappedOutput, RingBuffer
+
+
+def filled(capacity, chunks):
+    """RingBuffer and the whole stream written to it"""
+    ring = RingBuffer(capacity)
+    stream = b""
+    for chunk in chunks:
+        ring.write(chunk)
+        stream += chunk
+    return ring, stream
+
+
+def test_capacity_must_be_positive():
+    with pytest.raises(ValueError):
+        RingBuffer(0)
+
+
+def test_keeps_the_last_capacity_bytes():
+    ring, stream = filled(8, [b"abc", b"defgh", b"ijklm"])
+    assert (ring.start, ring.end, len(ring)) == (5, 13, 8)
+    assert ring.read(0) == stream[-8:]
+    assert ring.read(7, 10) == stream[7:10]
+    # Часть за пределами сохраненного диапазона отбрасывается
+    assert ring.read(0, 6) == stream[5:6]
+
+
+def test_write_larger_than_capacity_keeps_tail():
+    ring, stream = filled(4, [b"xy", b"0123456789"])
+    assert ring.end == len(stream)
+    assert ring.read(0) == b"6789"
+
+
+def test_views_split_at_the_wrap_point():
+    ring, stream = filled(8, [b"abcdef", b"ghij"])
+    views = ring.views(ring.start)
+    assert len(views) == 2
+    assert b"".join(views) == stream[-8:]
+
+
+def test_random_writes_match_the_stream():
+    rng = random.Random(7)
+    ring = RingBuffer(64)
+    stream = b""
+    for _ in range(500):
+        chunk = bytes(rng.choice(b"ab\n") for _ in range(rng.randrange(0, 100)))
+        ring.write(chunk)
+        stream += chunk
+        begin = rng.randrange(max(0, len(stream) - 80), len(stream) + 1)
+        end = rng.randrange(begin, len(stream) + 1)
+        kept = max(begin, ring.start)
+        assert ring.read(begin, end) == stream[kept:max(kept, end)]
+        for sub in (b"\n", b"ab\n", b"ba"):
+            assert ring.find(sub, begin, end) == stream.find(sub, kept, end)
+            assert ring.rfind(sub, begin, end) == stream.rfind(sub, kept, end)
+
+
+def test_find_across_the_wrap_point():
+    ring, stream = filled(8, [b"xxxxxx@@", b"end"])
+    assert ring.find(b"@@end", ring.start) == stream.find(b"@@end")
+    assert ring.rfind(b"@@end", ring.start) == stream.rfind(b"@@end")
+    assert ring.find(b"missing", ring.start) == -1
+
+
+def test_capped_output_keeps_head_and_tail():
+    output = CappedOutput(10)
+    for chunk in (b"0123", b"456789", b"abcdef"):
+        output.write(chunk)
+    assert output.skipped == 6
+    assert output.getvalue() == "01234\n... [6 bytes skipped] ...\nbcdef"
+
+
+def test_capped_output_short_stream_is_whole():
+    output = CappedOutput(100)
+    output.write("вывод ".encode())
+    output.write(b"ok")
+    assert output.skipped == 0
+    assert output.getvalue() == "вывод ok"
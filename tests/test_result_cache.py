@@ -0,0 +1,56 @@
+import pytest
+
+import result_cache
+from result_cache import ResultCache, format_age
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_entry_expires_after_ttl(clock):
+    cache = ResultCache()
+    cache.put('host', 'df -h', 'out', ttl=10)
+    clock[0] += 4
+    assert cache.get('host', 'df -h') == ('out', 4)
+    clock[0] += 6
+    assert cache.get('host', 'df -h') is None
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = ResultCache(max_entries=2)
+    cache.put('host', 'a', 1, ttl=60)
+    cache.put('host', 'b', 2, ttl=60)
+    cache.get('host', 'a')
+    cache.put('host', 'c', 3, ttl=60)
+    assert cache.get('host', 'b') is None
+    assert cache.get('host', 'a') == (1, 0)
+    assert cache.get('host', 'c') == (3, 0)
+
+
+def test_disabled_cache_and_zero_ttl_store_nothing(clock):
+    cache = ResultCache(max_entries=0)
+    cache.put('host', 'a', 1, ttl=60)
+    assert cache.get('host', 'a') is None
+    cache = ResultCache()
+    cache.put('host', 'a', 1, ttl=0)
+    assert cache.get('host', 'a') is None
+
+
+def test_invalidate_host_or_everything(clock):
+    cache = ResultCache()
+    cache.put('web', 'a', 1, ttl=60)
+    cache.put('db', 'a', 2, ttl=60)
+    cache.invalidate('web')
+    assert cache.get('web', 'a') is None
+    assert cache.get('db', 'a') == (2, 0)
+    cache.invalidate()
+    assert cache.get('db', 'a') is None
+
+
+def test_format_age():
+    assert format_age(12.4) == "12 с"
+    assert format_age(185) == "3 мин"
@@ -0,0 +1,58 @@
+import pytest
+
+from sanitizer import TerminalSanitizer, sanitize, sanitize_bytes
+
+
+@pytest.mark.parametrize('raw, clean', [
+    (b'\x1b[1;32mok\x1b[0m\n', b'ok\n'),
+    (b'\x1b]0;user@host: ~\x07$ ls\n', b'$ ls\n'),
+    (b'\x1b]0;title\x1b\\text', b'text'),
+    (b'\x1b(Bplain', b'plain'),
+    (b'\x1b[?2004hprompt$ \x1b[?2004l', b'prompt$ '),
+    # Остатки кода readline без ESC после обрезки вывода
+    (b'[?2004lout', b'out'),
+    (b'a\x00b\x07c\x7fd', b'abcd'),
+    (b'tab\tkept\r\n', b'tab\tkept\n'),
+])
+def test_strips_escapes_and_controls(raw, clean):
+    assert sanitize_bytes(raw) == clean
+
+
+def test_carriage_return_overprints_like_a_terminal():
+    assert sanitize_bytes(b' 10%\r 50%\r100% done\n') == b'100% done\n'
+    # Короткий сегмент перекрывает только начало строки
+    assert sanitize_bytes(b'abcdef\rXY\n') == b'XYcdef\n'
+
+
+def test_backspace_and_non_ascii_overprint():
+    assert sanitize_bytes(b'abc\x08\x08X\n') == b'aX\n'
+    # Перезапись считается по символам, а не по байтам UTF-8
+    assert sanitize('привет\rПР\n') == 'ПРивет\n'
+
+
+def test_c1_controls_removed_but_cyrillic_kept():
+    assert sanitize_bytes('a\u009bb мир'.encode()) == 'ab мир'.encode()
+
+
+def test_drop_blank_lines():
+    assert sanitize_bytes(b'one\n\n  \t\ntwo\n\n', drop_blank_lines=True) == b'one\ntwo\n'
+
+
+def test_plain_text_is_unchanged():
+    data = 'обычный вывод\nбез кодов\n'.encode() * 100
+    assert sanitize_bytes(data) == data
+
+
+def test_stream_handles_splits_inside_escapes_and_characters():
+    raw = '\x1b[31mкрасный\x1b[0m\r\nвторая 50%\rвторая 100%\n'.encode()
+    for size in (1, 2, 3, 7):
+        stream = TerminalSanitizer()
+        chunks = [raw[i:i + size] for i in range(0, len(raw), size)]
+        out = "".join(stream.feed(chunk) for chunk in chunks) + stream.flush()
+        assert out == sanitize(raw)
+
+
+def test_flush_drops_a_truncated_escape():
+    stream = TerminalSanitizer()
+    assert stream.feed(b'done\x1b[3') == ''
+    assert stream.flush() == 'done'
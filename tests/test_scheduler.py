@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import FairScheduler, QuotaExceeded
+
+
+@pytest.fixture
+def gated():
+    """Scheduler factory whose workers are held by a gate task until release()"""
+    schedulers = []
+    gate = threading.Event()
+
+    def make(max_workers=1, **limits):
+        scheduler = FairScheduler(max_workers=max_workers, **limits)
+        started = [scheduler.submit(('gate', n), gate.wait, 5) for n in range(max_workers)]
+        for future in started:
+            # Ждем, пока все потоки заняты воротами
+            while not future.running():
+                time.sleep(0.001)
+        schedulers.append(scheduler)
+        return scheduler
+
+    make.release = gate.set
+    yield make
+    gate.set()
+    for scheduler in schedulers:
+        scheduler.shutdown()
+
+
+def test_users_take_turns(gated):
+    scheduler = gated()
+    order = []
+    futures = [scheduler.submit(name, order.append, name, user=name[0]) for name in ('a1', 'a2', 'a3', 'b1', 'b2')]
+    gated.release()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == ['a1', 'b1', 'a2', 'b2', 'a3']
+
+
+def test_same_key_runs_in_order_one_at_a_time(gated):
+    scheduler = gated(max_workers=4)
+    active = []
+    overlaps = []
+    order = []
+
+    def task(number):
+        active.append(number)
+        overlaps.append(len(active))
+        time.sleep(0.01)
+        order.append(number)
+        active.remove(number)
+
+    futures = [scheduler.submit('chat', task, number, user=number % 2) for number in range(6)]
+    gated.release()
+    for future in futures:
+        future.result(timeout=5)
+    assert order == list(range(6))
+    assert max(overlaps) == 1
+
+
+def test_user_limit_bounds_concurrency(gated):
+    scheduler = gated(max_workers=4, user_limit=2)
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def task():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    futures = [scheduler.submit(number, task, user='flood') for number in range(6)]
+    gated.release()
+    for future in futures:
+        future.result(timeout=5)
+    assert peak[0] == 2
+
+
+def test_queue_limit_rejects_more_waiting_tasks(gated):
+    scheduler = gated(queue_limit=2)
+    scheduler.submit(1, int, user='flood')
+    scheduler.submit(2, int, user='flood')
+    with pytest.raises(QuotaExceeded):
+        scheduler.submit(3, int, user='flood')
+    # Лимит у каждого пользователя свой
+    other = scheduler.submit(4, int, user='other')
+    gated.release()
+    assert other.result(timeout=5) == 0
+
+
+def test_position_counts_other_users_round(gated):
+    scheduler = gated()
+    for number in range(3):
+        scheduler.submit(('a', number), int, user='a')
+    first = scheduler.submit(('b', 0), int, user='b')
+    second = scheduler.submit(('b', 1), int, user='b')
+    # До первой задачи b пройдет одна задача a, до второй - две
+    assert scheduler.position(first) == 1
+    assert scheduler.position(second) == 3
+    gated.release()
+
+
+def test_exception_is_set_on_future(gated):
+    scheduler = gated()
+    future = scheduler.submit('chat', int, 'not a number')
+    gated.release()
+    with pytest.raises(ValueError):
+        future.result(timeout=5)
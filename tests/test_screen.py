@@ -0,0 +1,49 @@
+from screen import Screen
+
+
+def render(data, columns=10, rows=4):
+    screen = Screen(columns, rows)
+    screen.feed(data)
+    return screen.render()
+
+
+def test_text_wraps_and_scrolls():
+    assert render(b"one\r\ntwo\r\n") == "one\ntwo"
+    assert render(b"0123456789ab") == "0123456789\nab"
+    assert render(b"1\r\n2\r\n3\r\n4\r\n5") == "2\n3\n4\n5"
+
+
+def test_cursor_movement_and_erase():
+    assert render(b"hello\x1b[1;2HA") == "hAllo"
+    assert render(b"hello\x1b[3D\x1b[K") == "he"
+    assert render(b"one\r\ntwo\x1b[2J\x1b[Hx") == "x"
+    assert render(b"abc\x08\x08X") == "aXc"
+
+
+def test_colours_and_titles_are_dropped():
+    assert render(b"\x1b]0;title\x07\x1b[1;31mred\x1b[0m ok") == "red ok"
+
+
+def test_split_escape_and_utf8_across_feeds():
+    screen = Screen(10, 2)
+    data = "\x1b[31mмир\x1b[0m".encode()
+    for byte in data:
+        screen.feed(bytes([byte]))
+    assert screen.render() == "мир"
+
+
+def test_alternate_screen_restores_main_and_keeps_last_frame():
+    screen = Screen(10, 3)
+    screen.feed(b"$ top\r\n\x1b[?1049h\x1b[H\x1b[2Jtop frame\x1b[?1049l")
+    assert screen.render() == "$ top"
+    assert screen.render(closed_alternate=True) == "top frame"
+
+
+def test_dirty_flag_tracks_changes():
+    screen = Screen(10, 2)
+    screen.feed(b"x")
+    assert screen.dirty
+    screen.lines()
+    assert not screen.dirty
+    screen.feed(b"y")
+    assert screen.dirty
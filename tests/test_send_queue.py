@@ -0,0 +1,66 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import telegram
+
+from send_queue import QueuedBot, SendQueue
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    """QueuedBot whose Bot API calls are recorded instead of sent"""
+    calls = []
+    ids = itertools.count(1)
+
+    def post(self, endpoint, data=None, timeout=None, api_kwargs=None):
+        calls.append((endpoint, data.get('text')))
+        return {'message_id': next(ids), 'date': 0, 'chat': {'id': data['chat_id'], 'type': 'private'},
+                'text': data.get('text')}
+
+    monkeypatch.setattr(telegram.Bot, '_post', post)
+    # Один токен на чат: все следующие запросы успевают встать в очередь
+    queue = SendQueue(chat_rate=5, chat_burst=1, global_rate=100)
+    bot = QueuedBot('123:abc', send_queue=queue)
+    bot.calls = calls
+    yield bot
+    queue.stop()
+
+
+def test_waited_messages_are_not_merged(bot):
+    bot.send_message(chat_id=1, text="first")
+    with ThreadPoolExecutor(2) as pool:
+        futures = [pool.submit(bot.send_message, chat_id=1, text=text) for text in ("a", "b")]
+        messages = [future.result(timeout=5) for future in futures]
+
+    assert messages[0].message_id != messages[1].message_id
+    assert sorted(message.text for message in messages) == ["a", "b"]
+
+
+def test_notices_are_merged(bot):
+    bot.send_message(chat_id=1, text="first")
+    futures = [bot.send_message(chat_id=1, text=text, wait=False) for text in ("a", "b")]
+    results = [future.result(timeout=5) for future in futures]
+
+    assert results[0] is results[1]
+    assert ('sendMessage', "a\n\nb") in bot.calls
+
+
+def test_notice_with_coalesce_false_stays_separate(bot):
+    bot.send_message(chat_id=1, text="first")
+    kept = bot.send_message(chat_id=1, text="a", wait=False, coalesce=False)
+    other = bot.send_message(chat_id=1, text="b", wait=False)
+
+    assert kept.result(timeout=5).text == "a"
+    assert other.result(timeout=5).text == "b"
+
+
+def test_newer_edit_replaces_queued_one(bot):
+    bot.send_message(chat_id=1, text="first")
+    old = bot.edit_message_text(chat_id=1, message_id=7, text="old", wait=False)
+    new = bot.edit_message_text(chat_id=1, message_id=7, text="new", wait=False)
+    new.result(timeout=5)
+    old.result(timeout=5)
+
+    assert ('editMessageText', "new") in bot.calls
+    assert ('editMessageText', "old") not in bot.calls
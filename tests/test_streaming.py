@@ -0,0 +1,67 @@
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import streaming
+from streaming import MessageStreamer
+
+
+class FakeBot:
+    """Records sent and edited texts in place of a QueuedBot"""
+
+    def __init__(self):
+        self.sent = []
+        self.edits = []
+        self.ids = itertools.count(1)
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+        return SimpleNamespace(message_id=next(self.ids))
+
+    def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        self.edits.append((message_id, text))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(streaming.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_fast_command_sends_nothing(clock):
+    streamer = MessageStreamer(FakeBot(), 1, interval=1.0)
+    streamer.feed("done\n")
+    assert streamer.finish() is False
+    assert streamer.bot.sent == []
+
+
+def test_edits_are_throttled(clock):
+    bot = FakeBot()
+    streamer = MessageStreamer(bot, 1, interval=1.0)
+    clock[0] = 1.0
+    streamer.feed("one\n")
+    clock[0] = 1.5
+    streamer.feed("two\n")
+    assert bot.sent == ["```\none\n```"] and bot.edits == []
+    clock[0] = 2.0
+    streamer.feed("three\n")
+    assert bot.edits == [(1, "```\none\ntwo\nthree\n```")]
+    assert streamer.finish("✅ код 0") is True
+    assert bot.edits[-1] == (1, "```\none\ntwo\nthree\n```\n✅ код 0")
+
+
+def test_long_output_continues_in_new_messages_then_keeps_tail(clock):
+    bot = FakeBot()
+    streamer = MessageStreamer(bot, 1, interval=0, max_length=20, max_messages=2)
+    lines = [f"line {number}\n" for number in range(10)]
+    for line in lines:
+        streamer.feed(line)
+    streamer.finish()
+    final = dict(enumerate(bot.sent, 1))
+    final.update(bot.edits)
+    # Первое сообщение закрыто целыми строками, последнее показывает хвост
+    assert len(final) == 2
+    assert final[1] == "```\nline 0\nline 1\n```"
+    assert final[2].startswith("```\n...\n") and final[2].endswith("line 9\n```")
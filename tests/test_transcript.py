@@ -0,0 +1,74 @@
+import pytest
+
+import transcript
+from transcript import Transcript
+
+
+@pytest.fixture
+def log(tmp_path):
+    return Transcript(str(tmp_path))
+
+
+def test_record_and_get(log):
+    assert log.record(1, 'ls -la', 'total 0\n', exit_status=0, duration=0.5, timestamp=100.0) == 1
+    assert log.record(1, 'false', '', exit_status=1) == 2
+    assert log.record(1, 'sleep 1 &', 'started') == 3
+
+    entry, output = log.get(1, 1)
+    assert (entry.number, entry.command, entry.exit_status, entry.timestamp) == (1, 'ls -la', 0, 100.0)
+    assert entry.duration == pytest.approx(0.5)
+    assert output == 'total 0\n'
+    assert log.get(1, 3)[0].exit_status is None
+    assert log.get(1, 0) is None
+    assert log.get(1, 4) is None
+
+
+def test_chats_are_separate(log):
+    log.record(1, 'uptime', 'up')
+    log.record(2, 'whoami', 'root')
+    assert [entry.command for entry in log.search(1)] == ['uptime']
+    assert log.get(2, 1)[1] == 'root'
+    assert log.search(3) == []
+
+
+def test_search_newest_first_with_limit(log):
+    for number in range(30):
+        log.record(1, f'echo {number}', str(number))
+    entries = log.search(1)
+    assert len(entries) == 20
+    assert [entry.number for entry in entries[:3]] == [30, 29, 28]
+    assert [entry.command for entry in log.search(1, '7', limit=5)] == ['echo 27', 'echo 17', 'echo 7']
+
+
+def test_search_is_case_insensitive_for_cyrillic(log):
+    log.record(1, 'grep Ошибка /var/log/syslog', '')
+    log.record(1, 'echo ПРИВЕТ', '')
+    log.record(1, 'Docker PS', '')
+    assert [entry.number for entry in log.search(1, 'ошибка')] == [1]
+    assert [entry.number for entry in log.search(1, 'Привет')] == [2]
+    assert [entry.number for entry in log.search(1, 'docker ps')] == [3]
+    # Спецсимволы в запросе ищутся буквально
+    assert log.search(1, '.*') == []
+
+
+def test_new_records_are_seen_by_another_instance(log, tmp_path):
+    log.record(1, 'first', 'one')
+    other = Transcript(str(tmp_path))
+    assert [entry.command for entry in other.search(1)] == ['first']
+    log.record(1, 'second', 'two')
+    assert [entry.command for entry in other.search(1)] == ['second', 'first']
+
+
+def test_long_output_keeps_head_and_tail(log, monkeypatch):
+    monkeypatch.setattr(transcript, 'MAX_OUTPUT', 10)
+    log.record(1, 'yes', 'a' * 5 + 'b' * 20 + 'c' * 5)
+    output = log.get(1, 1)[1]
+    assert output.startswith('aaaaa\n') and output.endswith('\nccccc')
+    assert '20 символов пропущено' in output
+
+
+def test_disabled_transcript_does_nothing():
+    log = Transcript('')
+    assert log.record(1, 'ls', 'out') is None
+    assert log.search(1) == []
+    assert log.get(1, 1) is None
@@ -0,0 +1,181 @@
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from threading import Lock
+
+from config import env_int
+
+# Каталог с журналами команд по чатам; пустое значение отключает запись
+TRANSCRIPT_DIR = os.getenv('TRANSCRIPT_DIR', 'transcripts')
+# Сколько символов вывода одной команды сохранять (начало и конец)
+MAX_OUTPUT = env_int('TRANSCRIPT_MAX_OUTPUT', 1024 * 1024)
+MAX_COMMAND_BYTES = 1000
+
+# Запись индекса: время, длительность, код завершения (-1 - неизвестен),
+# смещение и длина сжатого блока в .log, длина вывода, длина команды; за ней команда
+RECORD = struct.Struct('<dfiQIIH')
+NO_EXIT_STATUS = -1
+
+Entry = namedtuple('Entry', ['number', 'timestamp', 'duration', 'exit_status', 'command', 'offset', 'length', 'size'])
+
+
+def _caseless_pattern(text):
+    """Bytes regex matching text in UTF-8 in any letter case.
+
+    re.IGNORECASE on bytes folds only ASCII, so every character becomes an
+    alternation of the encodings of its lower and upper case forms.
+    """
+    parts = []
+    for char in text:
+        variants = {char, char.lower(), char.upper(), char.lower().upper(), char.upper().lower()}
+        encoded = sorted(re.escape(variant.encode('utf-8')) for variant in variants if len(variant) == 1)
+        parts.append(encoded[0] if len(encoded) == 1 else b'(?:' + b'|'.join(encoded) + b')')
+    return re.compile(b''.join(parts))
+
+
+class _ChatIndex:
+    """Offsets of the index records of one chat, read incrementally"""
+
+    def __init__(self):
+        self.offsets = array('Q')
+        self.scanned = 0
+
+
+class Transcript:
+    """Append-only per-chat log of commands and their output.
+
+    Each output is a separate zlib block appended to <chat>.log; <chat>.idx
+    holds small fixed-header records with the command, timing and block
+    position. History search runs a regex over the memory-mapped index
+    and only the block of a requested entry is ever decompressed.
+    """
+
+    def __init__(self, directory=TRANSCRIPT_DIR):
+        self.directory = directory
+        self.indexes = {}
+        self.lock = Lock()
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _path(self, chat_id, extension):
+        return os.path.join(self.directory, f"{chat_id}.{extension}")
+
+    def record(self, chat_id, command, output, exit_status=None, duration=0.0, timestamp=None):
+        """Append a command with its output; returns its number or None"""
+        if not self.enabled:
+            return None
+        if len(output) > MAX_OUTPUT:
+            half = MAX_OUTPUT // 2
+            output = f"{output[:half]}\n... [{len(output) - MAX_OUTPUT} символов пропущено] ...\n{output[-half:]}"
+        raw = output.encode('utf-8', errors='replace')
+        block = zlib.compress(raw, 6)
+        command_bytes = command.encode('utf-8', errors='replace')[:MAX_COMMAND_BYTES]
+
+        try:
+            with self.lock:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(self._path(chat_id, 'log'), 'ab') as log:
+                    offset = log.tell()
+                    log.write(block)
+                # Индекс пишется после данных: оборванная запись оставит
+                # в .log лишний блок, но не ссылку в никуда
+                with open(self._path(chat_id, 'idx'), 'ab') as index:
+                    index.write(RECORD.pack(
+                        timestamp or time.time(), duration,
+                        NO_EXIT_STATUS if exit_status is None else exit_status,
+                        offset, len(block), len(raw), len(command_bytes)
+                    ) + command_bytes)
+                return len(self._refresh(chat_id).offsets)
+        except OSError as e:
+            self.logger.error(f"Could not write transcript for chat {chat_id}: {str(e)}")
+            return None
+
+    def _refresh(self, chat_id):
+        """Index offsets of chat_id, extended with records added since the last call"""
+        index = self.indexes.setdefault(chat_id, _ChatIndex())
+        path = self._path(chat_id, 'idx')
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size <= index.scanned:
+            return index
+
+        with open(path, 'rb') as file:
+            file.seek(index.scanned)
+            data = file.read(size - index.scanned)
+        position = 0
+        while position + RECORD.size <= len(data):
+            command_length = RECORD.unpack_from(data, position)[-1]
+            end = position + RECORD.size + command_length
+            if end > len(data):
+                # Недописанная запись в конце - дочитаем в следующий раз
+                break
+            index.offsets.append(index.scanned + position)
+            position = end
+        index.scanned += position
+        return index
+
+    @staticmethod
+    def _entry(data, offset, number):
+        timestamp, duration, exit_status, block_offset, length, size, command_length = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        command = bytes(data[start:start + command_length]).decode('utf-8', errors='replace')
+        return Entry(
+            number, timestamp, duration, None if exit_status == NO_EXIT_STATUS else exit_status,
+            command, block_offset, length, size
+        )
+
+    def search(self, chat_id, pattern=None, limit=20):
+        """Newest entries whose command contains pattern (case-insensitive)"""
+        if not self.enabled:
+            return []
+        with self.lock:
+            offsets = self._refresh(chat_id).offsets
+            if not offsets:
+                return []
+            with open(self._path(chat_id, 'idx'), 'rb') as file, \
+                    mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if pattern:
+                    # Поиск идет по всему индексу без разбора записей; совпадения
+                    # в двоичных заголовках отсеиваются проверкой самой команды
+                    regex = _caseless_pattern(pattern)
+                    numbers = sorted(
+                        {bisect_right(offsets, match.start()) - 1 for match in regex.finditer(data)}, reverse=True
+                    )
+                else:
+                    numbers = range(len(offsets) - 1, -1, -1)
+
+                entries = []
+                for number in numbers:
+                    entry = self._entry(data, offsets[number], number + 1)
+                    if pattern and pattern.lower() not in entry.command.lower():
+                        continue
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        break
+                return entries
+
+    def get(self, chat_id, number):
+        """(Entry, output) of entry number, or None"""
+        if not self.enabled:
+            return None
+        with self.lock:
+            offsets = self._refresh(chat_id).offsets
+            if not 1 <= number <= len(offsets):
+                return None
+            with open(self._path(chat_id, 'idx'), 'rb') as file:
+                file.seek(offsets[number - 1])
+                header = file.read(RECORD.size + MAX_COMMAND_BYTES)
+            entry = self._entry(header, 0, number)
+            with open(self._path(chat_id, 'log'), 'rb') as log:
+                log.seek(entry.offset)
+                block = log.read(entry.length)
+        return entry, zlib.decompress(block).decode('utf-8', errors='replace')
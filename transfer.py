@@ -0,0 +1,162 @@
+import gzip
+import io
+import posixpath
+import stat
+import time
+from tempfile import SpooledTemporaryFile
+
+from delivery import SPOOL_MAX_SIZE, format_size
+
+# Telegram принимает от бота документы до 50 МБ и отдает боту файлы до 20 МБ
+UPLOAD_LIMIT = 50 * 1024 * 1024
+DOWNLOAD_LIMIT = 20 * 1024 * 1024
+# Файл больше UPLOAD_LIMIT уходит частями с запасом на multipart-заголовки
+PART_SIZE = 49 * 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+# Запросы на чтение отправляются пачкой на столько байт вперед: скорость
+# не упирается в RTT, а память ограничена размером окна
+PREFETCH_WINDOW = 16 * 1024 * 1024
+PROGRESS_INTERVAL = 2
+# /get сжимает файлы крупнее этого размера, если они еще не сжаты
+COMPRESS_MIN_SIZE = 64 * 1024
+COMPRESSED_EXTENSIONS = {
+    '.gz', '.tgz', '.zip', '.xz', '.bz2', '.zst', '.7z', '.rar',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.mkv', '.ogg', '.pdf',
+}
+
+
+def resolve_path(path, cwd=None):
+    """SFTP path: "~/..." is relative to home, other relative paths to cwd"""
+    if path in ('~', '~/'):
+        return '.'
+    if path.startswith('~/'):
+        return path[2:]
+    if cwd and not path.startswith('/'):
+        return posixpath.join(cwd, path)
+    return path
+
+
+def should_compress(path, size):
+    return size >= COMPRESS_MIN_SIZE and posixpath.splitext(path)[1].lower() not in COMPRESSED_EXTENSIONS
+
+
+class TransferProgress:
+    """Progress callback (done, total) that calls report(text) at most every interval seconds"""
+
+    def __init__(self, report, label, interval=PROGRESS_INTERVAL):
+        self.report = report
+        self.label = label
+        self.interval = interval
+        self.started = time.monotonic()
+        self.reported = self.started
+
+    def __call__(self, done, total):
+        now = time.monotonic()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            self.report(self.describe(done, total))
+
+    def describe(self, done, total):
+        elapsed = max(time.monotonic() - self.started, 0.001)
+        percent = f" ({100 * done / total:.0f}%)" if total else ""
+        return f"{self.label}: {format_size(done)} из {format_size(total)}{percent}, {format_size(done / elapsed)}/с"
+
+
+def _read_pipelined(remote, size):
+    """Yield the file contents, keeping a window of read requests in flight"""
+    for window_start in range(0, size, PREFETCH_WINDOW):
+        window_end = min(window_start + PREFETCH_WINDOW, size)
+        chunks = [
+            (offset, min(READ_CHUNK_SIZE, window_end - offset))
+            for offset in range(window_start, window_end, READ_CHUNK_SIZE)
+        ]
+        yield from remote.readv(chunks)
+    # Файл мог вырасти после stat (например, лог) - дочитываем остаток
+    remote.seek(size)
+    while True:
+        data = remote.read(READ_CHUNK_SIZE)
+        if not data:
+            return
+        yield data
+
+
+def download(sftp, path, compress=None, progress=None):
+    """Copy a remote file into a temporary file, gzip-compressed if compress.
+
+    compress=None compresses files that are large and not compressed yet.
+    Returns (fileobj, size, filename); the temporary file spills to disk
+    past SPOOL_MAX_SIZE. Raises IOError if the file cannot be read.
+    """
+    attributes = sftp.stat(path)
+    if stat.S_ISDIR(attributes.st_mode):
+        raise IsADirectoryError(f"{path} is a directory")
+    total = attributes.st_size
+    filename = posixpath.basename(path.rstrip('/')) or 'file'
+    if compress is None:
+        compress = should_compress(path, total)
+
+    spool = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    target = gzip.GzipFile(filename=filename, fileobj=spool, mode='wb', compresslevel=6) if compress else spool
+    done = 0
+    with sftp.open(path, 'rb') as remote:
+        for data in _read_pipelined(remote, total):
+            target.write(data)
+            done += len(data)
+            if progress:
+                progress(done, max(total, done))
+    if compress:
+        target.close()
+        filename += '.gz'
+
+    size = spool.tell()
+    spool.seek(0)
+    return spool, size, filename
+
+
+def send_file(bot, chat_id, fileobj, size, filename, caption=None):
+    """Send a file as one document, or as PART_SIZE parts if Telegram would reject it"""
+    if size <= UPLOAD_LIMIT:
+        bot.send_document(chat_id=chat_id, document=fileobj, filename=filename, caption=caption)
+        return
+
+    parts = (size + PART_SIZE - 1) // PART_SIZE
+    for number in range(1, parts + 1):
+        # InputFile все равно читает документ в память целиком, так что часть
+        # читаем сразу, но не больше одной за раз
+        part = io.BytesIO(fileobj.read(PART_SIZE))
+        part_caption = f"Часть {number} из {parts}"
+        if number == 1:
+            part_caption += f". Собрать: cat {filename}.part* > {filename}"
+        bot.send_document(
+            chat_id=chat_id, document=part, filename=f"{filename}.part{number:02d}", caption=part_caption
+        )
+
+
+def upload(sftp, fileobj, size, path, filename, progress=None):
+    """Write fileobj to path (a directory gets filename appended) and return the final path.
+
+    Data goes to a temporary name first, so an interrupted upload never
+    leaves a truncated target. Raises IOError on SFTP errors.
+    """
+    if path.endswith('/'):
+        path = posixpath.join(path, filename)
+    else:
+        try:
+            if stat.S_ISDIR(sftp.stat(path).st_mode):
+                path = posixpath.join(path, filename)
+        except IOError:
+            pass
+
+    partial = f"{path}.part"
+    # putfo включает конвейерную запись: пакеты не ждут подтверждения каждого
+    sftp.putfo(fileobj, partial, file_size=size, callback=progress)
+    try:
+        sftp.posix_rename(partial, path)
+    except IOError:
+        # Сервер без расширения posix-rename: обычный rename не заменяет файл
+        try:
+            sftp.remove(path)
+        except IOError:
+            pass
+        sftp.rename(partial, path)
+    return path